@@ -4,32 +4,96 @@
 包含检索、生成、对话管理和置信度评估四个核心模块
 """
 
+import re
 from agentscope.agents import AgentBase
-import ollama
-from typing import List, Dict, Any, Union
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Union, AsyncIterator, Tuple
 from config import Config  # 配置文件
 from agentscope.message import Msg
+from session_store import SessionStore
+from reranker import BaseReranker, create_reranker
+from chunker import format_citation
+from context_builder import ContextBuilder, get_context_builder
+from lexical_index import tokenize
+from llm_client import get_llm_client
+from metrics import stage, timed
+from qa_router import QARouter
+
+
+class ThinkTagFilter:
+    """流式过滤 <think>...</think> 推理块，标签可能被拆分在多个片段中"""
+
+    OPEN_TAG = "<think>"
+    CLOSE_TAG = "</think>"
+
+    def __init__(self):
+        self.buffer = ""
+        self.in_think = False
+
+    def feed(self, chunk: str) -> str:
+        """
+        输入一个生成片段，返回可以立即输出的文本
+
+        末尾可能是标签前缀的部分会暂存到下一个片段再判断
+        """
+        self.buffer += chunk
+        output = []
+        while self.buffer:
+            tag = self.CLOSE_TAG if self.in_think else self.OPEN_TAG
+            pos = self.buffer.find(tag)
+            if pos >= 0:
+                if not self.in_think:
+                    output.append(self.buffer[:pos])
+                self.buffer = self.buffer[pos + len(tag):]
+                self.in_think = not self.in_think
+                continue
+
+            # 保留可能构成标签开头的尾部
+            keep = 0
+            for size in range(min(len(tag) - 1, len(self.buffer)), 0, -1):
+                if tag.startswith(self.buffer[-size:]):
+                    keep = size
+                    break
+            if not self.in_think:
+                output.append(self.buffer[:len(self.buffer) - keep])
+            self.buffer = self.buffer[len(self.buffer) - keep:]
+            break
+        return "".join(output)
+
+    def flush(self) -> str:
+        """生成结束时输出暂存的剩余文本"""
+        rest = "" if self.in_think else self.buffer
+        self.buffer = ""
+        return rest
 
 
 class RetrievalAgent(AgentBase):
     """文档检索代理，负责从向量库中检索相关信息"""
 
-    def __init__(self, vector_store: Any):
+    def __init__(self, vector_store: Any, reranker: BaseReranker = None,
+                 context_builder: ContextBuilder = None):
         """
         初始化检索代理
 
         参数:
             vector_store: 向量数据库实例，需实现search方法
+            reranker: 重排序器，默认按 Config.RERANK_ENABLED 创建，未开启时为 None
+            context_builder: 上下文组装器，默认按 Config.CONTEXT_TOKEN_BUDGET 创建
         """
         super().__init__("retrieval_agent")
         self.vector_store = vector_store  # 向量数据库实例
+        self.reranker = reranker if reranker is not None else create_reranker()
+        self.context_builder = context_builder or get_context_builder()
+        # 开启重排序时多取候选，由重排序器挑出前 N 条
+        self.top_k = Config.RERANK_CANDIDATES if self.reranker is not None else 10
 
-    def reply(self, msg: Dict) -> Dict:
+    def reply(self, msg: Dict, filters: Dict[str, Any] = None) -> Dict:
         """
         执行语义检索并返回相关文档
 
         参数:
             msg: 输入消息，需包含文本内容
+            filters: 元数据过滤条件（公司、股票代码、报告年份等），为空时检索全部文档
 
         返回:
             包含检索结果的字典，包含上下文和原始文档信息
@@ -40,26 +104,91 @@ class RetrievalAgent(AgentBase):
         # 执行向量数据库检索
         results = self.vector_store.search(
             query=query,
-            k=10  # 返回前10个最相关结果
+            k=self.top_k,  # 未开启重排序时返回前10个最相关结果
+            filters=filters
         )
+        results = self._filter(results)
+        rerank_stats = None
+        if self.reranker is not None:
+            with stage("rerank"):
+                reranked = self.reranker.rerank(query, results)
+            results, rerank_stats = reranked["results"], reranked["stats"]
+        return self._build_reply(query, results, rerank_stats)
+
+    async def reply_async(self, msg: Msg, filters: Dict[str, Any] = None) -> Dict:
+        """reply 的异步版本"""
+        query = msg.get_text_content()
+        results = await self.vector_store.search_async(query=query, k=self.top_k, filters=filters)
+        results = self._filter(results)
+        rerank_stats = None
+        if self.reranker is not None:
+            with stage("rerank"):
+                reranked = await self.reranker.rerank_async(query, results)
+            results, rerank_stats = reranked["results"], reranked["stats"]
+        return self._build_reply(query, results, rerank_stats)
+
+    def reply_batch(self, queries: List[str], filters: Dict[str, Any] = None,
+                    priority: str = "interactive") -> List[Dict]:
+        """
+        批量检索：所有问题一次批量嵌入、一次矩阵检索，重排序按问题并行
+
+        参数:
+            queries: 问题列表
+            filters: 元数据过滤条件，对所有问题生效
+            priority: 查询嵌入与重排序请求的优先级
+
+        返回:
+            与 queries 顺序一致的检索结果，每项格式与 reply 相同
+        """
+        batch_results = [
+            self._filter(results)
+            for results in self.vector_store.search_batch(queries, k=self.top_k, filters=filters, priority=priority)
+        ]
+        if self.reranker is None:
+            return [self._build_reply(query, results) for query, results in zip(queries, batch_results)]
 
-        # 构建可读的上下文字符串
-        context_parts = []
-        for i, res in enumerate(results):
-            source = res['metadata'].get('source', '未知来源')
-            content = res['content']
-            context_parts.append(f"来源 {i + 1} ({source}):\n{content}...")
+        with ThreadPoolExecutor(max_workers=Config.RERANK_MAX_WORKERS) as executor:
+            reranked = list(executor.map(
+                lambda query, results: self.reranker.rerank(query, results, priority=priority), queries, batch_results
+            ))
+        return [
+            self._build_reply(query, item["results"], item["stats"])
+            for query, item in zip(queries, reranked)
+        ]
 
-        context = "\n\n".join(context_parts)
+    @staticmethod
+    def _filter(results: List[Dict]) -> List[Dict]:
+        """过滤相似度过低的结果（l2 度量下或仅由 BM25 命中的结果没有 score，不做过滤）"""
+        return [
+            res for res in results
+            if res.get("score") is None or res["score"] >= Config.RETRIEVAL_MIN_SCORE
+        ]
+
+    def _build_reply(self, query: str, results: List[Dict], rerank_stats: Dict = None) -> Dict:
+        """
+        构建上下文
+
+        参数:
+            query: 查询文本
+            results: 过滤（及重排序）后的检索结果
+            rerank_stats: 重排序统计，未开启重排序时为 None
+
+        返回:
+            包含上下文和原始文档信息的字典
+        """
+        # 去重、合并相邻分块并按 token 预算截取
+        packed = self.context_builder.build(results)
 
         # 返回结构化结果
         return {
             "role": "system",
             "name": self.name,
-            "content": context,
-            "context": results,  # 保留原始文档信息用于溯源
+            "content": packed["content"],
+            "context": packed["context"],  # 实际进入提示词的原始文档信息，用于溯源
             "type": "retrieval",
             "query": query,  # 保留原始查询
+            "rerank": rerank_stats,
+            "context_stats": packed["stats"],
         }
 
 
@@ -75,13 +204,13 @@ class GenerationAgent(AgentBase):
         """
         super().__init__("generation_agent")
         self.model_name = model_name
-        self.client = ollama.Client(host=Config.OLLAMA_HOST)
+        self.llm = get_llm_client()
 
         # 系统提示词 - 定义回答格式和要求
         self.system_prompt = """
         作为金融分析师，请根据提供的上下文回答问题：
         1. 确保答案准确专业
-        2. 标注信息来源
+        2. 标注信息来源，使用上下文中括号内的来源标注（如 xxx.pdf p.12），多个来源用逗号分隔
         3. 评估答案置信度
         4. 保持回答简洁
 
@@ -91,19 +220,21 @@ class GenerationAgent(AgentBase):
         [置信度]: <高/中/低>
         """
 
-    def format_prompt(self, context: str, question: str) -> List[Dict]:
+    def format_prompt(self, context: str, question: str, history: List[Dict] = None) -> List[Dict]:
         """
         构建LLM提示消息
 
         参数:
             context: 检索得到的上下文
             question: 用户问题
+            history: 同一会话的最近对话历史
 
         返回:
             格式化后的消息列表
         """
         return [
             {"role": "system", "content": self.system_prompt},
+            *(history or []),
             {"role": "user", "content": f"上下文:\n{context}\n\n问题: {question}"}
         ]
 
@@ -146,23 +277,25 @@ class GenerationAgent(AgentBase):
             source_text = response.split("[来源]:")[1]
             # 取第一个换行符前的内容
             source_line = source_text.split("\n")[0].strip()
-            sources = [s.strip() for s in source_line.split(",")]
+            sources = [s.strip() for s in re.split(r"[,，、]", source_line)]
 
-        # 获取上下文中所有有效来源
-        context_sources = [res['metadata'].get('source', '') for res in context]
+        # 获取上下文中所有有效来源，PDF 分块带页码（file.pdf p.45）
+        context_sources = {res['metadata'].get('source', '') for res in context}
+        citations = list(dict.fromkeys(format_citation(res['metadata']) for res in context))
 
-        # 验证来源是否在上下文中存在
+        # 验证来源是否在上下文中存在（页码可能是合并后的范围，只校验文件名）
         valid_sources = [
             src for src in sources
-            if src and src in context_sources
+            if src and src.split(" p.")[0] in context_sources
         ]
 
-        # 如果没有有效来源，使用上下文中的前三个来源
-        if not valid_sources and context_sources:
-            valid_sources = list(set(context_sources))[:10]
+        # 如果没有有效来源，使用上下文中的来源
+        if not valid_sources and citations:
+            valid_sources = citations[:10]
 
         return valid_sources
 
+    @timed("generation")
     def reply(self, msg: Dict) -> Dict:
         """
         基于检索结果生成回答
@@ -173,28 +306,97 @@ class GenerationAgent(AgentBase):
         返回:
             生成的回答消息
         """
-        # 提取检索结果
-        context = msg.get("content", "")
-        context_data = msg.get("context", [])
-        question = msg.get("query", "")
-
-        # 构建提示
-        messages = self.format_prompt(context, question)
+        # 提取检索结果并构建提示
+        messages = self.format_prompt(msg.get("content", ""), msg.get("query", ""), msg.get("history"))
 
         # 调用模型API生成回答
         try:
-            response = self.client.chat(
+            response = self.llm.chat(
+                msg.get("priority", "interactive"),
+                model=self.model_name,
+                messages=messages,
+                options=self.chat_options()
+            )
+            content = response["message"]["content"]
+        except Exception as e:
+            content = f"生成回答时出错: {str(e)}"
+
+        return self._build_reply(content, msg.get("context", []))
+
+    @timed("generation")
+    async def reply_async(self, msg: Dict) -> Dict:
+        """reply 的异步版本，等待模型生成时不阻塞事件循环"""
+        messages = self.format_prompt(msg.get("content", ""), msg.get("query", ""), msg.get("history"))
+
+        try:
+            response = await self.llm.chat_async(
+                msg.get("priority", "interactive"),
                 model=self.model_name,
                 messages=messages,
-                options={
-                    "num_predict": Config.MAX_TOKEN,  # 减少token数量
-                    "temperature": 0.3
-                }
+                options=self.chat_options()
             )
             content = response["message"]["content"]
         except Exception as e:
             content = f"生成回答时出错: {str(e)}"
 
+        return self._build_reply(content, msg.get("context", []))
+
+    @timed("generation")
+    async def stream_reply_async(self, msg: Dict) -> AsyncIterator[Tuple[str, Any]]:
+        """
+        流式生成回答，实时过滤 <think> 推理块
+
+        参数:
+            msg: 包含检索结果的消息
+
+        产出:
+            ("token", 文本片段)，最后产出 ("answer", 与 reply 相同结构的回答消息)
+        """
+        messages = self.format_prompt(msg.get("content", ""), msg.get("query", ""), msg.get("history"))
+        think_filter = ThinkTagFilter()
+        parts = []
+        try:
+            stream = self.llm.chat_stream_async(
+                msg.get("priority", "interactive"),
+                model=self.model_name,
+                messages=messages,
+                options=self.chat_options()
+            )
+            async for chunk in stream:
+                text = think_filter.feed(chunk["message"]["content"])
+                if text:
+                    parts.append(text)
+                    yield "token", text
+            text = think_filter.flush()
+            if text:
+                parts.append(text)
+                yield "token", text
+            content = "".join(parts).strip()
+        except Exception as e:
+            content = f"生成回答时出错: {str(e)}"
+            yield "token", content
+
+        yield "answer", self._build_reply(content, msg.get("context", []))
+
+    @staticmethod
+    def chat_options() -> Dict:
+        """生成参数"""
+        return {
+            "num_predict": Config.MAX_TOKEN,  # 减少token数量
+            "temperature": 0.3
+        }
+
+    def _build_reply(self, content: str, context_data: List) -> Dict:
+        """
+        规范回答格式并提取结构化信息
+
+        参数:
+            content: 模型生成的原始回答
+            context_data: 检索得到的原始文档列表
+
+        返回:
+            生成的回答消息
+        """
         # 确保回答格式正确
         if "[分析]:" not in content:
             content = f"[分析]: {content}"
@@ -217,50 +419,153 @@ class GenerationAgent(AgentBase):
 class DialogueManager(AgentBase):
     """对话管理代理，协调检索和生成流程"""
 
-    def __init__(self, retrieval_agent: RetrievalAgent, generation_agent: GenerationAgent):
+    def __init__(self, retrieval_agent: RetrievalAgent, generation_agent: GenerationAgent,
+                 session_store: SessionStore = None, router: QARouter = None):
         """
         初始化对话管理器
 
         参数:
             retrieval_agent: 检索代理实例
             generation_agent: 生成代理实例
+            session_store: 会话存储，按 session_id 隔离对话历史
+            router: 问答库路由，命中时直接返回官方回答；为空时所有问题都经过检索与生成
         """
         super().__init__("dialogue_manager")
         self.retrieval_agent = retrieval_agent
         self.generation_agent = generation_agent
-        self.history = []  # 对话历史记录
+        self.session_store = session_store or SessionStore()
+        self.router = router
 
-    def reply(self, msg: Union[Dict, Msg]) -> Dict:
+    def reply(self, msg: Union[Dict, Msg], session_id: str = None, filters: Dict[str, Any] = None) -> Dict:
         """
         处理用户输入，协调检索和生成流程
 
         参数:
             msg: 用户输入消息
+            session_id: 会话标识，为空时不读写对话历史
+            filters: 检索的元数据过滤条件
 
         返回:
             系统生成的回答
         """
-        # 更新对话历史
-        self.history.append(msg)
+        # 问答库直接命中时不再检索与生成
+        if self._routable(session_id):
+            hit = self.router.match(msg.get_text_content(), filters)
+            if hit is not None:
+                return self._routed_reply(msg, hit, session_id)
 
         # 执行检索
-        retrieval_result = self.retrieval_agent(msg)
+        retrieval_result = self.retrieval_agent(msg, filters=filters)
+
+        # 生成回答
+        response = self.generation_agent(self._generation_msg(msg, retrieval_result, session_id))
+        response["context_stats"] = self._context_stats(retrieval_result)
+
+        # 更新历史
+        self._remember(session_id, msg, response)
+
+        return response
+
+    async def reply_async(self, msg: Msg, session_id: str = None, filters: Dict[str, Any] = None) -> Dict:
+        """reply 的异步版本"""
+        if self._routable(session_id):
+            hit = await self.router.match_async(msg.get_text_content(), filters)
+            if hit is not None:
+                return self._routed_reply(msg, hit, session_id)
+
+        retrieval_result = await self.retrieval_agent.reply_async(msg, filters=filters)
+
+        response = await self.generation_agent.reply_async(
+            self._generation_msg(msg, retrieval_result, session_id)
+        )
+        response["context_stats"] = self._context_stats(retrieval_result)
+
+        self._remember(session_id, msg, response)
+
+        return response
+
+    async def stream_reply_async(self, msg: Msg, session_id: str = None,
+                                 filters: Dict[str, Any] = None) -> AsyncIterator[Tuple[str, Any]]:
+        """
+        流式处理用户输入
+
+        产出:
+            ("retrieval", 检索结果)、若干 ("token", 文本片段)，最后 ("answer", 回答消息)；
+            问答库直接命中时整段回答作为一个 token 产出
+        """
+        if self._routable(session_id):
+            hit = await self.router.match_async(msg.get_text_content(), filters)
+            if hit is not None:
+                response = self._routed_reply(msg, hit, session_id)
+                yield "retrieval", {"context": response["context"], "context_stats": response["context_stats"]}
+                yield "token", response["content"]
+                yield "answer", response
+                return
+
+        retrieval_result = await self.retrieval_agent.reply_async(msg, filters=filters)
+        yield "retrieval", retrieval_result
+
+        generation_msg = self._generation_msg(msg, retrieval_result, session_id)
+        async for event, data in self.generation_agent.stream_reply_async(generation_msg):
+            if event == "answer":
+                data["context_stats"] = self._context_stats(retrieval_result)
+                self._remember(session_id, msg, data)
+            yield event, data
+
+    def _routable(self, session_id: str = None) -> bool:
+        """会话已有历史时问题可能依赖上下文（如追问），不走问答库路由"""
+        if self.router is None:
+            return False
+        return not (session_id and self.session_store.get_history(session_id))
+
+    def _routed_reply(self, msg: Msg, hit: Dict, session_id: str = None) -> Dict:
+        """由问答库命中的条目构建回答，格式与生成代理的回答一致"""
+        source = hit["metadata"].get("source", "未知来源")
+        response = {
+            "role": "assistant",
+            "name": self.name,
+            "content": f"[分析]: {hit['answer']}\n[来源]: {source}\n[置信度]: 高",
+            "confidence": "高",
+            "sources": [source],
+            "context": [hit],
+            "route": "qa_bank",
+            "context_stats": {"route": "qa_bank", "matched_question": hit["question"],
+                              "similarity": round(hit["score"], 4)}
+        }
+        self._remember(session_id, msg, response)
+        return response
 
-        # 准备生成请求
-        generation_msg = {
+    def _generation_msg(self, msg: Msg, retrieval_result: Dict, session_id: str = None) -> Dict:
+        """准备生成请求，附带该会话的最近对话历史"""
+        return {
             "content": retrieval_result["content"],
             "context": retrieval_result.get("context", []),
             "query": msg.get_text_content(),  # 原始问题
-            "history": self.history[-5:]  # 最近5条历史记录
+            "history": self.session_store.get_history(session_id) if session_id else []
         }
 
-        # 生成回答
-        response = self.generation_agent(generation_msg)
+    @staticmethod
+    def _context_stats(retrieval_result: Dict) -> Dict:
+        """本次请求的上下文组装统计（开启重排序时附带重排序统计）"""
+        stats = dict(retrieval_result.get("context_stats") or {})
+        if retrieval_result.get("rerank"):
+            stats["rerank"] = retrieval_result["rerank"]
+        return stats
+
+    def _remember(self, session_id: str, msg: Msg, response: Dict):
+        """将本轮问答写入会话历史"""
+        if not session_id:
+            return
+        self.session_store.append(
+            session_id,
+            {"role": "user", "content": msg.get_text_content()},
+            {"role": "assistant", "content": response["content"]}
+        )
 
-        # 更新历史
-        self.history.append(response)
 
-        return response
+EVALUATION_MODES = ("llm", "heuristic", "background")
+# 问答库直接命中的官方回答不需要评估
+ROUTED_EVALUATION = "[逻辑一致性]: 高\n[来源可靠性]: 高\n[综合置信度]: 高\n（问答库直接命中，回答为官方答复原文）"
 
 
 class ConfidenceEvaluator(AgentBase):
@@ -274,10 +579,10 @@ class ConfidenceEvaluator(AgentBase):
             model_name: 评估使用的模型名称
         """
         super().__init__("confidence_evaluator")
-        self.client = ollama.Client(host=Config.OLLAMA_HOST)
+        self.llm = get_llm_client()
         self.model_name = model_name
 
-    def evaluate_confidence(self, question: str, answer: str, context: List) -> str:
+    def evaluate_confidence(self, question: str, answer: str, context: List, priority: str = "evaluation") -> str:
         """
         评估回答的质量和置信度
 
@@ -285,10 +590,49 @@ class ConfidenceEvaluator(AgentBase):
             question: 原始问题
             answer: 生成的回答
             context: 检索得到的原始文档
+            priority: 请求优先级
 
         返回:
             评估结果文本
         """
+        # 调用模型进行评估
+        try:
+            response = self.llm.chat(
+                priority,
+                model=self.model_name,
+                messages=[{"role": "user", "content": self.format_prompt(question, answer, context)}],
+                options={"temperature": 0.1, "num_predict": 512}
+            )
+            return response["message"]["content"]
+        except Exception as e:
+            return f"评估失败: {str(e)}"
+
+    async def evaluate_confidence_async(self, question: str, answer: str, context: List,
+                                        priority: str = "evaluation") -> str:
+        """evaluate_confidence 的异步版本"""
+        try:
+            response = await self.llm.chat_async(
+                priority,
+                model=self.model_name,
+                messages=[{"role": "user", "content": self.format_prompt(question, answer, context)}],
+                options={"temperature": 0.1, "num_predict": 512}
+            )
+            return response["message"]["content"]
+        except Exception as e:
+            return f"评估失败: {str(e)}"
+
+    def format_prompt(self, question: str, answer: str, context: List) -> str:
+        """
+        构建评估提示
+
+        参数:
+            question: 原始问题
+            answer: 生成的回答
+            context: 检索得到的原始文档
+
+        返回:
+            评估提示文本
+        """
         # 提取来源信息
         sources = {res['metadata'].get('source', '未知') for res in context}
 
@@ -310,17 +654,7 @@ class ConfidenceEvaluator(AgentBase):
         [来源可靠性]: <高/中/低>
         [综合置信度]: <高/中/低>
         """
-
-        # 调用模型进行评估
-        try:
-            response = self.client.chat(
-                model=self.model_name,
-                messages=[{"role": "user", "content": prompt}],
-                options={"temperature": 0.1, "num_predict": 512}
-            )
-            return response["message"]["content"]
-        except Exception as e:
-            return f"评估失败: {str(e)}"
+        return prompt
 
     def extract_confidence_level(self, evaluation: str) -> str:
         """
@@ -343,24 +677,97 @@ class ConfidenceEvaluator(AgentBase):
 
         return confidence
 
-    def reply(self, msg: Dict) -> Dict:
+    @staticmethod
+    def resolve_mode(mode: str = None) -> str:
+        """校验评估模式，默认为 Config.EVALUATION_MODE"""
+        mode = mode or Config.EVALUATION_MODE
+        if mode not in EVALUATION_MODES:
+            raise ValueError(f"不支持的评估模式: {mode}，可选: {', '.join(EVALUATION_MODES)}")
+        return mode
+
+    @staticmethod
+    def _level(value: float) -> str:
+        medium, high = Config.EVALUATION_HEURISTIC_THRESHOLDS
+        return "高" if value >= high else "中" if value >= medium else "低"
+
+    def heuristic_evaluate(self, answer: str, context: List) -> str:
+        """
+        不调用模型的启发式评估
+
+        依据三项指标（均在 0-1 之间）：
+        1. 检索得分：进入提示词的前 3 条结果的平均 cosine 相似度（无相似度时不计入）
+        2. 来源引用：回答 [来源] 中是否引用了上下文中的来源
+        3. 内容重合：回答中的词在检索上下文中出现的比例
+
+        返回:
+            与模型评估格式相同的评估文本
+        """
+        if not context:
+            return "[逻辑一致性]: 低\n[来源可靠性]: 低\n[综合置信度]: 低\n（启发式评估: 没有检索到相关资料）"
+
+        scores = [res["score"] for res in context if res.get("score") is not None][:3]
+        retrieval = max(0.0, sum(scores) / len(scores)) if scores else None
+
+        cited_text = answer.split("[来源]:", 1)[1].split("[置信度]:", 1)[0] if "[来源]:" in answer else ""
+        sources = {res["metadata"].get("source", "") for res in context}
+        citation = 1.0 if any(source and source in cited_text for source in sources) else 0.0
+
+        body = answer.split("[来源]:", 1)[0].replace("[分析]:", "")
+        answer_tokens = set(tokenize(body))
+        context_tokens = set()
+        for res in context:
+            context_tokens.update(tokenize(res["content"]))
+        overlap = len(answer_tokens & context_tokens) / len(answer_tokens) if answer_tokens else 0.0
+
+        reliability = citation if retrieval is None else (retrieval + citation) / 2
+        overall = overlap * 0.4 + reliability * 0.6
+        retrieval_text = "无" if retrieval is None else f"{retrieval:.2f}"
+        return (f"[逻辑一致性]: {self._level(overlap)}\n"
+                f"[来源可靠性]: {self._level(reliability)}\n"
+                f"[综合置信度]: {self._level(overall)}\n"
+                f"（启发式评估: 检索得分 {retrieval_text}，来源引用 {citation:.0f}，内容重合 {overlap:.2f}）")
+
+    @timed("evaluation")
+    def reply(self, msg: Dict, mode: str = None) -> Dict:
         """
         执行置信度评估
 
         参数:
-            msg: 包含问题和回答的消息
+            msg: 包含问题和回答的消息，带 route 字段（问答库直接命中）时不评估
+            mode: 评估模式，heuristic 时不调用模型；默认为 Config.EVALUATION_MODE
 
         返回:
             包含评估结果的消息
         """
+        if msg.get("route"):
+            return self._update_msg(msg, ROUTED_EVALUATION)
+
         # 提取评估所需信息
         question = msg.get("query", "")
         answer = msg.get("content", "")
         context = msg.get("context", [])
 
         # 执行评估
-        evaluation = self.evaluate_confidence(question, answer, context)
+        if self.resolve_mode(mode) == "heuristic":
+            evaluation = self.heuristic_evaluate(answer, context)
+        else:
+            evaluation = self.evaluate_confidence(question, answer, context, msg.get("priority", "evaluation"))
+        return self._update_msg(msg, evaluation)
+
+    @timed("evaluation")
+    async def reply_async(self, msg: Dict, mode: str = None) -> Dict:
+        """reply 的异步版本"""
+        if msg.get("route"):
+            return self._update_msg(msg, ROUTED_EVALUATION)
+        if self.resolve_mode(mode) == "heuristic":
+            return self._update_msg(msg, self.heuristic_evaluate(msg.get("content", ""), msg.get("context", [])))
+        evaluation = await self.evaluate_confidence_async(
+            msg.get("query", ""), msg.get("content", ""), msg.get("context", []), msg.get("priority", "evaluation")
+        )
+        return self._update_msg(msg, evaluation)
 
+    def _update_msg(self, msg: Dict, evaluation: str) -> Dict:
+        """将评估结果和置信度等级写回消息"""
         # 提取置信度等级
         confidence = self.extract_confidence_level(evaluation)
 
@@ -0,0 +1,186 @@
+"""
+答案缓存
+缓存完整的分析结果，相同问题（规范化后完全一致）直接命中；
+开启语义匹配时，嵌入相似度超过阈值、且数字与提到的公司名称 / 股票代码都一致的近似问题也可命中。
+条目按 TTL 过期、按 LRU 淘汰，向量索引更新后整体失效
+"""
+
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, FrozenSet, List, Optional
+
+import numpy as np
+
+from app.models import AnalysisResult
+from config import Config
+from embedding_cache import EmbeddingCache
+from metrics import record_cache
+
+NUMBER_PATTERN = re.compile(r"\d+(?:\.\d+)?")
+
+
+class AnswerCache:
+    """分析结果缓存（精确匹配 + 可选语义匹配）"""
+
+    def __init__(self, ttl: float = None, max_entries: int = None, semantic: bool = None,
+                 threshold: float = None, entities: Callable[[str], FrozenSet] = None):
+        """
+        初始化答案缓存
+
+        参数:
+            ttl: 条目有效期（秒），默认为 Config.ANSWER_CACHE_TTL
+            max_entries: 最多缓存的条目数，默认为 Config.ANSWER_CACHE_MAX_ENTRIES
+            semantic: 是否启用语义匹配，默认为 Config.ANSWER_CACHE_SEMANTIC
+            threshold: 语义匹配的 cosine 相似度阈值，默认为 Config.ANSWER_CACHE_SIMILARITY
+            entities: 提取问题中公司名称、股票代码等主体的函数，语义匹配要求主体一致，默认不提取
+        """
+        self.ttl = ttl or Config.ANSWER_CACHE_TTL
+        self.max_entries = max_entries or Config.ANSWER_CACHE_MAX_ENTRIES
+        self.semantic = Config.ANSWER_CACHE_SEMANTIC if semantic is None else semantic
+        self.threshold = threshold or Config.ANSWER_CACHE_SIMILARITY
+        self.entities = entities
+        # (过滤范围, 规范化问题) -> {"result", "vector", "numbers", "entities", "scope", "expires"}
+        self._entries = OrderedDict()
+        # 语义匹配用的向量矩阵，条目变化后懒重建
+        self._matrix = None
+        self._matrix_keys = []
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def normalize_query(query: str) -> str:
+        """规范化问题文本，作为精确匹配的键"""
+        return EmbeddingCache.normalize_text(query).lower()
+
+    @staticmethod
+    def _numbers(query: str) -> List[str]:
+        """
+        提取问题中的数字（年份、金额等）
+
+        "XX公司2023年营收" 与 "XX公司2022年营收" 的嵌入非常接近，
+        数字不一致的问题不做语义匹配
+        """
+        return NUMBER_PATTERN.findall(query)
+
+    def _entities(self, query: str) -> FrozenSet:
+        """
+        问题中提到的主体（公司名称、股票代码）
+
+        "平安银行2023年营收" 与 "招商银行2023年营收" 的嵌入同样接近且数字相同，
+        主体不一致的问题不做语义匹配
+        """
+        return self.entities(query) if self.entities is not None else frozenset()
+
+    @staticmethod
+    def _unit(vector) -> Optional[np.ndarray]:
+        if vector is None:
+            return None
+        vector = np.asarray(vector, dtype='float32')
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else None
+
+    def get(self, query: str, embedding=None, scope: str = "") -> Optional[AnalysisResult]:
+        """
+        查找缓存的分析结果
+
+        参数:
+            query: 用户问题
+            embedding: 问题的嵌入向量，仅语义匹配时需要
+            scope: 检索范围（如序列化后的过滤条件），只匹配同一范围内的答案
+
+        返回:
+            命中时返回分析结果（query 字段替换为本次问题），否则返回 None
+        """
+        key = (scope, self.normalize_query(query))
+        # 主体提取需要查询向量库，在持锁之前完成
+        entities = self._entities(query) if self.semantic and embedding is not None else None
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            entry = self._entries.get(key)
+            if entry is None and entities is not None:
+                match = self._semantic_match(key, self._unit(embedding), entities)
+                if match is not None:
+                    entry = self._entries[match]
+                    key = match
+                    self.semantic_hits += 1
+
+            if entry is None:
+                self.misses += 1
+                record_cache("answer", False)
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            record_cache("answer", True)
+            return entry["result"].model_copy(update={"query": query})
+
+    def put(self, query: str, result: AnalysisResult, embedding=None, scope: str = ""):
+        """写入分析结果"""
+        key = (scope, self.normalize_query(query))
+        entities = self._entities(query) if self.semantic else None
+        with self._lock:
+            self._entries[key] = {
+                "result": result,
+                "vector": self._unit(embedding) if self.semantic else None,
+                "numbers": self._numbers(key[1]),
+                "entities": entities,
+                "scope": scope,
+                "expires": time.time() + self.ttl
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._matrix = None
+
+    def _semantic_match(self, key: tuple, vector: Optional[np.ndarray], entities: FrozenSet) -> Optional[tuple]:
+        """返回相似度最高、超过阈值且数字与主体一致的缓存键（调用方需持有锁）"""
+        if vector is None or not self._entries:
+            return None
+        if self._matrix is None:
+            self._matrix_keys = [k for k, e in self._entries.items() if e["vector"] is not None]
+            if not self._matrix_keys:
+                return None
+            self._matrix = np.stack([self._entries[k]["vector"] for k in self._matrix_keys])
+        if not self._matrix_keys or self._matrix.shape[1] != vector.shape[0]:
+            return None
+
+        scores = self._matrix @ vector
+        scope, text = key
+        numbers = self._numbers(text)
+        for i in np.argsort(-scores):
+            if scores[i] < self.threshold:
+                break
+            candidate = self._entries.get(self._matrix_keys[i])
+            if (candidate is not None and candidate["scope"] == scope and candidate["numbers"] == numbers
+                    and candidate["entities"] == entities):
+                return self._matrix_keys[i]
+        return None
+
+    def _expire(self, now: float):
+        """删除过期条目（调用方需持有锁）"""
+        expired = [key for key, entry in self._entries.items() if entry["expires"] <= now]
+        for key in expired:
+            del self._entries[key]
+        if expired:
+            self._matrix = None
+
+    def clear(self):
+        """清空缓存（向量索引更新后调用）"""
+        with self._lock:
+            self._entries.clear()
+            self._matrix = None
+            self._matrix_keys = []
+
+    def stats(self) -> Dict[str, int]:
+        """命中统计"""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses
+            }
@@ -2,11 +2,19 @@
 金融量化分析系统核心类
 """
 
-import os
 import json
+import uuid
 from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Tuple
 from app.models import AnalysisResult
-from data_loader import DataLoader
+from answer_cache import AnswerCache
+from batch_runner import BatchRunner
+from chunker import format_citation
+from evaluation_scheduler import EvaluationScheduler
+from llm_client import get_scheduler
+from metrics import begin_request, finish_request, request_timings
+from index_updater import IndexUpdater
+from qa_router import QARouter
 from vector_store import VectorStore
 from agents import RetrievalAgent, GenerationAgent, ConfidenceEvaluator, DialogueManager
 from config import Config
@@ -20,7 +28,17 @@ class QuantAnalysisSystem:
         1. 向量数据库
         2. 数据加载器
         3. 核心处理代理
+        4. 答案缓存与后台评估调度
         """
+        # 初始化答案缓存（索引更新时需要清空，先于向量存储创建）
+        # 语义匹配要求问题提到的公司名称、股票代码一致，取值来自向量库的元数据索引
+        self.answer_cache = AnswerCache(
+            entities=lambda text: self.vector_store.mentioned_entities(text)
+        ) if Config.ANSWER_CACHE_ENABLED else None
+        self.evaluation_scheduler = EvaluationScheduler()
+        # 问答库路由在知识库加载后创建，索引更新时需要重建
+        self.qa_router = None
+
         # 初始化向量存储
         self.vector_store = VectorStore(embed_model=Config.EMB_MODEL)
 
@@ -31,40 +49,30 @@ class QuantAnalysisSystem:
         self._initialize_agents()
 
     def _setup_vector_store(self):
-        """配置向量存储索引"""
-        if os.path.exists(Config.VECTOR_STORE_PATH):
-            print("加载现有金融知识库...")
-            self.vector_store.load_index(Config.VECTOR_STORE_PATH)
-        else:
-            print("构建金融知识库索引...")
-            self._build_vector_index()
-
-    def _build_vector_index(self):
-        """构建向量索引"""
-        # 创建索引结构
-        self.vector_store.create_index()
-
-        # 加载数据文档
-        loader = DataLoader()
-        documents = loader.load_all_data()
-
-        # 准备索引内容
-        content_list = []
-        metadata_list = []
-
-        for doc in documents:
-            content_list.append(doc["content"])
-            metadata_list.append({
-                "source": doc["metadata"].get("source", "未标注来源"),
-                "date": doc["metadata"].get("date", "未知日期")
-            })
-
-        # 添加文档到索引
-        self.vector_store.add_documents(content_list, metadata_list)
-
-        # 保存索引
-        self.vector_store.save_index(Config.VECTOR_STORE_PATH)
-        print(f"金融知识库构建完成，包含 {len(content_list)} 条文档")
+        """配置向量存储索引：加载现有索引并增量更新，索引不存在时全量构建（多个 worker 同时启动时依次执行）"""
+        self.index_updater = IndexUpdater(self.vector_store, Config.VECTOR_STORE_PATH)
+        stats = self.index_updater.load_or_build()
+        print(f"金融知识库就绪，包含 {stats['total_documents']} 条文档，本次新增 {stats['documents_added']} 条，"
+              f"删除 {stats['documents_removed']} 条，耗时 {stats['time_elapsed']:.1f} 秒")
+
+    def update_index(self) -> dict:
+        """
+        增量更新向量索引：只嵌入新增或变更的文件，删除已移除文件的向量
+
+        返回:
+            更新统计信息（新增/删除/合并重复/总文档数与耗时）
+        """
+        stats = self.index_updater.update()
+        print(f"金融知识库更新完成，新增 {stats['documents_added']} 条，"
+              f"删除 {stats['documents_removed']} 条，合并近似重复 {stats['duplicates_merged']} 条"
+              f"（去重率 {stats['dedup_ratio']:.1%}），耗时 {stats['time_elapsed']:.1f} 秒")
+        # 知识库内容变化后，缓存的答案可能已经过时
+        if stats["documents_added"] or stats["documents_removed"]:
+            if self.answer_cache is not None:
+                self.answer_cache.clear()
+            if self.qa_router is not None:
+                self.qa_router.rebuild()
+        return stats
 
     def _initialize_agents(self):
         """初始化处理代理"""
@@ -77,43 +85,312 @@ class QuantAnalysisSystem:
         # 置信度评估 - 负责答案质量评估
         self.confidence_evaluator = ConfidenceEvaluator()
 
+        # 问答库路由 - 常见问题直接返回官方回答
+        if Config.QA_ROUTER_ENABLED:
+            self.qa_router = QARouter(self.vector_store)
+
         # 对话管理 - 协调处理流程
         self.dialogue_manager = DialogueManager(
             self.retrieval_agent,
-            self.generation_agent
+            self.generation_agent,
+            router=self.qa_router
         )
 
-    def analyze_query(self, user_query: str) -> AnalysisResult:
+    def analyze_query(self, user_query: str, session_id: str = None, filters: Dict[str, Any] = None,
+                      evaluation_mode: str = None, include_timings: bool = False) -> AnalysisResult:
         """
         处理用户查询的完整分析流程
 
         参数:
             user_query: 用户查询文本
+            session_id: 会话标识，同一会话的最近问答会作为对话历史传给生成代理
+            filters: 检索的元数据过滤条件，如 {"stock_code": "000001", "report_year": 2023}
+            evaluation_mode: 置信度评估模式 llm / heuristic / background，默认为 Config.EVALUATION_MODE；
+                             background 时先返回启发式评估，模型评估完成后按 request_id 查询
+            include_timings: 是否在结果中附带各阶段耗时、token 数与排队时间
 
         返回:
             分析结果对象
         """
+        mode = self.confidence_evaluator.resolve_mode(evaluation_mode)
+        request_stats = begin_request()
+
+        # 步骤0: 查找答案缓存
+        use_cache = self._use_answer_cache(session_id)
+        embedding = None
+        if use_cache:
+            embedding = self._query_embedding(user_query)
+            cached = self._cached_result(user_query, embedding, session_id, filters)
+            if cached is not None:
+                return self._with_timings(cached, "cached", request_stats, include_timings)
+
         # 步骤1: 对话管理处理用户输入
         manager_response = self.dialogue_manager.reply(
-            Msg(role="user", content=user_query, name="quant")
+            Msg(role="user", content=user_query, name="quant"), session_id=session_id, filters=filters
+        )
+        mode = self._response_mode(mode, manager_response)
+
+        # 步骤2: 置信度评估（background 模式下先用启发式评估，模型评估转入后台）
+        final_response = self.confidence_evaluator.reply(
+            self._eval_msg(user_query, manager_response), mode=self._foreground_mode(mode)
+        )
+
+        result = self._build_result(user_query, manager_response, final_response, mode)
+        self._finish_result(result, manager_response, mode, use_cache, embedding, filters)
+        return self._with_timings(result, self._outcome(manager_response), request_stats, include_timings)
+
+    async def analyze_query_async(self, user_query: str, session_id: str = None, filters: Dict[str, Any] = None,
+                                  evaluation_mode: str = None, include_timings: bool = False) -> AnalysisResult:
+        """
+        analyze_query 的异步版本：嵌入、生成和评估均异步等待，
+        FAISS 检索在线程池中执行，并发请求之间不再互相阻塞
+
+        参数:
+            user_query: 用户查询文本
+            session_id: 会话标识
+            filters: 检索的元数据过滤条件
+            evaluation_mode: 置信度评估模式，默认为 Config.EVALUATION_MODE
+            include_timings: 是否在结果中附带耗时明细
+
+        返回:
+            分析结果对象
+        """
+        mode = self.confidence_evaluator.resolve_mode(evaluation_mode)
+        request_stats = begin_request()
+        use_cache = self._use_answer_cache(session_id)
+        embedding = None
+        if use_cache:
+            embedding = await self._query_embedding_async(user_query)
+            cached = self._cached_result(user_query, embedding, session_id, filters)
+            if cached is not None:
+                return self._with_timings(cached, "cached", request_stats, include_timings)
+
+        manager_response = await self.dialogue_manager.reply_async(
+            Msg(role="user", content=user_query, name="quant"), session_id=session_id, filters=filters
+        )
+        mode = self._response_mode(mode, manager_response)
+        final_response = await self.confidence_evaluator.reply_async(
+            self._eval_msg(user_query, manager_response), mode=self._foreground_mode(mode)
+        )
+        result = self._build_result(user_query, manager_response, final_response, mode)
+        self._finish_result(result, manager_response, mode, use_cache, embedding, filters)
+        return self._with_timings(result, self._outcome(manager_response), request_stats, include_timings)
+
+    async def analyze_query_stream(self, user_query: str, session_id: str = None,
+                                   filters: Dict[str, Any] = None, evaluation_mode: str = None,
+                                   include_timings: bool = False) -> AsyncIterator[Tuple[str, Any]]:
+        """
+        流式分析流程
+
+        参数:
+            user_query: 用户查询文本
+            session_id: 会话标识
+            filters: 检索的元数据过滤条件
+            evaluation_mode: 置信度评估模式，默认为 Config.EVALUATION_MODE
+            include_timings: 是否在 result 事件的结果中附带耗时明细
+
+        产出:
+            ("sources", 检索来源) -> 若干 ("token", 生成片段) -> ("evaluation", 置信度评估)
+            -> ("result", 完整分析结果)；命中答案缓存时整段回答作为一个 token 产出。
+            background 模式下先产出 ("result", 启发式评估的结果)，模型评估完成后再产出 ("evaluation", ...)
+        """
+        mode = self.confidence_evaluator.resolve_mode(evaluation_mode)
+        request_stats = begin_request()
+        use_cache = self._use_answer_cache(session_id)
+        embedding = None
+        if use_cache:
+            embedding = await self._query_embedding_async(user_query)
+            cached = self._cached_result(user_query, embedding, session_id, filters)
+            if cached is not None:
+                cached = self._with_timings(cached, "cached", request_stats, include_timings)
+                yield "sources", {"sources": cached.sources, "documents": []}
+                yield "token", {"text": cached.analysis}
+                yield "evaluation", {"request_id": cached.request_id, "status": cached.evaluation_status,
+                                     "confidence": cached.confidence, "evaluation": cached.evaluation}
+                yield "result", cached
+                return
+
+        manager_response = None
+        async for event, data in self.dialogue_manager.stream_reply_async(
+            Msg(role="user", content=user_query, name="quant"), session_id=session_id, filters=filters
+        ):
+            if event == "retrieval":
+                documents = [
+                    {"source": res["metadata"].get("source", "未知来源"), "citation": format_citation(res["metadata"]),
+                     "score": res.get("score")}
+                    for res in data.get("context", [])
+                ]
+                yield "sources", {
+                    "sources": list(dict.fromkeys(doc["source"] for doc in documents)),
+                    "documents": documents,
+                    "context_stats": data.get("context_stats")
+                }
+            elif event == "token":
+                yield "token", {"text": data}
+            else:
+                manager_response = data
+
+        mode = self._response_mode(mode, manager_response)
+        final_response = await self.confidence_evaluator.reply_async(
+            self._eval_msg(user_query, manager_response), mode=self._foreground_mode(mode)
         )
+        result = self._build_result(user_query, manager_response, final_response, mode)
+        self._finish_result(result, manager_response, mode, use_cache, embedding, filters)
+        result = self._with_timings(result, self._outcome(manager_response), request_stats, include_timings)
+        if mode != "background":
+            yield "evaluation", {"request_id": result.request_id, "status": result.evaluation_status,
+                                 "confidence": result.confidence, "evaluation": result.evaluation}
+            yield "result", result
+            return
+
+        yield "result", result
+        # 模型队列繁忙时后台评估可能长时间排队，超时后推送 pending 状态与查询地址
+        evaluation = await self.evaluation_scheduler.wait(result.request_id, timeout=Config.EVALUATION_STREAM_WAIT)
+        if evaluation is not None and evaluation["status"] == "pending":
+            evaluation["poll_url"] = f"/api/v1/evaluations/{result.request_id}"
+        yield "evaluation", evaluation
+
+    async def analyze_batch(self, items: List[Dict[str, Any]], concurrency: int = None) -> AsyncIterator[Dict]:
+        """
+        批量分析：按组批量检索，生成与评估以有限并发执行，不读写会话历史与答案缓存
+
+        参数:
+            items: [{"id": 可选, "query": 问题, "filters": 可选过滤条件}, ...]
+            concurrency: 同时进行生成与评估的问题数，默认为 Config.BATCH_CONCURRENCY
+
+        产出:
+            按完成顺序产出 {"id", "query", "result"} 或 {"id", "query", "error"}
+        """
+        runner = BatchRunner(self.retrieval_agent, self.generation_agent, self.confidence_evaluator,
+                             concurrency=concurrency)
+        async for record in runner.run(items):
+            yield record
+
+    def get_evaluation(self, request_id: str) -> Dict[str, Any]:
+        """查询后台评估结果，未知或已过期的 request_id 返回 None"""
+        return self.evaluation_scheduler.get(request_id)
+
+    @staticmethod
+    def _outcome(manager_response: dict) -> str:
+        return "routed" if manager_response.get("route") else "generated"
+
+    @staticmethod
+    def _with_timings(result: AnalysisResult, outcome: str, request_stats: dict,
+                      include_timings: bool = False) -> AnalysisResult:
+        """记录请求总耗时，需要时在结果中附带耗时明细"""
+        finish_request(outcome, request_stats)
+        if not include_timings:
+            return result
+        return result.model_copy(update={"timings": request_timings(request_stats)})
 
-        # 步骤2: 置信度评估
-        eval_msg = {
-            "question": user_query,
+    @staticmethod
+    def _response_mode(mode: str, manager_response: dict) -> str:
+        """问答库直接命中的回答不调用模型评估，也不提交后台评估"""
+        return "heuristic" if manager_response.get("route") else mode
+
+    @staticmethod
+    def _foreground_mode(mode: str) -> str:
+        """返回结果前执行的评估模式：background 模式下先做启发式评估"""
+        return "heuristic" if mode == "background" else mode
+
+    def _finish_result(self, result: AnalysisResult, manager_response: dict, mode: str, use_cache: bool,
+                       embedding, filters: Dict[str, Any] = None):
+        """写入答案缓存；background 模式下提交模型评估，完成后再缓存带最终评估的结果"""
+        if mode != "background":
+            if use_cache:
+                self._store_result(result.query, result, embedding, filters)
+            return
+
+        def evaluate():
+            final_response = self.confidence_evaluator.reply(
+                self._eval_msg(result.query, manager_response), mode="llm"
+            )
+            if use_cache:
+                self._store_result(result.query, result.model_copy(update={
+                    "confidence": final_response["confidence"],
+                    "evaluation": final_response.get("confidence_evaluation", ""),
+                    "evaluation_status": "completed"
+                }), embedding, filters)
+            return final_response
+
+        self.evaluation_scheduler.submit(result.request_id, evaluate)
+
+    def _use_answer_cache(self, session_id: str = None) -> bool:
+        """会话已有历史时回答依赖上下文，不使用答案缓存"""
+        if self.answer_cache is None:
+            return False
+        return not (session_id and self.dialogue_manager.session_store.get_history(session_id))
+
+    def _query_embedding(self, user_query: str):
+        """语义匹配用的问题嵌入；检索阶段会从嵌入缓存复用同一向量"""
+        if not self.answer_cache.semantic:
+            return None
+        try:
+            return self.vector_store.embedder.get_embedding(user_query)
+        except Exception as e:
+            print(f"问题嵌入失败，答案缓存仅做精确匹配: {str(e)}")
+            return None
+
+    async def _query_embedding_async(self, user_query: str):
+        """_query_embedding 的异步版本"""
+        if not self.answer_cache.semantic:
+            return None
+        try:
+            return await self.vector_store.embedder.get_embedding_async(user_query)
+        except Exception as e:
+            print(f"问题嵌入失败，答案缓存仅做精确匹配: {str(e)}")
+            return None
+
+    @staticmethod
+    def _cache_scope(filters: Dict[str, Any] = None) -> str:
+        """过滤条件不同的问题检索范围不同，答案分开缓存"""
+        return json.dumps(filters, ensure_ascii=False, sort_keys=True, default=str) if filters else ""
+
+    def _cached_result(self, user_query: str, embedding, session_id: str = None, filters: Dict[str, Any] = None):
+        """查找缓存的分析结果，命中时同样写入会话历史"""
+        cached = self.answer_cache.get(user_query, embedding, self._cache_scope(filters))
+        if cached is None:
+            return None
+        if session_id:
+            self.dialogue_manager.session_store.append(
+                session_id,
+                {"role": "user", "content": user_query},
+                {"role": "assistant", "content": cached.analysis}
+            )
+        return cached.model_copy(update={"cached": True})
+
+    def _store_result(self, user_query: str, result: AnalysisResult, embedding, filters: Dict[str, Any] = None):
+        """缓存分析结果，生成或评估失败的结果不缓存"""
+        if "生成回答时出错" in result.analysis or result.evaluation.startswith("评估失败"):
+            return
+        if result.evaluation_status != "completed":
+            return
+        self.answer_cache.put(user_query, result, embedding, self._cache_scope(filters))
+
+    @staticmethod
+    def _eval_msg(user_query: str, manager_response: dict) -> dict:
+        """构建置信度评估消息"""
+        return {
+            "query": user_query,
             "content": manager_response["content"],
-            "context": manager_response.get("context", [])
+            "context": manager_response.get("context", []),
+            "route": manager_response.get("route")
         }
-        final_response = self.confidence_evaluator.reply(eval_msg)
 
-        # 返回结构化分析结果
+    @staticmethod
+    def _build_result(user_query: str, manager_response: dict, final_response: dict,
+                      mode: str = None) -> AnalysisResult:
+        """返回结构化分析结果，background 模式下评估状态为 pending"""
         return AnalysisResult(
+            request_id=uuid.uuid4().hex,
+            evaluation_status="pending" if mode == "background" else "completed",
             query=user_query,
             analysis=final_response["content"],
             confidence=final_response["confidence"],
             sources=manager_response.get("sources", []),
             evaluation=final_response.get("confidence_evaluation", ""),
-            timestamp=datetime.now().isoformat()
+            timestamp=datetime.now().isoformat(),
+            context_stats=manager_response.get("context_stats")
         )
 
     def save_state(self):
@@ -121,7 +398,7 @@ class QuantAnalysisSystem:
         state = {
             "last_updated": datetime.now().isoformat(),
             "vector_store_path": Config.VECTOR_STORE_PATH,
-            "document_count": len(self.vector_store.documents)
+            "document_count": len(self.vector_store)
         }
 
         with open(Config.SYSTEM_STATE_PATH, "w") as f:
@@ -133,12 +410,19 @@ class QuantAnalysisSystem:
         try:
             with open(Config.SYSTEM_STATE_PATH, "r") as f:
                 state = json.load(f)
-            return {
+            status = {
                 "status": "running",
                 **state
             }
         except FileNotFoundError:
-            return {
+            status = {
                 "status": "initialized",
                 "message": "系统尚未保存状态"
-            }
\ No newline at end of file
+            }
+        if self.answer_cache is not None:
+            status["answer_cache"] = self.answer_cache.stats()
+        if self.qa_router is not None:
+            status["qa_router"] = self.qa_router.stats()
+        status["evaluations"] = self.evaluation_scheduler.stats()
+        status["llm_scheduler"] = get_scheduler().metrics()
+        return status
\ No newline at end of file
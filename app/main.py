@@ -2,11 +2,12 @@
 金融量化分析系统 - FastAPI 后端入口
 """
 
-from fastapi import FastAPI, Depends
+from fastapi import FastAPI, Depends, HTTPException, Response
 from fastapi.middleware.cors import CORSMiddleware
-from app.routers import analysis
+from app.routers import analysis, data
 from app.dependencies import get_quant_system
 from config import Config
+import metrics
 
 # 创建 FastAPI 应用
 app = FastAPI(
@@ -36,6 +37,16 @@ app.add_middleware(
 
 # 包含路由
 app.include_router(analysis.router, prefix="/api/v1", tags=["分析"])
+app.include_router(data.router, prefix="/api/v1", tags=["数据"])
+
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    """Prometheus 指标（需要安装 prometheus_client）"""
+    payload = metrics.render()
+    if payload is None:
+        raise HTTPException(status_code=404, detail="未安装 prometheus_client，指标不可用")
+    content, content_type = payload
+    return Response(content=content, media_type=content_type)
 
 @app.on_event("startup")
 async def startup_event():
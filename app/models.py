@@ -3,22 +3,52 @@ Pydantic 数据模型定义
 """
 
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 
 class AnalysisRequest(BaseModel):
     """分析请求模型"""
     query: str
     user_id: Optional[str] = None
     session_id: Optional[str] = None
+    # 检索过滤条件，可选字段: company_name / stock_code / report_year / report_type / type，
+    # 取值可以是单个值或列表，如 {"stock_code": "000001", "report_year": [2022, 2023]}
+    filters: Optional[Dict[str, Any]] = None
+    # 置信度评估模式: llm / heuristic / background，缺省使用服务端配置
+    evaluation_mode: Optional[str] = None
+    # 是否在结果中附带各阶段耗时、token 数与排队时间
+    include_timings: bool = False
+
+class BatchAnalysisItem(BaseModel):
+    """批量分析中的单个问题"""
+    id: Optional[str] = None  # 缺省为在列表中的序号
+    query: str
+    filters: Optional[Dict[str, Any]] = None
+
+class BatchAnalysisRequest(BaseModel):
+    """批量分析请求模型"""
+    items: List[BatchAnalysisItem]
+    concurrency: Optional[int] = None  # 同时进行生成与评估的问题数
 
 class AnalysisResult(BaseModel):
     """分析结果模型"""
+    request_id: Optional[str] = None  # 用于查询后台评估结果
     query: str
     analysis: str
     confidence: str
     sources: List[str] = []
     evaluation: str = ""
     timestamp: str
+    cached: bool = False  # 是否来自答案缓存
+    context_stats: Optional[Dict[str, Any]] = None  # 上下文组装统计（token 数、丢弃的分块数等）
+    evaluation_status: str = "completed"  # pending 表示模型评估仍在后台执行
+    timings: Optional[Dict[str, Any]] = None  # 耗时明细（请求 include_timings 时返回）
+
+class EvaluationStatus(BaseModel):
+    """后台评估状态模型"""
+    request_id: str
+    status: str  # pending / completed / failed
+    confidence: Optional[str] = None
+    evaluation: Optional[str] = None
 
 class SystemStatus(BaseModel):
     """系统状态模型"""
@@ -26,11 +56,17 @@ class SystemStatus(BaseModel):
     last_updated: Optional[str] = None
     document_count: Optional[int] = None
     message: Optional[str] = None
+    answer_cache: Optional[Dict[str, int]] = None  # 答案缓存命中统计
+    qa_router: Optional[Dict[str, int]] = None  # 问答库路由命中统计
+    evaluations: Optional[Dict[str, int]] = None  # 后台评估统计
+    llm_scheduler: Optional[Dict[str, Any]] = None  # 模型请求调度：在途数与各优先级的排队情况
 
 class DataUpdateResponse(BaseModel):
     """数据更新响应模型"""
     status: str
     documents_added: int
     documents_removed: int
+    duplicates_merged: int = 0
+    dedup_ratio: float = 0.0
     total_documents: int
     time_elapsed: float
\ No newline at end of file
@@ -2,14 +2,23 @@
 分析相关路由
 """
 
-from fastapi import APIRouter, Depends
-from app.models import AnalysisRequest, AnalysisResult, SystemStatus
+import json
+from fastapi import APIRouter, Depends, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from app.models import AnalysisRequest, AnalysisResult, BatchAnalysisRequest, EvaluationStatus, SystemStatus
 from app.dependencies import get_quant_system
 from app.core.system import QuantAnalysisSystem
 
 router = APIRouter()
 
 
+def _sse_event(event: str, data) -> str:
+    """格式化为一条 SSE 消息"""
+    payload = json.dumps(jsonable_encoder(data), ensure_ascii=False)
+    return f"event: {event}\ndata: {payload}\n\n"
+
+
 @router.post("/analyze", response_model=AnalysisResult, summary="分析金融查询")
 async def analyze_query(
         request: AnalysisRequest,
@@ -20,10 +29,131 @@ async def analyze_query(
 
     参数:
     - query: 金融分析查询文本
+    - session_id: 会话标识，同一会话内的追问会带上最近的对话历史
+    - filters: 检索过滤条件，如 {"company_name": "平安银行", "report_year": 2023}
+    - evaluation_mode: 置信度评估模式 llm / heuristic / background；background 时立即返回启发式评估，
+      模型评估结果通过 GET /evaluations/{request_id} 获取
+    - include_timings: 为 true 时结果附带 timings（各阶段耗时、各阶段模型调用的 token 数与模型耗时、排队时间）
     返回:
     - 包含分析结果、置信度、来源等信息的对象
     """
-    return quant_system.analyze_query(request.query)
+    try:
+        return await quant_system.analyze_query_async(
+            request.query, session_id=request.session_id, filters=request.filters,
+            evaluation_mode=request.evaluation_mode, include_timings=request.include_timings
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.post("/analyze/stream", summary="流式分析金融查询")
+async def analyze_query_stream(
+        request: AnalysisRequest,
+        quant_system: QuantAnalysisSystem = Depends(get_quant_system)
+) -> StreamingResponse:
+    """
+    以 SSE 流式返回分析过程
+
+    事件顺序:
+    - sources: 检索到的来源
+    - token: 生成的回答片段（已过滤 <think> 推理块）
+    - evaluation: 置信度评估
+    - result: 完整分析结果
+    - done: 流结束
+
+    evaluation_mode 为 background 时 result（启发式评估）先于 evaluation（模型评估）产出
+    """
+    async def event_stream():
+        try:
+            async for event, data in quant_system.analyze_query_stream(
+                    request.query, session_id=request.session_id, filters=request.filters,
+                    evaluation_mode=request.evaluation_mode, include_timings=request.include_timings
+            ):
+                yield _sse_event(event, data)
+        except Exception as e:
+            yield _sse_event("error", {"message": str(e)})
+        yield _sse_event("done", {})
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@router.post("/analyze/batch", summary="批量分析金融查询")
+async def analyze_batch(
+        request: BatchAnalysisRequest,
+        quant_system: QuantAnalysisSystem = Depends(get_quant_system)
+) -> StreamingResponse:
+    """
+    批量分析，以 NDJSON 按完成顺序逐行返回结果
+
+    每行为 {"id", "query", "result": 分析结果} 或 {"id", "query", "error": 错误信息}；
+    客户端中断后只需重新提交未返回 result 的问题
+    """
+    if not request.items:
+        raise HTTPException(status_code=400, detail="items 不能为空")
+    items = [item.model_dump() for item in request.items]
+
+    async def ndjson_stream():
+        try:
+            async for record in quant_system.analyze_batch(items, concurrency=request.concurrency):
+                yield json.dumps(jsonable_encoder(record), ensure_ascii=False) + "\n"
+        except Exception as e:
+            yield json.dumps({"error": str(e)}, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(ndjson_stream(), media_type="application/x-ndjson")
+
+
+@router.websocket("/ws/analyze")
+async def analyze_query_ws(
+        websocket: WebSocket,
+        quant_system: QuantAnalysisSystem = Depends(get_quant_system)
+):
+    """
+    WebSocket 流式分析，客户端发送 {"query": "..."}，
+    服务端按与 /analyze/stream 相同的事件顺序推送 {"event": ..., "data": ...}
+    """
+    await websocket.accept()
+    try:
+        while True:
+            message = await websocket.receive_text()
+            try:
+                # 非法 JSON、非对象或缺少 query 的消息返回错误事件，连接继续可用
+                request = AnalysisRequest.model_validate(json.loads(message))
+            except ValueError as e:
+                await websocket.send_json({"event": "error", "data": {"message": f"请求格式错误: {e}"}})
+                await websocket.send_json({"event": "done", "data": {}})
+                continue
+            try:
+                async for event, data in quant_system.analyze_query_stream(
+                        request.query, session_id=request.session_id, filters=request.filters,
+                        evaluation_mode=request.evaluation_mode, include_timings=request.include_timings
+                ):
+                    await websocket.send_json({"event": event, "data": jsonable_encoder(data)})
+            except Exception as e:
+                await websocket.send_json({"event": "error", "data": {"message": str(e)}})
+            await websocket.send_json({"event": "done", "data": {}})
+    except WebSocketDisconnect:
+        pass
+
+
+@router.get("/evaluations/{request_id}", response_model=EvaluationStatus, summary="获取后台评估结果")
+async def get_evaluation(
+        request_id: str,
+        quant_system: QuantAnalysisSystem = Depends(get_quant_system)
+) -> EvaluationStatus:
+    """
+    查询 evaluation_mode=background 的请求的模型评估结果
+
+    返回:
+    - status 为 pending 时评估仍在执行，completed / failed 时附带评估结果
+    """
+    evaluation = quant_system.get_evaluation(request_id)
+    if evaluation is None:
+        raise HTTPException(status_code=404, detail=f"未找到评估任务: {request_id}")
+    return EvaluationStatus(**evaluation)
 
 
 @router.get("/status", response_model=SystemStatus, summary="获取系统状态")
@@ -36,4 +166,4 @@ async def get_status(
     返回:
     - 系统状态、最后更新时间、文档数量等信息
     """
-    return quant_system.get_system_status()
\ No newline at end of file
+    return quant_system.get_system_status()
@@ -0,0 +1,26 @@
+"""
+数据管理相关路由
+"""
+
+from fastapi import APIRouter, Depends
+from starlette.concurrency import run_in_threadpool
+from app.models import DataUpdateResponse
+from app.dependencies import get_quant_system
+from app.core.system import QuantAnalysisSystem
+
+router = APIRouter()
+
+
+@router.post("/data/update", response_model=DataUpdateResponse, summary="增量更新知识库")
+async def update_data(
+        quant_system: QuantAnalysisSystem = Depends(get_quant_system)
+) -> DataUpdateResponse:
+    """
+    扫描数据目录并增量更新向量索引
+
+    返回:
+    - 新增/删除文档数、当前总文档数及耗时
+    """
+    # 嵌入与索引更新耗时较长，放到线程池中避免阻塞事件循环
+    stats = await run_in_threadpool(quant_system.update_index)
+    return DataUpdateResponse(**stats)
@@ -0,0 +1,225 @@
+"""
+批量分析
+问题按组批量检索（一次批量嵌入 + 一次 FAISS 矩阵检索），生成与置信度评估以有限并发执行，
+结果按完成顺序逐条产出；写入 JSONL 时每条结果立即落盘，中断后重新运行会跳过已完成的问题
+"""
+
+import asyncio
+import json
+import os
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, Iterable, List, Set
+
+from agents import RetrievalAgent, GenerationAgent, ConfidenceEvaluator
+from app.models import AnalysisResult
+from config import Config
+
+
+class BatchRunner:
+    """批量分析执行器"""
+
+    def __init__(self, retrieval_agent: RetrievalAgent, generation_agent: GenerationAgent,
+                 confidence_evaluator: ConfidenceEvaluator, concurrency: int = None,
+                 retrieval_size: int = None):
+        """
+        参数:
+            retrieval_agent: 检索代理
+            generation_agent: 生成代理
+            confidence_evaluator: 置信度评估代理
+            concurrency: 同时进行生成与评估的问题数，默认为 Config.BATCH_CONCURRENCY
+            retrieval_size: 每次批量检索的问题数，默认为 Config.BATCH_RETRIEVAL_SIZE
+        """
+        self.retrieval_agent = retrieval_agent
+        self.generation_agent = generation_agent
+        self.confidence_evaluator = confidence_evaluator
+        self.concurrency = concurrency or Config.BATCH_CONCURRENCY
+        self.retrieval_size = retrieval_size or Config.BATCH_RETRIEVAL_SIZE
+
+    @staticmethod
+    def normalize_items(items: Iterable[Dict]) -> List[Dict]:
+        """补全问题 id（缺省为序号），校验问题文本"""
+        normalized = []
+        for i, item in enumerate(items):
+            query = (item.get("query") or "").strip()
+            if not query:
+                raise ValueError(f"第 {i + 1} 个问题缺少 query")
+            item_id = item.get("id")
+            normalized.append({
+                "id": str(i) if item_id is None else str(item_id),
+                "query": query,
+                "filters": item.get("filters")
+            })
+        return normalized
+
+    async def run(self, items: List[Dict]) -> AsyncIterator[Dict]:
+        """
+        执行批量分析
+
+        参数:
+            items: [{"id": ..., "query": ..., "filters": ...}, ...]
+
+        产出:
+            按完成顺序产出 {"id", "query", "result": 分析结果} 或 {"id", "query", "error": 错误信息}
+        """
+        items = self.normalize_items(items)
+        queue = asyncio.Queue()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        # 在途的分析任务，消费方提前结束时与生产任务一起取消，不再占用模型名额
+        pending = set()
+
+        async def analyze(item: Dict, retrieval: Dict):
+            try:
+                result = await self._analyze(item, retrieval, semaphore)
+                record = {"id": item["id"], "query": item["query"], "result": result.model_dump()}
+            except Exception as e:
+                record = {"id": item["id"], "query": item["query"], "error": str(e)}
+            await queue.put(record)
+
+        async def produce():
+            for start in range(0, len(items), self.retrieval_size):
+                group = items[start:start + self.retrieval_size]
+                # 在途的生成任务降到并发上限以内再检索下一组，检索与最后几个生成任务重叠
+                while len(pending) > self.concurrency:
+                    done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    pending.difference_update(done)
+                for item, retrieval in zip(group, await asyncio.to_thread(self._retrieve, group)):
+                    if "error" in retrieval:
+                        await queue.put({"id": item["id"], "query": item["query"], "error": retrieval["error"]})
+                    else:
+                        pending.add(asyncio.create_task(analyze(item, retrieval)))
+            if pending:
+                await asyncio.wait(pending)
+            await queue.put(None)
+
+        producer = asyncio.create_task(produce())
+        try:
+            while True:
+                record = await queue.get()
+                if record is None:
+                    break
+                yield record
+            await producer
+        finally:
+            producer.cancel()
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(producer, *pending, return_exceptions=True)
+
+    def _retrieve(self, group: List[Dict]) -> List[Dict]:
+        """批量检索一组问题，过滤条件相同的问题合并为一次检索"""
+        scopes = {}
+        for i, item in enumerate(group):
+            scope = json.dumps(item["filters"], ensure_ascii=False, sort_keys=True, default=str) \
+                if item["filters"] else ""
+            scopes.setdefault(scope, []).append(i)
+
+        retrievals = [None] * len(group)
+        for indices in scopes.values():
+            queries = [group[i]["query"] for i in indices]
+            try:
+                results = self.retrieval_agent.reply_batch(
+                    queries, filters=group[indices[0]]["filters"], priority=Config.BATCH_PRIORITY
+                )
+            except Exception as e:
+                results = [{"error": f"检索失败: {str(e)}"}] * len(indices)
+            for i, result in zip(indices, results):
+                retrievals[i] = result
+        return retrievals
+
+    async def _analyze(self, item: Dict, retrieval: Dict, semaphore: asyncio.Semaphore) -> AnalysisResult:
+        """对单个问题生成回答并评估置信度"""
+        async with semaphore:
+            response = await self.generation_agent.reply_async({
+                "content": retrieval["content"],
+                "context": retrieval.get("context", []),
+                "query": item["query"],
+                "history": [],
+                "priority": Config.BATCH_PRIORITY
+            })
+            final_response = await self.confidence_evaluator.reply_async({
+                "query": item["query"],
+                "content": response["content"],
+                "context": response.get("context", []),
+                "priority": Config.BATCH_PRIORITY
+            })
+
+        context_stats = dict(retrieval.get("context_stats") or {})
+        if retrieval.get("rerank"):
+            context_stats["rerank"] = retrieval["rerank"]
+        return AnalysisResult(
+            query=item["query"],
+            analysis=final_response["content"],
+            confidence=final_response["confidence"],
+            sources=response.get("sources", []),
+            evaluation=final_response.get("confidence_evaluation", ""),
+            timestamp=datetime.now().isoformat(),
+            context_stats=context_stats
+        )
+
+    @staticmethod
+    def load_items(input_path: str) -> List[Dict]:
+        """读取问题 JSONL，每行为 {"id": 可选, "query": 问题, "filters": 可选}，缺省 id 为行号"""
+        items = []
+        with open(input_path, "r", encoding="utf-8") as f:
+            for line_no, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                item.setdefault("id", line_no)
+                items.append(item)
+        return items
+
+    @staticmethod
+    def completed_ids(output_path: str) -> Set[str]:
+        """
+        读取已写出的结果，返回成功完成的问题 id
+
+        进程崩溃时最后一行可能只写了一半，先截掉不完整的行；
+        失败的问题不计入，续跑时重新执行（同一 id 以最后一行为准）
+        """
+        if not os.path.exists(output_path):
+            return set()
+        with open(output_path, "rb+") as f:
+            data = f.read()
+            if data and not data.endswith(b"\n"):
+                f.truncate(data.rfind(b"\n") + 1)
+                data = data[:data.rfind(b"\n") + 1]
+
+        done = set()
+        for line in data.decode("utf-8").splitlines():
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if "error" in record:
+                done.discard(record["id"])
+            else:
+                done.add(record["id"])
+        return done
+
+    async def run_file(self, input_path: str, output_path: str) -> Dict[str, Any]:
+        """
+        批量分析 JSONL 文件，结果逐条追加写入 output_path，可中断后续跑
+
+        返回:
+            {"total": 问题数, "skipped": 已完成而跳过的数量, "succeeded": 本次成功数, "failed": 本次失败数}
+        """
+        items = self.normalize_items(self.load_items(input_path))
+        done = self.completed_ids(output_path)
+        remaining = [item for item in items if item["id"] not in done]
+        stats = {"total": len(items), "skipped": len(items) - len(remaining), "succeeded": 0, "failed": 0}
+        if stats["skipped"]:
+            print(f"跳过已完成的 {stats['skipped']} 个问题")
+
+        with open(output_path, "a", encoding="utf-8") as f:
+            async for record in self.run(remaining):
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                # 每条结果立即落盘，崩溃后最多重跑在途的问题
+                f.flush()
+                os.fsync(f.fileno())
+                if "error" in record:
+                    stats["failed"] += 1
+                    print(f"问题 {record['id']} 分析失败: {record['error']}")
+                else:
+                    stats["succeeded"] += 1
+                print(f"批量分析进度: {stats['skipped'] + stats['succeeded'] + stats['failed']}/{stats['total']}")
+        return stats
@@ -0,0 +1,112 @@
+"""
+FAISS 索引基准测试
+对比 flat / hnsw / ivf_flat / ivf_pq 的 recall@k、单条查询 p50/p99 延迟和每条向量的内存占用
+
+用法:
+    python benchmark_index.py --index vector_store.faiss
+    python benchmark_index.py --synthetic 200000 --dim 768 --nprobe 8,16,32 --ef-search 32,64,128
+"""
+
+import argparse
+import time
+
+import faiss
+import numpy as np
+
+from config import Config
+from vector_store import (INDEX_TYPES, create_faiss_index, export_vectors, faiss_metric, search_parameters,
+                          train_faiss_index)
+
+
+def load_vectors(args) -> np.ndarray:
+    """从现有索引导出向量，或生成带聚类结构的合成向量"""
+    if args.synthetic:
+        rng = np.random.default_rng(args.seed)
+        centers = rng.standard_normal((max(args.synthetic // 1000, 10), args.dim)).astype('float32')
+        labels = rng.integers(0, len(centers), args.synthetic)
+        noise = rng.standard_normal((args.synthetic, args.dim)).astype('float32') * 0.5
+        return centers[labels] + noise
+
+    _, vectors = export_vectors(faiss.read_index(args.index))
+    return np.ascontiguousarray(vectors, dtype='float32')
+
+
+def make_queries(vectors: np.ndarray, n_queries: int, seed: int) -> np.ndarray:
+    """以库内向量加扰动作为查询，模拟与语料相近但不完全相同的问题"""
+    rng = np.random.default_rng(seed)
+    picks = vectors[rng.choice(len(vectors), min(n_queries, len(vectors)), replace=False)]
+    scale = float(np.std(vectors)) * 0.1
+    return (picks + rng.standard_normal(picks.shape).astype('float32') * scale).astype('float32')
+
+
+def measure(index, queries: np.ndarray, k: int, params, ground_truth: np.ndarray) -> dict:
+    """逐条查询统计召回率与延迟"""
+    latencies = []
+    hits = 0
+    for i, query in enumerate(queries):
+        start = time.perf_counter()
+        _, labels = index.search(query[None, :], k, params=params)
+        latencies.append((time.perf_counter() - start) * 1000)
+        hits += len(np.intersect1d(labels[0], ground_truth[i]))
+    return {
+        "recall": hits / (len(queries) * k),
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FAISS 索引类型基准测试")
+    parser.add_argument("--index", default=Config.VECTOR_STORE_PATH, help="从该索引文件导出向量")
+    parser.add_argument("--synthetic", type=int, default=0, help="使用 N 条合成向量代替现有索引")
+    parser.add_argument("--dim", type=int, default=768, help="合成向量维度")
+    parser.add_argument("--types", default=",".join(INDEX_TYPES), help="参与测试的索引类型")
+    parser.add_argument("--metric", default=Config.SIMILARITY_METRIC, choices=["cosine", "l2"])
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--nprobe", default=str(Config.IVF_NPROBE), help="IVF 的 nprobe 取值，逗号分隔")
+    parser.add_argument("--ef-search", default=str(Config.HNSW_EF_SEARCH), help="HNSW 的 efSearch 取值，逗号分隔")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    vectors = load_vectors(args)
+    n, dim = vectors.shape
+    ids = np.arange(n, dtype='int64')
+    queries = make_queries(vectors, args.queries, args.seed)
+    if args.metric == "cosine":
+        faiss.normalize_L2(vectors)
+        faiss.normalize_L2(queries)
+    print(f"向量数: {n}，维度: {dim}，度量: {args.metric}，查询数: {len(queries)}，k={args.k}")
+
+    # 以暴力检索结果作为真值
+    exact = faiss.IndexFlat(dim, faiss_metric(args.metric))
+    exact.add(vectors)
+    _, ground_truth = exact.search(queries, args.k)
+
+    header = f"{'索引':<10}{'参数':<16}{'recall@k':>10}{'p50(ms)':>10}{'p99(ms)':>10}{'字节/向量':>12}{'构建(s)':>10}"
+    print(header)
+    print("-" * len(header))
+    for index_type in args.types.split(","):
+        start = time.perf_counter()
+        index = create_faiss_index(index_type, dim, n, args.metric)
+        train_faiss_index(index, vectors)
+        index.add_with_ids(vectors, ids)
+        build_time = time.perf_counter() - start
+        bytes_per_vector = len(faiss.serialize_index(index)) / n
+
+        if index_type == "hnsw":
+            sweeps = [("efSearch", int(v), search_parameters(index, ef_search=int(v))) for v in args.ef_search.split(",")]
+        elif index_type.startswith("ivf"):
+            sweeps = [("nprobe", int(v), search_parameters(index, nprobe=int(v))) for v in args.nprobe.split(",")]
+        else:
+            sweeps = [("-", "", None)]
+
+        for name, value, params in sweeps:
+            result = measure(index, queries, args.k, params, ground_truth)
+            label = f"{name}={value}" if value != "" else name
+            print(f"{index_type:<10}{label:<16}{result['recall']:>10.3f}{result['p50_ms']:>10.3f}"
+                  f"{result['p99_ms']:>10.3f}{bytes_per_vector:>12.1f}{build_time:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+"""
+版面感知的 PDF 分块
+基于 PyMuPDF 的文本块与字体信息逐页分块:
+1. 按段落（文本块）累积分块，不在段落中间切分；超长段落才交给文本分割器
+2. 识别章节标题（字号明显大于正文、加粗的编号标题或“第X节”），章节变化时另起分块
+3. 表格作为整体单独成块，超长表格按行拆分并在每块重复表头
+每个分块记录起止页码、所属章节与内容类型，用于生成 "file.pdf p.45" 形式的引用
+"""
+
+import re
+from collections import Counter
+from typing import Dict, Iterator, List, Optional
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from config import Config
+
+# 年报常见的章节编号: 第三节 / 一、 / （一） / 1. / 1.2
+SECTION_PATTERN = re.compile(r"^第[一二三四五六七八九十百零\d]+[节章部分]")
+NUMBERED_HEADING_PATTERN = re.compile(r"^(?:[一二三四五六七八九十]+、|[（(][一二三四五六七八九十\d]+[)）]|\d+(?:\.\d+)*[.、\s])")
+PAGE_NUMBER_PATTERN = re.compile(r"^[\d\s/\-第页共]+$")
+
+HEADING_MAX_CHARS = 60  # 超过该长度的文本块不视为标题
+PAGE_NUMBER_MAX_CHARS = 12  # 页码文本块的最大长度，如 "第 3 页 共 120 页"
+PAGE_MARGIN_RATIO = 0.08  # 页眉 / 页脚区域占页面高度的比例，页码只在该区域内识别
+HEADING_SIZE_RATIO = 1.15  # 字号达到正文字号的该倍数视为标题
+TOP_HEADING_SIZE_RATIO = 1.4  # 字号达到正文字号的该倍数视为一级标题
+BOLD_FLAG = 1 << 4
+
+
+def format_citation(metadata: Dict) -> str:
+    """
+    生成引用标注
+
+    返回:
+        PDF 分块为 "file.pdf p.45" 或 "file.pdf p.45-46"，其余数据为来源文件名
+    """
+    source = metadata.get("source", "未知来源")
+    page_start = metadata.get("page_start")
+    if page_start is None:
+        return source
+    page_end = metadata.get("page_end", page_start)
+    pages = f"p.{page_start}" if page_end == page_start else f"p.{page_start}-{page_end}"
+    return f"{source} {pages}"
+
+
+class PDFChunker:
+    """按版面结构对 PDF 分块"""
+
+    def __init__(self, chunk_size: int = None, chunk_overlap: int = None, detect_tables: bool = None):
+        """
+        参数:
+            chunk_size: 分块最大字符数，默认为 Config.CHUNK_SIZE
+            chunk_overlap: 超长段落切分时的重叠字符数，默认为 Config.CHUNK_OVERLAP
+            detect_tables: 是否识别表格，默认为 Config.CHUNK_DETECT_TABLES
+        """
+        self.chunk_size = chunk_size or Config.CHUNK_SIZE
+        self.chunk_overlap = Config.CHUNK_OVERLAP if chunk_overlap is None else chunk_overlap
+        self.detect_tables = Config.CHUNK_DETECT_TABLES if detect_tables is None else detect_tables
+        self.splitter = RecursiveCharacterTextSplitter(chunk_size=self.chunk_size, chunk_overlap=self.chunk_overlap)
+
+    def chunk(self, pdf) -> Iterator[Dict]:
+        """
+        逐页分块
+
+        参数:
+            pdf: 已打开的 fitz.Document
+
+        产出:
+            {"content", "page_start", "page_end", "section", "content_type"}，页码从 1 开始
+        """
+        state = _ChunkState()
+        # 正文字号按已读页面中字符数最多的字号估计，只需逐页累计
+        font_sizes = Counter()
+        for page_number, page in enumerate(pdf, start=1):
+            tables = self._find_tables(page)
+            blocks = self._text_blocks(page, [table["bbox"] for table in tables])
+            for block in blocks:
+                font_sizes.update({block["size"]: len(block["text"])})
+            body_size = font_sizes.most_common(1)[0][0] if font_sizes else 0
+
+            units = [dict(block, kind="text") for block in blocks] + [dict(table, kind="table") for table in tables]
+            units.sort(key=lambda unit: (round(unit["bbox"][1]), unit["bbox"][0]))
+            for unit in units:
+                if unit["kind"] == "table":
+                    yield from state.flush()
+                    yield from self._table_chunks(unit["rows"], page_number, state.section)
+                    continue
+                level = self._heading_level(unit, body_size)
+                if level:
+                    yield from state.start_section(unit["text"], level, page_number)
+                else:
+                    yield from self._add_paragraph(state, unit["text"], page_number)
+        yield from state.flush()
+
+    def _add_paragraph(self, state: "_ChunkState", text: str, page_number: int) -> Iterator[Dict]:
+        """段落加入当前分块，放不下时先输出当前分块"""
+        if state.length + len(text) > self.chunk_size:
+            yield from state.flush(keep_headings=True)
+        if len(text) <= self.chunk_size:
+            state.append(text, page_number)
+            return
+        # 超长段落切分，最后一段留在缓冲区与后续段落合并
+        pieces = self.splitter.split_text(text)
+        for piece in pieces[:-1]:
+            state.append(piece, page_number)
+            yield from state.flush()
+        state.append(pieces[-1], page_number)
+
+    @staticmethod
+    def _heading_level(block: Dict, body_size: float) -> int:
+        """判断文本块是否为标题，返回 1（一级）、2（二级）或 0（正文）"""
+        text = block["text"]
+        if len(text) > HEADING_MAX_CHARS or "\n" in text.strip():
+            return 0
+        if SECTION_PATTERN.match(text):
+            return 1
+        if body_size and block["size"] >= body_size * TOP_HEADING_SIZE_RATIO:
+            return 1
+        if body_size and block["size"] >= body_size * HEADING_SIZE_RATIO:
+            return 2
+        if block["bold"] and NUMBERED_HEADING_PATTERN.match(text):
+            return 2
+        return 0
+
+    @staticmethod
+    def _text_blocks(page, table_boxes: List) -> List[Dict]:
+        """提取页面文本块（跳过表格区域内的文本与页眉页脚中的页码）"""
+        blocks = []
+        height = page.rect.height
+        for block in page.get_text("dict", sort=True)["blocks"]:
+            if block.get("type") != 0:
+                continue
+            x0, y0, x1, y1 = block["bbox"]
+            center = ((x0 + x1) / 2, (y0 + y1) / 2)
+            if any(bx0 <= center[0] <= bx1 and by0 <= center[1] <= by1 for bx0, by0, bx1, by1 in table_boxes):
+                continue
+
+            lines, sizes, bold = [], Counter(), True
+            for line in block["lines"]:
+                spans = [span for span in line["spans"] if span["text"].strip()]
+                if not spans:
+                    continue
+                lines.append("".join(span["text"] for span in line["spans"]).strip())
+                for span in spans:
+                    sizes[round(span["size"], 1)] += len(span["text"])
+                    bold = bold and bool(span["flags"] & BOLD_FLAG)
+            text = "\n".join(lines).strip()
+            if not text:
+                continue
+            # 只有位于页眉页脚的短数字块才是页码；正文中单独成块的年份、金额（如 "2023"）保留
+            in_margin = y1 <= height * PAGE_MARGIN_RATIO or y0 >= height * (1 - PAGE_MARGIN_RATIO)
+            if in_margin and len(text) <= PAGE_NUMBER_MAX_CHARS and PAGE_NUMBER_PATTERN.match(text):
+                continue
+            blocks.append({"text": text, "bbox": block["bbox"], "size": sizes.most_common(1)[0][0], "bold": bold})
+        return blocks
+
+    def _find_tables(self, page) -> List[Dict]:
+        """识别页面中的表格，PyMuPDF 版本过低或识别失败时返回空列表"""
+        if not self.detect_tables:
+            return []
+        try:
+            found = page.find_tables()
+        except Exception:
+            return []
+        tables = []
+        for table in found.tables:
+            rows = [[(cell or "").replace("\n", " ").strip() for cell in row] for row in table.extract()]
+            rows = [row for row in rows if any(row)]
+            if rows:
+                tables.append({"bbox": tuple(table.bbox), "rows": rows})
+        return tables
+
+    def _table_chunks(self, rows: List[List[str]], page_number: int, section: Optional[str]) -> Iterator[Dict]:
+        """表格整体成块，超过分块大小时按行拆分，每块重复表头"""
+        lines = ["| " + " | ".join(row) + " |" for row in rows]
+        header, body = lines[0], lines[1:]
+        current = [header]
+        length = len(header)
+        for line in body:
+            if length + len(line) + 1 > self.chunk_size and len(current) > 1:
+                yield _chunk("\n".join(current), page_number, page_number, section, "table")
+                current, length = [header], len(header)
+            current.append(line)
+            length += len(line) + 1
+        yield _chunk("\n".join(current), page_number, page_number, section, "table")
+
+
+class _ChunkState:
+    """分块缓冲区与当前章节"""
+
+    def __init__(self):
+        self.parts = []
+        self.length = 0
+        self.has_body = False
+        self.page_start = None
+        self.page_end = None
+        self.headings = []
+
+    @property
+    def section(self) -> Optional[str]:
+        return " > ".join(self.headings) or None
+
+    def append(self, text: str, page_number: int, body: bool = True):
+        if self.page_start is None:
+            self.page_start = page_number
+        self.page_end = page_number
+        self.parts.append(text)
+        self.length += len(text) + 1
+        self.has_body = self.has_body or body
+
+    def start_section(self, heading: str, level: int, page_number: int) -> Iterator[Dict]:
+        """遇到标题时输出上一章节的分块，标题作为新分块的开头"""
+        if self.has_body:
+            yield from self.flush()
+        self.headings = self.headings[:level - 1] + [heading]
+        self.append(heading, page_number, body=False)
+
+    def flush(self, keep_headings: bool = False) -> Iterator[Dict]:
+        """
+        输出当前分块
+
+        参数:
+            keep_headings: 缓冲区只有标题时保留，等待后续正文
+        """
+        if not self.parts or (keep_headings and not self.has_body):
+            return
+        if self.has_body:
+            yield _chunk("\n".join(self.parts), self.page_start, self.page_end, self.section, "text")
+        self.parts, self.length, self.has_body = [], 0, False
+        self.page_start = self.page_end = None
+
+
+def _chunk(content: str, page_start: int, page_end: int, section: Optional[str], content_type: str) -> Dict:
+    return {
+        "content": content,
+        "page_start": page_start,
+        "page_end": page_end,
+        "section": section,
+        "content_type": content_type
+    }
@@ -23,11 +23,150 @@ class Config:
 
     # FAISS索引路径
     VECTOR_STORE_PATH = "vector_store.faiss"
+    INDEX_MMAP = True  # 以 mmap 只读方式加载索引，多进程共享页缓存
+
+    # 相似度度量: cosine（归一化向量 + 内积）/ l2（原始欧氏距离）
+    SIMILARITY_METRIC = os.getenv("SIMILARITY_METRIC", "cosine")
+    RETRIEVAL_MIN_SCORE = 0.3  # cosine 相似度低于该值的检索结果不进入提示词
+
+    # 混合检索: BM25 词法检索与向量检索并行执行，按倒数排名融合（RRF）
+    HYBRID_SEARCH = os.getenv("HYBRID_SEARCH", "true").lower() == "true"
+    HYBRID_CANDIDATES = 50  # 每路检索参与融合的候选数
+    RRF_K = 60
+    BM25_K1 = 1.2
+    BM25_B = 0.75
+
+    # 重排序: 向量检索多取候选，重排序后只保留最相关的前 N 条进入提示词
+    RERANK_ENABLED = os.getenv("RERANK_ENABLED", "false").lower() == "true"
+    RERANK_BACKEND = os.getenv("RERANK_BACKEND", "ollama")  # ollama / cross_encoder
+    RERANK_MODEL = "qwen3:4b"  # ollama 后端的打分模型
+    RERANK_CROSS_ENCODER = "BAAI/bge-reranker-base"  # cross_encoder 后端的模型
+    RERANK_CANDIDATES = 50  # 参与重排序的候选数
+    RERANK_TOP_N = 5  # 重排序后保留的结果数
+    RERANK_TIME_BUDGET = 3.0  # 时间预算（秒），超时退回向量检索顺序
+    RERANK_BATCH_SIZE = 10  # ollama 后端每次请求打分的候选数
+    RERANK_MAX_CHARS = 500  # 每个候选参与打分的最大字符数
+    RERANK_MAX_WORKERS = 4
+
+    # 元数据过滤: 过滤后候选不超过该数量时直接对候选向量精确检索，否则使用 FAISS IDSelector
+    FILTER_EXACT_MAX = 20000
+
+    # 上下文组装: 去重、合并相邻分块后按检索排序放入，直到达到 token 预算
+    CONTEXT_TOKEN_BUDGET = 3000
+    # 精确计数使用的 Hugging Face 分词器名称或本地路径（如 Qwen/Qwen3-4B），只从本地加载，不会联网下载；
+    # 默认为空，按字符近似估计 token 数
+    CONTEXT_TOKENIZER = os.getenv("CONTEXT_TOKENIZER", "")
+
+    # FAISS索引类型: auto / flat / hnsw / ivf_flat / ivf_pq
+    INDEX_TYPE = os.getenv("INDEX_TYPE", "auto")
+    INDEX_AUTO_FLAT_MAX = 100000  # auto 模式下不超过该规模使用暴力检索
+    INDEX_AUTO_IVF_FLAT_MAX = 1000000  # 超过该规模改用 IVF-PQ 压缩
+    INDEX_TRAIN_SAMPLE = 100000  # IVF 训练采样数
+    HNSW_M = 32
+    HNSW_EF_CONSTRUCTION = 200
+    HNSW_EF_SEARCH = 64  # 查询时可覆盖
+    IVF_NLIST = None  # 为空时取 4*sqrt(N)
+    IVF_NPROBE = 16  # 查询时可覆盖
+    PQ_M = None  # 子量化器数，为空时按维度自动选择
+    PQ_NBITS = 8
+
+    # 嵌入生成配置
+    EMBED_BATCH_SIZE = 64  # 单次请求发送的文本数
+    EMBED_MAX_WORKERS = 4  # 同时在途的批次数
+    EMBED_MAX_RETRIES = 3  # 批次失败后的重试次数
+    EMBED_RETRY_BACKOFF = 1.0  # 重试退避基数（秒）
+
+    # 嵌入缓存配置
+    EMBED_CACHE_ENABLED = os.getenv("EMBED_CACHE_ENABLED", "true").lower() == "true"
+    EMBED_CACHE_PATH = "embedding_cache.db"
+    EMBED_CACHE_MAX_BYTES = 2 * 1024 ** 3  # 磁盘层上限 2GB
+    EMBED_CACHE_MEMORY_ITEMS = 20000  # 内存 LRU 层条数
 
     # 文本分块配置
     CHUNK_SIZE = 1000
-    CHUNK_OVERLAP = 200
+    CHUNK_OVERLAP = 200  # 仅用于超长段落的切分，段落之间不重叠
+    CHUNK_DETECT_TABLES = True  # PDF 表格整体成块（需要 PyMuPDF >= 1.23）
     MAX_TOKEN = 16384
+
+    # 近似重复分块合并: 数字相同且 MinHash 估计的 Jaccard 相似度达到阈值的分块只存储一次，记录全部来源
+    DEDUP_ENABLED = os.getenv("DEDUP_ENABLED", "true").lower() == "true"
+    DEDUP_THRESHOLD = 0.9
+    DEDUP_NUM_PERM = 128  # MinHash 签名长度
+    DEDUP_SHINGLE_SIZE = 5  # 字符 n-gram 长度（去除空白后）
+
+    # 数据爬取配置
+    CRAWL_STATE_DIR = os.path.join(DATA_DIR, "crawl_state")  # 爬取检查点目录
+    CRAWL_CONCURRENCY = 4  # 同时进行的下载数
+    CRAWL_RATE = 2.0  # 每个域名每秒的请求数（令牌桶速率）
+    CRAWL_BURST = 4  # 每个域名允许的突发请求数
+    CRAWL_TIMEOUT = 60  # 单次请求超时（秒）
+    CRAWL_MAX_RETRIES = 3  # 网络错误与 429/5xx 响应的重试次数
+    CRAWL_RETRY_BACKOFF = 2.0  # 重试退避基数（秒）
+    CRAWL_CHUNK_SIZE = 1024 * 1024  # 流式下载缓冲大小
+    CRAWL_CHECKPOINT_INTERVAL = 5  # 检查点保存间隔（秒）
+
+    # 流式入库配置: 多进程逐页解析，分块按批送入嵌入，解析与嵌入重叠进行
+    INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", 0)) or None  # 解析进程数，默认为 CPU 核数
+    INGEST_PENDING_PER_WORKER = 2  # 每个解析进程最多排队的文件数与按页发回的分块批次数，消费方较慢时解析暂停
+    INGEST_BATCH_SIZE = 256  # 每批送入嵌入与索引的分块数
+    INGEST_PREFETCH_BATCHES = 2  # 嵌入当前批次时最多预先解析好的批次数
+
+    # 数据增强配置: 并发请求模型（enrichment 优先级），结果逐条追加到 JSONL 检查点，全部完成后一次写入最终文件
+    ENRICH_CONCURRENCY = int(os.getenv("ENRICH_CONCURRENCY", 4))  # 同时进行的增强请求数
+    ENRICH_CLASSIFY_BATCH_SIZE = 20  # 每次模型调用分类的问题数，为 1 时逐条分类
+    QA_CLASSIFIER = os.getenv("QA_CLASSIFIER", "embedding")  # 问答分类方式: embedding（嵌入零样本分类）/ llm（模型批量分类）
+    CLASSIFY_MIN_MARGIN = 0.02  # 嵌入分类最高与次高类别相似度之差低于该值时视为不确定
+    CLASSIFY_LLM_FALLBACK = True  # 不确定的问题是否交由模型再分类
+    ENRICH_PDF_PAGES = 3  # 生成年报元数据时读取的页数
+    ENRICH_PDF_CHARS = 5000  # 生成年报元数据时送入模型的最大字符数
+
+    # Ollama 请求调度: 所有模型请求共享连接池，按 interactive > evaluation > enrichment > embedding 的优先级排队
+    LLM_MAX_IN_FLIGHT = int(os.getenv("LLM_MAX_IN_FLIGHT", 4))  # 同时发往 Ollama 的请求数，建议与 OLLAMA_NUM_PARALLEL 一致
+    LLM_RESERVED_INTERACTIVE = 1  # 只留给交互请求的名额，后台任务占满其余名额时交互请求仍可立即执行
+    LLM_MAX_QUEUED = 256  # 每个优先级最多排队的请求数，超出时立即拒绝
+    LLM_QUEUE_TIMEOUT = {"interactive": 60, "evaluation": 300, "enrichment": 3600, "embedding": 3600}  # 排队超时（秒）
+    LLM_REQUEST_TIMEOUT = 600  # 单次请求超时（秒）
+
+    # 观测: /metrics 需要安装 prometheus_client；开启追踪时各阶段同时生成 OpenTelemetry span（需安装 opentelemetry-api）
+    TRACING_ENABLED = os.getenv("TRACING_ENABLED", "false").lower() == "true"
+
+    # 会话配置
+    SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory")  # memory / sqlite
+    SESSION_DB_PATH = "sessions.db"
+    SESSION_HISTORY_WINDOW = 10  # 每个会话保留的最近消息数（5 轮问答）
+    SESSION_MESSAGE_MAX_CHARS = 2000  # 单条历史消息写入提示词的最大字符数
+    SESSION_TTL = 1800  # 会话空闲过期时间（秒）
+    SESSION_MAX_COUNT = 10000
+
+    # 答案缓存配置
+    ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+    ANSWER_CACHE_TTL = 3600  # 条目有效期（秒）
+    ANSWER_CACHE_MAX_ENTRIES = 1000
+    ANSWER_CACHE_SEMANTIC = True  # 是否按嵌入相似度匹配近似问题
+    ANSWER_CACHE_SIMILARITY = 0.95  # 语义匹配的 cosine 相似度阈值
+
+    # 问答库路由: 用户问题与问答语料中的问题一致或高度相似时直接返回官方回答，不经过检索、生成与评估
+    QA_ROUTER_ENABLED = os.getenv("QA_ROUTER_ENABLED", "true").lower() == "true"
+    QA_ROUTER_SIMILARITY = 0.95  # 问题嵌入的 cosine 相似度阈值（问题中的数字还需一致）
+
+    # 置信度评估: llm（再调用一次模型）/ heuristic（按检索得分与来源重合估计，不调用模型）/
+    # background（先返回启发式评估，模型评估在后台完成后通过接口或流式事件获取）
+    EVALUATION_MODE = os.getenv("EVALUATION_MODE", "llm")
+    EVALUATION_MAX_WORKERS = 2  # 后台评估的并发数
+    EVALUATION_RESULT_TTL = 3600  # 后台评估结果的保留时间（秒）
+    EVALUATION_MAX_RESULTS = 10000
+    # 流式接口在 background 模式下等待后台评估的最长时间（秒），超时后推送 pending 状态，客户端改为轮询评估接口
+    EVALUATION_STREAM_WAIT = float(os.getenv("EVALUATION_STREAM_WAIT", 60))
+    EVALUATION_HEURISTIC_THRESHOLDS = (0.35, 0.6)  # 启发式得分达到 中 / 高 的阈值
+
+    # 批量分析配置
+    BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", 4))  # 同时进行生成与评估的问题数
+    BATCH_RETRIEVAL_SIZE = 32  # 每次批量嵌入与矩阵检索的问题数
+    BATCH_PRIORITY = "enrichment"  # 批量分析的模型请求优先级，低于在线问答
+
+    # 系统状态文件
+    SYSTEM_STATE_PATH = "system_state.json"
+
     API_HOST = os.getenv("API_HOST", "0.0.0.0")
     API_PORT = int(os.getenv("API_PORT", 8000))
     # CORS 配置
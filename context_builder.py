@@ -0,0 +1,196 @@
+"""
+上下文组装
+按 token 预算把检索结果拼装为提示词上下文:
+1. 去除内容完全相同的分块
+2. 同一来源的相邻分块（chunk_index 连续）合并，并去掉超长段落切分造成的重叠文本
+3. 按检索排序依次放入，直到达到 token 预算
+每块以 "来源 N (file.pdf p.45):" 开头，生成模型按该标注引用
+token 数优先使用生成模型的分词器计算，未安装 transformers 或无法加载时按字符近似估计
+"""
+
+import hashlib
+import math
+import re
+from typing import Dict, List, Optional
+
+from chunker import format_citation
+from config import Config
+
+CJK_PATTERN = re.compile(r"[一-鿿㐀-䶿豈-﫿]")
+MIN_OVERLAP = 20  # 相邻分块的重叠文本少于该长度时直接以换行拼接
+
+
+class TokenCounter:
+    """token 计数：优先使用 Hugging Face 分词器，否则按字符近似估计"""
+
+    def __init__(self, tokenizer_name: str = None):
+        """
+        参数:
+            tokenizer_name: 分词器名称或本地路径，默认为 Config.CONTEXT_TOKENIZER，为空时直接使用近似估计；
+                只加载本地已有的分词器（本地路径或已下载到 Hugging Face 缓存），离线部署不会在请求中联网下载
+        """
+        self.tokenizer = None
+        tokenizer_name = tokenizer_name or Config.CONTEXT_TOKENIZER
+        if tokenizer_name:
+            try:
+                from transformers import AutoTokenizer
+                self.tokenizer = AutoTokenizer.from_pretrained(tokenizer_name, local_files_only=True)
+            except Exception as e:
+                print(f"分词器 {tokenizer_name} 加载失败，token 数按字符近似估计: {str(e)}")
+
+    @property
+    def exact(self) -> bool:
+        return self.tokenizer is not None
+
+    def count(self, text: str) -> int:
+        """计算文本的 token 数"""
+        if self.tokenizer is not None:
+            return len(self.tokenizer.encode(text, add_special_tokens=False))
+        # Qwen 系列分词器下中文约 1.4 字/token，其余字符约 3.5 字符/token
+        cjk = len(CJK_PATTERN.findall(text))
+        other = len(text) - cjk - text.count(" ") - text.count("\n")
+        return math.ceil(cjk / 1.4 + max(other, 0) / 3.5)
+
+
+def overlap_length(previous: str, current: str, max_overlap: int) -> int:
+    """previous 的后缀与 current 的前缀相同的最大长度（只检查不超过 max_overlap 的长度）"""
+    for size in range(min(len(previous), len(current), max_overlap), 0, -1):
+        if previous.endswith(current[:size]):
+            return size
+    return 0
+
+
+class ContextBuilder:
+    """按 token 预算组装检索上下文"""
+
+    def __init__(self, token_budget: int = None, token_counter: TokenCounter = None):
+        """
+        参数:
+            token_budget: 上下文 token 预算，默认为 Config.CONTEXT_TOKEN_BUDGET
+            token_counter: token 计数器，默认按 Config.CONTEXT_TOKENIZER 创建
+        """
+        self.token_budget = token_budget or Config.CONTEXT_TOKEN_BUDGET
+        self.token_counter = token_counter or TokenCounter()
+        # 重叠检测的上限留出余量，文本分割器的实际重叠可能略大于 CHUNK_OVERLAP
+        self.max_overlap = int(Config.CHUNK_OVERLAP * 1.5)
+
+    def build(self, results: List[Dict], token_budget: int = None) -> Dict:
+        """
+        组装上下文
+
+        参数:
+            results: 按相关度排序的检索结果
+            token_budget: 本次请求的 token 预算，默认为初始化时的预算
+
+        返回:
+            {"content": 上下文文本, "context": 实际放入的检索结果, "stats": 组装统计}
+        """
+        budget = token_budget or self.token_budget
+        unique, duplicates = self._deduplicate(results)
+        blocks = self._merge_adjacent(unique)
+
+        parts, used = [], []
+        packed_tokens = 0
+        dropped = 0
+        for block in blocks:
+            text = f"来源 {len(parts) + 1} ({block['citation']}):\n{block['content']}"
+            tokens = self.token_counter.count(text)
+            if packed_tokens + tokens > budget:
+                # 放不下的块跳过，后面更短的块仍可能放得下
+                dropped += len(block["members"])
+                continue
+            parts.append(text)
+            used.extend(block["members"])
+            packed_tokens += tokens
+
+        return {
+            "content": "\n\n".join(parts),
+            "context": used,
+            "stats": {
+                "token_budget": budget,
+                "packed_tokens": packed_tokens,
+                "exact_tokens": self.token_counter.exact,
+                "retrieved_chunks": len(results),
+                "duplicate_chunks": duplicates,
+                "merged_chunks": len(unique) - len(blocks),
+                "packed_chunks": len(used),
+                "dropped_chunks": dropped
+            }
+        }
+
+    @staticmethod
+    def _deduplicate(results: List[Dict]):
+        """去除内容完全相同的分块，保留排序靠前的一条"""
+        seen = set()
+        unique = []
+        for res in results:
+            digest = hashlib.sha1(res["content"].strip().encode("utf-8")).digest()
+            if digest in seen:
+                continue
+            seen.add(digest)
+            unique.append(res)
+        return unique, len(results) - len(unique)
+
+    def _merge_adjacent(self, results: List[Dict]) -> List[Dict]:
+        """
+        合并同一来源中 chunk_index 连续的分块
+
+        返回:
+            按块内最靠前的检索排名排序的块列表，每块含 source / citation / content / members
+        """
+        groups = {}
+        for rank, res in enumerate(results):
+            metadata = res.get("metadata", {})
+            source = metadata.get("source", "未知来源")
+            groups.setdefault(source, []).append((rank, metadata.get("chunk_index"), res))
+
+        blocks = []
+        for source, members in groups.items():
+            indexed = sorted((m for m in members if m[1] is not None), key=lambda m: m[1])
+            # 没有 chunk_index 的分块（问答数据、旧版索引）单独成块
+            blocks.extend(self._block(source, [m]) for m in members if m[1] is None)
+
+            run = []
+            for member in indexed:
+                if run and member[1] != run[-1][1] + 1:
+                    blocks.append(self._block(source, run))
+                    run = []
+                run.append(member)
+            if run:
+                blocks.append(self._block(source, run))
+
+        blocks.sort(key=lambda block: block["rank"])
+        return blocks
+
+    def _block(self, source: str, members: List) -> Dict:
+        """将按 chunk_index 排好序的连续分块拼接为一块，去掉相邻分块间的重叠文本"""
+        content = members[0][2]["content"]
+        for _, _, res in members[1:]:
+            text = res["content"]
+            overlap = overlap_length(content, text, self.max_overlap)
+            # 按段落分块的相邻分块之间没有重叠，过短的匹配视为巧合
+            content += text[overlap:] if overlap >= MIN_OVERLAP else "\n" + text
+        # 合并后的块引用所有分块覆盖的页码范围
+        metadata = dict(members[0][2].get("metadata", {}))
+        paged = [res["metadata"] for _, _, res in members if res.get("metadata", {}).get("page_start") is not None]
+        if paged:
+            metadata["page_start"] = min(m["page_start"] for m in paged)
+            metadata["page_end"] = max(m.get("page_end", m["page_start"]) for m in paged)
+        return {
+            "source": source,
+            "citation": format_citation(metadata),
+            "content": content,
+            "rank": min(rank for rank, _, _ in members),
+            "members": [res for _, _, res in sorted(members, key=lambda m: m[0])]
+        }
+
+
+_default_builder: Optional[ContextBuilder] = None
+
+
+def get_context_builder() -> ContextBuilder:
+    """进程内共享的上下文组装器（分词器只加载一次）"""
+    global _default_builder
+    if _default_builder is None:
+        _default_builder = ContextBuilder()
+    return _default_builder
@@ -0,0 +1,286 @@
+"""
+异步爬取引擎
+PDFCrawler 与 QACrawler 共用:
+1. 每个域名一个令牌桶限速，代替固定的随机等待
+2. 有上限的并发下载，大缓冲流式写入临时文件后原子替换，中断不会留下半个文件
+3. 持久化的爬取队列（检查点），中断后重新运行只处理未完成的任务
+4. 已完成的任务带 ETag / Last-Modified 发送条件请求，服务器返回 304 时跳过；
+   内容会随时间变化且没有校验信息的任务（如按时间倒序的问答列表页）标记 refresh，每次运行都重新获取
+"""
+
+import asyncio
+import json
+import os
+import time
+from typing import Callable, Dict, Iterable, List, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+from config import Config
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+def atomic_write(path: str, data: bytes):
+    """写入临时文件后原子替换"""
+    tmp_path = f"{path}.part"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class TokenBucket:
+    """令牌桶：平均每秒 rate 个请求，允许 burst 个请求的突发"""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.capacity = max(burst, 1)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        """取得一个令牌，令牌不足时等待补充"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class CrawlCheckpoint:
+    """
+    爬取队列与任务状态，以 JSON 原子写入
+
+    每个任务: {"url", "path", "params", "method", "data", "refresh", "status", "etag", "last_modified",
+              "attempts", "error"}
+    status 取值 pending / done / failed / empty；refresh 为真的任务完成后仍每次重新获取
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.tasks = {}
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    self.tasks = json.load(f).get("tasks", {})
+            except (OSError, ValueError) as e:
+                print(f"读取爬取检查点 {path} 失败，将重新开始: {str(e)}")
+
+    def add(self, key: str, task: Dict):
+        """
+        登记任务，已登记的任务保留原有状态，只更新请求参数；
+        未登记但目标文件已存在的任务（由旧版爬虫下载）视为已完成，需要刷新的任务除外
+        """
+        if key not in self.tasks:
+            status = "done" if os.path.exists(task["path"]) and not task.get("refresh") else "pending"
+            self.tasks[key] = {"status": status, "attempts": 0}
+        self.tasks[key].update(task)
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        atomic_write(self.path, json.dumps({"tasks": self.tasks}, ensure_ascii=False).encode("utf-8"))
+
+
+class CrawlEngine:
+    """异步爬取引擎"""
+
+    def __init__(self, checkpoint_path: str, headers: Dict[str, str] = None, concurrency: int = None,
+                 rate: float = None, burst: int = None, transport: httpx.AsyncBaseTransport = None):
+        """
+        参数:
+            checkpoint_path: 检查点文件路径
+            headers: 所有请求共用的请求头
+            concurrency: 同时进行的下载数，默认为 Config.CRAWL_CONCURRENCY
+            rate: 每个域名每秒的请求数，默认为 Config.CRAWL_RATE
+            burst: 每个域名允许的突发请求数，默认为 Config.CRAWL_BURST
+            transport: httpx 传输层，测试时可替换为本地服务
+        """
+        self.checkpoint = CrawlCheckpoint(checkpoint_path)
+        self.headers = headers or {}
+        self.concurrency = concurrency or Config.CRAWL_CONCURRENCY
+        self.rate = rate or Config.CRAWL_RATE
+        self.burst = burst or Config.CRAWL_BURST
+        self.transport = transport
+        self._buckets = {}
+        self._client: Optional[httpx.AsyncClient] = None
+        self._saved_at = time.monotonic()
+
+    async def __aenter__(self) -> "CrawlEngine":
+        self._client = httpx.AsyncClient(
+            headers=self.headers, timeout=Config.CRAWL_TIMEOUT, follow_redirects=True,
+            limits=httpx.Limits(max_connections=self.concurrency * 2), transport=self.transport
+        )
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.checkpoint.save()
+        await self._client.aclose()
+        self._client = None
+
+    def _bucket(self, url: str) -> TokenBucket:
+        host = urlsplit(url).netloc
+        if host not in self._buckets:
+            self._buckets[host] = TokenBucket(self.rate, self.burst)
+        return self._buckets[host]
+
+    async def _send(self, method: str, url: str, stream: bool = False, **kwargs) -> httpx.Response:
+        """
+        限速发送请求，网络错误与 429 / 5xx 响应按指数退避重试（优先使用 Retry-After）
+
+        stream 为真时返回未读取响应体的响应，由调用方负责关闭
+        """
+        last_error = None
+        for attempt in range(Config.CRAWL_MAX_RETRIES + 1):
+            await self._bucket(url).acquire()
+            wait = Config.CRAWL_RETRY_BACKOFF * (2 ** attempt)
+            try:
+                request = self._client.build_request(method, url, **kwargs)
+                response = await self._client.send(request, stream=stream)
+                if response.status_code not in RETRY_STATUS:
+                    return response
+                last_error = httpx.HTTPStatusError(f"状态码 {response.status_code}", request=request, response=response)
+                retry_after = response.headers.get("Retry-After", "")
+                if retry_after.isdigit():
+                    wait = max(wait, int(retry_after))
+                await response.aclose()
+            except httpx.TransportError as e:
+                last_error = e
+            if attempt < Config.CRAWL_MAX_RETRIES:
+                await asyncio.sleep(wait)
+        raise last_error
+
+    async def fetch(self, url: str, method: str = "GET", **kwargs) -> httpx.Response:
+        """限速请求并读取完整响应（用于列表页、接口查询），非 2xx 响应抛出异常"""
+        response = await self._send(method, url, **kwargs)
+        response.raise_for_status()
+        return response
+
+    def add_tasks(self, tasks: Iterable[Dict]):
+        """
+        加入爬取队列
+
+        参数:
+            tasks: {"key": 唯一标识, "url", "path": 保存路径, "params": 可选, "method": 可选, "data": 可选,
+                    "refresh": 可选，为真时每次运行都重新获取}
+        """
+        for task in tasks:
+            task = dict(task)
+            self.checkpoint.add(task.pop("key"), task)
+        self.checkpoint.save()
+
+    async def run(self, keys: List[str] = None, transform: Callable[[bytes], Optional[bytes]] = None,
+                  limit: int = None, revalidate: bool = True) -> Dict[str, int]:
+        """
+        执行爬取队列中的任务
+
+        参数:
+            keys: 只执行这些任务，默认为队列中的全部任务
+            transform: 对响应内容的转换（如把 HTML 解析为 JSON），返回 None 表示没有有效内容；
+                为空时响应体直接流式写入文件
+            limit: 新下载的文件数达到该值后不再开始新任务
+            revalidate: 是否对已完成的任务发送条件请求，检查文件是否有更新（refresh 任务总是重新获取）
+
+        返回:
+            {"downloaded", "unchanged", "skipped", "empty", "failed"} 计数
+        """
+        stats = {"downloaded": 0, "unchanged": 0, "skipped": 0, "empty": 0, "failed": 0}
+        queue = asyncio.Queue()
+        for key in (self.checkpoint.tasks if keys is None else keys):
+            entry = self.checkpoint.tasks[key]
+            if entry["status"] == "done" and not revalidate and not entry.get("refresh"):
+                stats["skipped"] += 1
+                continue
+            queue.put_nowait(key)
+
+        active = 0
+
+        async def worker():
+            nonlocal active
+            while not queue.empty():
+                if limit is not None and stats["downloaded"] + active >= limit:
+                    return
+                key = queue.get_nowait()
+                active += 1
+                try:
+                    outcome = await self._run_task(key, transform)
+                finally:
+                    active -= 1
+                stats[outcome] += 1
+                self._save_periodically()
+
+        try:
+            await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+        finally:
+            self.checkpoint.save()
+        return stats
+
+    def _save_periodically(self):
+        """任务完成后按间隔保存检查点，避免每个任务都重写整个文件"""
+        if time.monotonic() - self._saved_at >= Config.CRAWL_CHECKPOINT_INTERVAL:
+            self.checkpoint.save()
+            self._saved_at = time.monotonic()
+
+    async def _run_task(self, key: str, transform: Callable[[bytes], Optional[bytes]] = None) -> str:
+        """执行单个任务，返回 downloaded / unchanged / skipped / empty / failed"""
+        entry = self.checkpoint.tasks[key]
+        path = entry["path"]
+        headers = {}
+        if entry["status"] == "done" and os.path.exists(path):
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+            if not headers and not entry.get("refresh"):
+                # 服务器不提供校验信息时无法判断是否变化，保留已有文件
+                return "skipped"
+
+        entry["attempts"] = entry.get("attempts", 0) + 1
+        try:
+            response = await self._send(
+                entry.get("method", "GET"), entry["url"], stream=True, headers=headers,
+                params=entry.get("params"), data=entry.get("data")
+            )
+            try:
+                if response.status_code == 304:
+                    return "unchanged"
+                response.raise_for_status()
+                os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+                if transform is None:
+                    await self._stream_to_file(response, path)
+                else:
+                    content = transform(await response.aread())
+                    if content is None:
+                        entry.update(status="empty", error=None)
+                        return "empty"
+                    atomic_write(path, content)
+            finally:
+                await response.aclose()
+        except Exception as e:
+            entry.update(status="failed", error=str(e))
+            print(f"爬取 {entry['url']} 失败: {str(e)}")
+            return "failed"
+
+        entry.update(
+            status="done", error=None,
+            etag=response.headers.get("ETag"), last_modified=response.headers.get("Last-Modified")
+        )
+        return "downloaded"
+
+    @staticmethod
+    async def _stream_to_file(response: httpx.Response, path: str):
+        """以大缓冲流式写入临时文件，完成后原子替换"""
+        tmp_path = f"{path}.part"
+        with open(tmp_path, "wb") as f:
+            async for chunk in response.aiter_bytes(Config.CRAWL_CHUNK_SIZE):
+                f.write(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
@@ -1,122 +1,113 @@
 import os
-import requests
-import time
-import random
+import asyncio
+import math
 import sys
-from tqdm import tqdm
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from config import Config
+from data_collection.crawl_engine import CrawlEngine
+
+QUERY_URL = "http://www.cninfo.com.cn/new/hisAnnouncement/query"
+STATIC_URL = "http://static.cninfo.com.cn/"
+PAGE_SIZE = 30
 
 
 class PDFCrawler:
-    def __init__(self):
+    def __init__(self, query_url=None, static_url=None, transport=None):
+        """
+        参数:
+            query_url: 公告查询接口，默认为巨潮资讯网
+            static_url: PDF 文件地址前缀，默认为巨潮资讯网
+            transport: httpx 传输层，测试时可替换为本地服务
+        """
         self.base_url = "http://www.cninfo.com.cn/new/commonUrl/pageOfSearch?url=disclosure/list/search&checkedCategory=category_ndbg_szsh#szse"
+        self.query_url = query_url or QUERY_URL
+        self.static_url = static_url or STATIC_URL
         self.download_dir = Config.PDF_DIR
         os.makedirs(self.download_dir, exist_ok=True)
         self.headers = {
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
             "Referer": "http://www.cninfo.com.cn/"
         }
-        self.session = requests.Session()
-        self.session.headers.update(self.headers)
-
-    def get_report_links(self, max_pages=10):
-        """获取年报链接"""
-        report_links = []
-        page = 1
-
-        while page <= max_pages and len(report_links) < 150:  # 目标150个
-            print(f"正在处理第 {page} 页...")
-            params = {
-                "pageNum": page,
-                "pageSize": 30,
-                "column": "szse",
-                "tabName": "fulltext",
-                "plate": "",
-                "stock": "",
-                "searchkey": "",
-                "secid": "",
-                "category": "category_ndbg_szsh",
-                "trade": "",
-                "seDate": "",
-                "sortName": "",
-                "sortType": "",
-                "isHLtitle": "true"
-            }
-
-            try:
-                response = self.session.post(
-                    "http://www.cninfo.com.cn/new/hisAnnouncement/query",
-                    params=params,
-                    timeout=30
-                )
-                data = response.json()
-
-                if data and "announcements" in data:
-                    for item in data["announcements"]:
-                        # if "年度报告" in item["announcementTitle"] and item["adjunctUrl"].endswith(".pdf"):
-                            report_links.append({
-                                "title": item["announcementTitle"],
-                                "url": "http://static.cninfo.com.cn/" + item["adjunctUrl"],
-                                "code": item["secCode"],
-                                "name": item["secName"],
-                                "date": item["announcementTime"] // 1000  # 转换为秒级时间戳
-                            })
-                else:
-                    print(f"第 {page} 页未找到数据")
-
-                page += 1
-                time.sleep(random.uniform(1.0, 3.0))  # 随机延迟
-
-            except Exception as e:
-                print(f"获取第 {page} 页时出错: {str(e)}")
-                break
-
-        return report_links
+        self.checkpoint_path = os.path.join(Config.CRAWL_STATE_DIR, "pdf_crawler.json")
+        self.transport = transport
+
+    async def get_report_links(self, engine, max_pages=10, max_count=150):
+        """并发获取年报列表页，按页码顺序返回最多 max_count 个年报链接"""
+        pages = min(max_pages, math.ceil(max_count / PAGE_SIZE))
+        results = await asyncio.gather(*(self._get_page(engine, page) for page in range(1, pages + 1)))
+        return [report for page_reports in results for report in page_reports][:max_count]
+
+    async def _get_page(self, engine, page):
+        """获取一页年报列表"""
+        print(f"正在处理第 {page} 页...")
+        params = {
+            "pageNum": page,
+            "pageSize": PAGE_SIZE,
+            "column": "szse",
+            "tabName": "fulltext",
+            "plate": "",
+            "stock": "",
+            "searchkey": "",
+            "secid": "",
+            "category": "category_ndbg_szsh",
+            "trade": "",
+            "seDate": "",
+            "sortName": "",
+            "sortType": "",
+            "isHLtitle": "true"
+        }
 
-    def download_pdf(self, report):
-        """下载PDF文件"""
         try:
-            file_name = f"{report['code']}_{report['date']}_{report['title'][:50]}.pdf"
-            file_path = os.path.join(self.download_dir, file_name)
-
-            # 检查文件是否已存在
-            if os.path.exists(file_path):
-                return False
-
-            response = self.session.get(report["url"], stream=True, timeout=60)
-            if response.status_code == 200:
-                with open(file_path, "wb") as f:
-                    for chunk in response.iter_content(chunk_size=1024):
-                        if chunk:
-                            f.write(chunk)
-                print(f"已下载: {file_name}")
-                return True
-            else:
-                print(f"下载失败: {report['url']} - 状态码: {response.status_code}")
-                return False
+            response = await engine.fetch(self.query_url, method="POST", params=params)
+            data = response.json()
         except Exception as e:
-            print(f"下载 {report['url']} 时出错: {str(e)}")
-            return False
+            print(f"获取第 {page} 页时出错: {str(e)}")
+            return []
+
+        if not data or not data.get("announcements"):
+            print(f"第 {page} 页未找到数据")
+            return []
+        return [
+            {
+                "title": item["announcementTitle"],
+                "url": self.static_url + item["adjunctUrl"],
+                "code": item["secCode"],
+                "name": item["secName"],
+                "date": item["announcementTime"] // 1000  # 转换为秒级时间戳
+            }
+            for item in data["announcements"]
+        ]
+
+    def report_task(self, report):
+        """年报对应的下载任务，文件名格式: {股票代码}_{公告时间戳}_{标题}.pdf"""
+        file_name = f"{report['code']}_{report['date']}_{report['title'][:50]}.pdf"
+        return {"key": report["url"], "url": report["url"], "path": os.path.join(self.download_dir, file_name)}
+
+    async def run_async(self, max_count=150):
+        """
+        获取年报链接并下载
+
+        上次中断时未完成的下载会继续进行，已下载的文件通过条件请求确认是否有更新
+
+        返回:
+            下载统计
+        """
+        async with CrawlEngine(self.checkpoint_path, self.headers, transport=self.transport) as engine:
+            print("开始获取年报链接...")
+            reports = await self.get_report_links(engine, max_count=max_count)
+            print(f"共获取到 {len(reports)} 份年报链接")
+            engine.add_tasks(self.report_task(report) for report in reports)
+            stats = await engine.run(limit=max_count)
+
+        print(f"下载完成，共下载 {stats['downloaded']} 份PDF年报，"
+              f"{stats['unchanged'] + stats['skipped']} 份已是最新，失败 {stats['failed']} 份")
+        return stats
 
     def run(self, max_count=150):
         """运行爬虫"""
-        print("开始获取年报链接...")
-        reports = self.get_report_links()
-        print(f"共获取到 {len(reports)} 份年报链接")
-
-        downloaded = 0
-        for report in tqdm(reports):
-            if downloaded >= max_count:
-                break
-
-            if self.download_pdf(report):
-                downloaded += 1
-                time.sleep(random.uniform(0.5, 2.0))  # 下载间隔
-
-        print(f"下载完成，共下载 {downloaded} 份PDF年报")
+        return asyncio.run(self.run_async(max_count))
 
 
 if __name__ == "__main__":
     crawler = PDFCrawler()
-    crawler.run()
\ No newline at end of file
+    crawler.run()
@@ -1,17 +1,20 @@
 import os
-import requests
+import asyncio
 import json
-import time
-import random
 from bs4 import BeautifulSoup
 import sys
-from tqdm import tqdm
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from config import Config
+from data_collection.crawl_engine import CrawlEngine
 
 class QACrawler:
-    def __init__(self):
-        self.base_url = "https://sns.sseinfo.com/ajax/feeds.do"
+    def __init__(self, base_url=None, transport=None):
+        """
+        参数:
+            base_url: 问答接口地址，默认为上证e互动
+            transport: httpx 传输层，测试时可替换为本地服务
+        """
+        self.base_url = base_url or "https://sns.sseinfo.com/ajax/feeds.do"
         self.download_dir = Config.JSON_DIR
         os.makedirs(self.download_dir, exist_ok=True)
         self.headers = {
@@ -19,31 +22,30 @@ class QACrawler:
             "Referer": "https://sns.sseinfo.com/",
             "X-Requested-With": "XMLHttpRequest"
         }
-        self.session = requests.Session()
-        self.session.headers.update(self.headers)
+        self.checkpoint_path = os.path.join(Config.CRAWL_STATE_DIR, "qa_crawler.json")
+        self.transport = transport
 
-    def get_qa_data(self, page=1, per_page=20):
-        """获取问答数据"""
+    def page_task(self, page=1, per_page=20):
+        """
+        问答页对应的爬取任务
+
+        列表按时间倒序（lastid=-1），同一页的内容随新问答不断变化，且接口不提供 ETag / Last-Modified，
+        因此标记为 refresh，每次运行都重新获取
+        """
         params = {
             "type": "10",
             "page": page,
             "lastid": -1,
-            "show":1,
+            "show": 1,
             "pageSize": per_page
         }
-
-        try:
-            response = self.session.get(self.base_url, params=params, timeout=30)
-            if response.status_code == 200:
-                # html_text = html.fromstring(response.content.decode('utf-8'))
-
-                return response.content.decode('utf-8')
-            else:
-                print(f"获取第 {page} 页失败，状态码: {response.status_code}")
-                return None
-        except Exception as e:
-            print(f"获取第 {page} 页时出错: {str(e)}")
-            return None
+        return {
+            "key": f"page_{page}_{per_page}",
+            "url": self.base_url,
+            "params": params,
+            "path": os.path.join(self.download_dir, f"qa_page_{page}.json"),
+            "refresh": True
+        }
 
     def parse_qa_data(self, data):
         """解析问答数据"""
@@ -78,40 +80,37 @@ class QACrawler:
 
         return qa_list
 
-    def save_to_json(self, data, page):
-        """保存为JSON文件"""
-        file_name = f"qa_page_{page}.json"
-        file_path = os.path.join(self.download_dir, file_name)
+    def to_json(self, content):
+        """把问答页 HTML 解析为 JSON，没有有效问答时返回 None"""
+        qa_data = self.parse_qa_data(content.decode("utf-8"))
+        if not qa_data:
+            return None
+        return json.dumps(qa_data, ensure_ascii=False, indent=2).encode("utf-8")
 
-        with open(file_path, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+    async def run_async(self, max_pages=10, per_page=20):
+        """
+        并发获取问答页并保存为 JSON
 
-        return file_path
+        每次运行都重新获取全部问答页（内容随新问答变化）
+        """
+        tasks = [self.page_task(page, per_page) for page in range(1, max_pages + 1)]
+        async with CrawlEngine(self.checkpoint_path, self.headers, transport=self.transport) as engine:
+            engine.add_tasks(tasks)
+            stats = await engine.run(keys=[task["key"] for task in tasks], transform=self.to_json)
 
-    def run(self, max_pages=10, per_page=20):
-        """运行爬虫"""
         all_qa = []
-
-        for page in tqdm(range(1, max_pages + 1), desc="Processing Question"):
-            print(f"正在获取第 {page} 页问答数据...")
-            raw_data = self.get_qa_data(page, per_page)
-
-            if raw_data:
-                qa_data = self.parse_qa_data(raw_data)
-                if qa_data:
-                    self.save_to_json(qa_data, page)
-                    all_qa.extend(qa_data)
-                    print(f"第 {page} 页获取到 {len(qa_data)} 条问答")
-                else:
-                    print(f"第 {page} 页未解析到有效问答")
-            else:
-                print(f"第 {page} 页获取失败")
-
-            time.sleep(random.uniform(1.5, 3.0))  # 请求间隔
-
-        print(f"爬取完成，共获取 {len(all_qa)} 条问答数据")
+        for task in tasks:
+            if os.path.exists(task["path"]):
+                with open(task["path"], "r", encoding="utf-8") as f:
+                    all_qa.extend(json.load(f))
+        print(f"爬取完成，新获取 {stats['downloaded']} 页，{stats['empty']} 页未解析到有效问答，"
+              f"失败 {stats['failed']} 页，共 {len(all_qa)} 条问答数据")
         return all_qa
 
+    def run(self, max_pages=10, per_page=20):
+        """运行爬虫"""
+        return asyncio.run(self.run_async(max_pages, per_page))
+
 
 if __name__ == "__main__":
     crawler = QACrawler()
@@ -1,98 +1,346 @@
 import os
+import re
 import json
+import itertools
+import multiprocessing
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
 # import pdfplumber
-from multiprocessing import Pool
 from tqdm import tqdm
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+from chunker import PDFChunker
 from config import Config
 import fitz
 
+# PDFCrawler.report_task 的文件名格式: {股票代码}_{公告时间戳}_{标题}.pdf
+PDF_NAME_PATTERN = re.compile(r"^(\d{6})_(\d+)_(.+)\.pdf$")
+YEAR_PATTERN = re.compile(r"((?:19|20)\d{2})")
+
+
+def parse_pdf_filename(filename: str) -> dict:
+    """
+    从年报文件名解析结构化元数据
+
+    返回:
+        stock_code / announce_date / title / company_name / report_year / report_type 中能解析出的字段
+    """
+    match = PDF_NAME_PATTERN.match(filename)
+    if not match:
+        return {}
+    code, timestamp, title = match.groups()
+    metadata = {
+        "stock_code": code,
+        "announce_date": datetime.fromtimestamp(int(timestamp)).strftime("%Y-%m-%d"),
+        "title": title
+    }
+    # 标题形如 "平安银行：2023年年度报告"
+    for separator in ("：", ":"):
+        if separator in title:
+            metadata["company_name"] = title.split(separator, 1)[0].strip()
+            break
+    year = YEAR_PATTERN.search(title)
+    if year:
+        metadata["report_year"] = year.group(1)
+    if "半年度" in title:
+        metadata["report_type"] = "半年度"
+    elif "季度" in title:
+        metadata["report_type"] = "季度"
+    elif "年度报告" in title or "年报" in title:
+        metadata["report_type"] = "年度"
+    return metadata
+
 
 class DataLoader:
     def __init__(self):
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=Config.CHUNK_SIZE,
-            chunk_overlap=Config.CHUNK_OVERLAP
+        self.pdf_metadata = self._load_pdf_metadata()
+
+    @staticmethod
+    def _load_pdf_metadata():
+        """加载 PDFEnhancer 生成的 metadata.json（文件名 -> 公司、代码、年份等）"""
+        metadata_file = os.path.join(Config.PDF_DIR, "metadata.json")
+        if not os.path.exists(metadata_file):
+            return {}
+        try:
+            with open(metadata_file, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"读取 {metadata_file} 失败: {str(e)}")
+            return {}
+
+    def pdf_file_metadata(self, filename):
+        """
+        合并文件名解析结果与 PDFEnhancer 的元数据
+
+        股票代码等来自交易所接口的文件名字段优先，缺失字段再由 LLM 生成的元数据补齐
+        """
+        metadata = parse_pdf_filename(filename)
+        enhanced = self.pdf_metadata.get(filename) or {}
+        for field in ("company_name", "stock_code", "report_year", "report_type"):
+            value = enhanced.get(field)
+            if field not in metadata and value:
+                if field == "report_year":
+                    year = YEAR_PATTERN.search(str(value))
+                    value = year.group(1) if year else None
+                if value:
+                    metadata[field] = str(value).strip()
+        return metadata
+
+    def _pdf_base_metadata(self, filename):
+        """PDF 分块共享的元数据（页数与 chunk_index 由解析进程补充）"""
+        return {
+            "source": filename,
+            "type": "pdf",
+            **self.pdf_file_metadata(filename)
+        }
+
+    @staticmethod
+    def _list_files(directory, suffix):
+        if not os.path.isdir(directory):
+            return []
+        return [f for f in os.listdir(directory) if f.endswith(suffix)]
+
+    def iter_documents(self, pdf_files=None, json_files=None, workers=None):
+        """
+        流式解析文档，按页批次逐个产出分块
+
+        文件在进程池中解析（进程数默认等于 CPU 核数），解析进程每读完一页就把该页产生的分块
+        经有界队列发回，同时提交的文件数与队列中的批次数都有上限；消费方处理较慢时解析进程阻塞在队列上，
+        内存占用与页数成正比，与单个文件大小和语料规模无关。不同文件的分块可能交错产出
+
+        参数:
+            pdf_files: PDF 文件名列表，为 None 时解析目录下全部 PDF
+            json_files: JSON 文件名列表，为 None 时解析目录下全部 JSON
+            workers: 解析进程数，默认为 Config.INGEST_WORKERS 或 CPU 核数
+
+        产出:
+            {"content": 分块文本, "metadata": 元数据}
+        """
+        if pdf_files is None:
+            pdf_files = self._list_files(Config.PDF_DIR, ".pdf")
+        if json_files is None:
+            json_files = self._list_files(Config.JSON_DIR, ".json")
+        tasks = [(extract_pdf, os.path.join(Config.PDF_DIR, f), self._pdf_base_metadata(f)) for f in pdf_files]
+        tasks += [(extract_json, os.path.join(Config.JSON_DIR, f), f) for f in json_files]
+        if not tasks:
+            return
+
+        workers = min(workers or Config.INGEST_WORKERS or os.cpu_count() or 1, len(tasks))
+        max_pending = workers * Config.INGEST_PENDING_PER_WORKER
+        task_iter = enumerate(tasks)
+        pending = {}  # 任务编号 -> future，收到任务的结束标记后移除
+        context = multiprocessing.get_context()
+        batches = context.Queue(maxsize=max_pending)
+        stop = context.Event()
+        # 分块参数通过 initializer 传入，spawn 方式启动的子进程不会继承运行时修改的 Config
+        executor = ProcessPoolExecutor(
+            max_workers=workers, mp_context=context, initializer=_init_worker,
+            initargs=(Config.CHUNK_SIZE, Config.CHUNK_OVERLAP, Config.CHUNK_DETECT_TABLES, batches, stop)
         )
+        try:
+            with tqdm(total=len(tasks), desc="解析文档") as progress:
+                while True:
+                    for task_id, (func, *args) in itertools.islice(task_iter, max_pending - len(pending)):
+                        pending[task_id] = executor.submit(_stream_task, task_id, func, *args)
+                    if not pending:
+                        break
+                    try:
+                        task_id, batch = batches.get(timeout=1)
+                    except queue.Empty:
+                        # 解析进程异常退出时不会发出结束标记，由 future 抛出异常
+                        for future in pending.values():
+                            if future.done():
+                                future.result()
+                        continue
+                    if batch is None:
+                        pending.pop(task_id).result()
+                        progress.update(1)
+                    else:
+                        yield from batch
+        finally:
+            # 提前结束时解析进程可能阻塞在队列上，通知其停止后再关闭进程池
+            stop.set()
+            executor.shutdown(wait=True, cancel_futures=True)
 
-    def _process_pdf(self, filename):
-        """处理单个PDF文件"""
-        if filename.endswith(".pdf"):
-            file_path = os.path.join(Config.PDF_DIR, filename)
-            try:
-                with fitz.open(file_path) as pdf:
-                    text = "\n".join(page.get_text() for page in pdf)
-
-                    metadata = {
-                        "source": filename,
-                        "type": "pdf",
-                        "page_count": len(pdf)
-                    }
-
-                    # 分割文本
-                    chunks = self.text_splitter.split_text(text)
-                    return [{"content": chunk, "metadata": metadata} for chunk in chunks]
-            except Exception as e:
-                print(f"Error processing {filename}: {str(e)}")
-        return []
-
-    def _process_json(self, filename):
-        """处理单个JSON文件"""
-        if filename.endswith(".json"):
-            file_path = os.path.join(Config.JSON_DIR, filename)
-            try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-
-                result = []
-                content_list =[]
-                metadata_list=[]
-                for item in data:
-                    content = f"Q: {item.get('question', '')}\nA: {item.get('answer', '')}"
-                    metadata = {
-                        "source": filename,
-                        "type": "json",
-                        "question_id": item.get("id", "")
-                    }
-                    # content_list.append(content)
-                    # metadata_list.append(metadata)
-                    result.append({"content": content, "metadata": metadata})
-                return result
-            except Exception as e:
-                print(f"Error processing {filename}: {str(e)}")
-        return []
-
-    def load_pdfs(self):
-        """并行加载PDF文档"""
-        files = [f for f in os.listdir(Config.PDF_DIR) if f.endswith(".pdf")]
-
-        with Pool(processes=min(4, os.cpu_count())) as pool:  # 限制进程数
-            results = list(tqdm(
-                pool.imap(self._process_pdf, files),
-                total=len(files),
-                desc="处理PDF文件"
-            ))
-
-        return [item for sublist in results for item in sublist]
-
-    def load_jsons(self):
-        """并行加载JSON文档"""
-        files = [f for f in os.listdir(Config.JSON_DIR) if f.endswith(".json")]
-
-        with Pool(processes=min(4, os.cpu_count())) as pool:
-            results = list(tqdm(
-                pool.imap(self._process_json, files),
-                total=len(files),
-                desc="处理JSON文件"
-            ))
-
-        return [item for sublist in results for item in sublist]
+    def load_pdfs(self, files=None):
+        """加载PDF文档，files 为空时加载目录下全部文件"""
+        return list(self.iter_documents(pdf_files=files, json_files=[]))
+
+    def load_jsons(self, files=None):
+        """加载JSON文档，files 为空时加载目录下全部文件"""
+        return list(self.iter_documents(pdf_files=[], json_files=files))
 
     def load_all_data(self):
-        """加载所有数据"""
-        pdf_data = self.load_pdfs()
-        json_data = self.load_jsons()
-        return pdf_data + json_data
+        """加载所有数据（一次性返回列表，大规模入库请使用 iter_documents）"""
+        return list(self.iter_documents())
+
+
+_worker_chunker = None
+_worker_batches = None
+_worker_stop = None
+
+
+def _init_worker(chunk_size, chunk_overlap, detect_tables, batches=None, stop=None):
+    """解析进程初始化：每个进程只创建一次分块器，并保存发回分块批次的队列"""
+    global _worker_chunker, _worker_batches, _worker_stop
+    _worker_chunker = PDFChunker(chunk_size, chunk_overlap, detect_tables)
+    _worker_batches, _worker_stop = batches, stop
+    if batches is not None:
+        # 正常结束时消费方已收到全部结束标记；提前结束时进程退出不必等待未取走的批次
+        batches.cancel_join_thread()
+
+
+def _get_chunker():
+    if _worker_chunker is None:
+        _init_worker(Config.CHUNK_SIZE, Config.CHUNK_OVERLAP, Config.CHUNK_DETECT_TABLES)
+    return _worker_chunker
+
+
+def _stream_task(task_id, func, *args):
+    """
+    在解析进程中执行解析函数，每产出一批分块就放入队列，最后放入结束标记 (task_id, None)
+
+    队列已满时阻塞等待消费方，消费方提前结束（stop 被设置）时放弃剩余批次
+    """
+    def put(item):
+        while not _worker_stop.is_set():
+            try:
+                _worker_batches.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    try:
+        for batch in func(*args):
+            if _worker_stop.is_set():
+                return
+            if batch:
+                put((task_id, batch))
+    finally:
+        put((task_id, None))
+
+
+def extract_pdf(file_path, metadata):
+    """
+    逐页读取 PDF 并按版面分块（在解析进程中执行）
+
+    分块记录起止页码、章节与内容类型（text / table），chunk_index 供上下文组装时合并相邻分块
+
+    产出:
+        分块列表，每读完一页产出该页完成的分块（跨页的分块在结束页产出）
+    """
+    batch = []
+    page = None
+    try:
+        with fitz.open(file_path) as pdf:
+            metadata = {**metadata, "page_count": len(pdf)}
+            for i, chunk in enumerate(_get_chunker().chunk(pdf)):
+                # 分块器逐页读取，分块的结束页变化说明上一页的分块已全部产出
+                if chunk["page_end"] != page and batch:
+                    yield batch
+                    batch = []
+                page = chunk["page_end"]
+                chunk_metadata = {
+                    **metadata,
+                    "chunk_index": i,
+                    "page_start": chunk["page_start"],
+                    "page_end": chunk["page_end"],
+                    "content_type": chunk["content_type"]
+                }
+                if chunk["section"]:
+                    chunk_metadata["section"] = chunk["section"]
+                batch.append({"content": chunk["content"], "metadata": chunk_metadata})
+    except Exception as e:
+        # 出错前已产出的页面保留
+        print(f"Error processing {os.path.basename(file_path)}: {str(e)}")
+    yield batch
+
+
+def extract_json(file_path, filename):
+    """
+    解析问答 JSON 文件（在解析进程中执行）
+
+    产出:
+        文件中全部问答组成的一批分块
+    """
+    try:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except Exception as e:
+        print(f"Error processing {filename}: {str(e)}")
+        return
+
+    result = []
+    for item in data:
+        content = f"Q: {item.get('question', '')}\nA: {item.get('answer', '')}"
+        metadata = {
+            "source": filename,
+            "type": "json",
+            "question_id": item.get("id", "")
+        }
+        if item.get("category"):
+            metadata["category"] = item["category"]
+        result.append({"content": content, "metadata": metadata})
+    yield result
+
+
+def batched(iterable, size):
+    """按固定大小分批"""
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def prefetch(iterable, depth):
+    """
+    在后台线程中提前迭代 iterable，最多缓存 depth 项
+
+    用于让文档解析与嵌入重叠：消费方嵌入当前批次时，后台线程继续准备后续批次
+    """
+    items = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    end = object()
+
+    def produce():
+        try:
+            for item in iterable:
+                while not stop.is_set():
+                    try:
+                        items.put((item, None), timeout=0.1)
+                        break
+                    except queue.Full:
+                        continue
+                if stop.is_set():
+                    break
+        except BaseException as e:
+            items.put((end, e))
+            return
+        finally:
+            if hasattr(iterable, "close"):
+                iterable.close()
+        items.put((end, None))
+
+    thread = threading.Thread(target=produce, name="prefetch", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = items.get()
+            if item is end:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stop.set()
+        # 清空队列，避免生产线程阻塞在 put 上
+        while thread.is_alive():
+            try:
+                items.get(timeout=0.1)
+            except queue.Empty:
+                pass
 
 
 if __name__ == "__main__":
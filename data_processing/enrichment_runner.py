@@ -0,0 +1,97 @@
+"""
+数据增强执行器
+以有限并发执行增强任务（模型请求走 enrichment 优先级，不影响在线问答），
+每完成一项立即追加写入 JSONL 检查点，中断后重新运行会跳过已完成的项；
+全部完成后由调用方把检查点合并为最终文件（只写一次）并删除检查点
+"""
+
+import asyncio
+import json
+import os
+from typing import Any, Awaitable, Callable, Dict
+
+from tqdm import tqdm
+
+from config import Config
+
+
+class EnrichmentRunner:
+    """带 JSONL 检查点的并发增强执行器"""
+
+    def __init__(self, checkpoint_path: str, concurrency: int = None):
+        """
+        参数:
+            checkpoint_path: JSONL 检查点路径，每行为 {"key", "result"} 或 {"key", "error"}
+            concurrency: 同时执行的任务数，默认为 Config.ENRICH_CONCURRENCY
+        """
+        self.checkpoint_path = checkpoint_path
+        self.concurrency = concurrency or Config.ENRICH_CONCURRENCY
+
+    def completed(self) -> Dict[str, Any]:
+        """
+        读取检查点，返回已成功完成的 {key: result}
+
+        进程崩溃时最后一行可能只写了一半，先截掉不完整的行；
+        失败的任务不计入，续跑时重新执行（同一 key 以最后一行为准）
+        """
+        if not os.path.exists(self.checkpoint_path):
+            return {}
+        with open(self.checkpoint_path, "rb+") as f:
+            data = f.read()
+            if data and not data.endswith(b"\n"):
+                f.truncate(data.rfind(b"\n") + 1)
+                data = data[:data.rfind(b"\n") + 1]
+
+        results = {}
+        for line in data.decode("utf-8").splitlines():
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if "error" in record:
+                results.pop(record["key"], None)
+            else:
+                results[record["key"]] = record["result"]
+        return results
+
+    async def run(self, tasks: Dict[str, Callable[[], Awaitable[Any]]], desc: str = "数据增强") -> Dict[str, int]:
+        """
+        执行尚未完成的任务
+
+        参数:
+            tasks: {key: 无参协程函数}，协程返回可 JSON 序列化的结果，抛出异常视为失败
+            desc: 进度条说明
+
+        返回:
+            {"total": 任务数, "skipped": 已完成而跳过的数量, "succeeded": 本次成功数, "failed": 本次失败数}
+        """
+        done = self.completed()
+        remaining = {key: task for key, task in tasks.items() if key not in done}
+        stats = {"total": len(tasks), "skipped": len(tasks) - len(remaining), "succeeded": 0, "failed": 0}
+        if not remaining:
+            return stats
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+        os.makedirs(os.path.dirname(self.checkpoint_path) or ".", exist_ok=True)
+        with open(self.checkpoint_path, "a", encoding="utf-8") as f, tqdm(total=len(remaining), desc=desc) as progress:
+            async def execute(key: str, task: Callable[[], Awaitable[Any]]):
+                async with semaphore:
+                    try:
+                        record = {"key": key, "result": await task()}
+                        stats["succeeded"] += 1
+                    except Exception as e:
+                        print(f"增强任务 {key} 失败: {str(e)}")
+                        record = {"key": key, "error": str(e)}
+                        stats["failed"] += 1
+                # 每条结果立即落盘，中断时最多丢失正在执行的任务
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+                progress.update(1)
+
+            await asyncio.gather(*(execute(key, task) for key, task in remaining.items()))
+        return stats
+
+    def clear(self):
+        """结果合并写入最终文件后删除检查点"""
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
@@ -1,16 +1,18 @@
 import re
 
-import ollama
 from config import Config
+from llm_client import get_llm_client
 
 
 class Qwen3Model:
-    def __init__(self):
+    def __init__(self, priority="enrichment"):
         self.model_name = Config.QWEN_MODEL
-        self.client = ollama.Client(host=Config.OLLAMA_HOST)
+        # 数据增强属于后台任务，请求优先级低于在线问答与评估
+        self.priority = priority
+        self.llm = get_llm_client()
 
-    def generate_response(self, prompt, history=None, max_tokens=2000):
-        """使用Qwen3生成响应"""
+    @staticmethod
+    def _build_messages(prompt, history=None):
         messages = []
 
         # 添加历史对话
@@ -23,16 +25,36 @@ class Qwen3Model:
 
         # 添加当前提示
         messages.append({"role": "user", "content": prompt})
+        return messages
+
+    @staticmethod
+    def _clean_output(response):
+        raw_output = response["message"]["content"]
+        return re.sub(r"<think>.*?</think>", "", raw_output, flags=re.DOTALL).strip()
 
+    def generate_response(self, prompt, history=None, max_tokens=2000):
+        """使用Qwen3生成响应"""
         # 调用Ollama API
-        response = self.client.chat(
+        response = self.llm.chat(
+            self.priority,
             model=self.model_name,
-            messages=messages,
+            messages=self._build_messages(prompt, history),
             options={
                 "num_predict": max_tokens,
                 "temperature": 0.3
             }
         )
-        raw_output = response["message"]["content"]
-        clean_output = re.sub(r"<think>.*?</think>", "", raw_output, flags=re.DOTALL).strip()
-        return clean_output
\ No newline at end of file
+        return self._clean_output(response)
+
+    async def generate_response_async(self, prompt, history=None, max_tokens=2000):
+        """generate_response 的异步版本，供并发增强使用"""
+        response = await self.llm.chat_async(
+            self.priority,
+            model=self.model_name,
+            messages=self._build_messages(prompt, history),
+            options={
+                "num_predict": max_tokens,
+                "temperature": 0.3
+            }
+        )
+        return self._clean_output(response)
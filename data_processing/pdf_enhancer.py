@@ -1,16 +1,20 @@
-import time
-
-from data_processing.ollama_integration import Qwen3Model
-import os
+import asyncio
+import functools
 import json
+import os
+
+import fitz
+
 from config import Config
-from pypdf import PdfReader
+from data_processing.enrichment_runner import EnrichmentRunner
+from data_processing.ollama_integration import Qwen3Model
 
 
 class PDFEnhancer:
     def __init__(self):
         self.llm = Qwen3Model()
         self.metadata_file = os.path.join(Config.PDF_DIR, "metadata.json")
+        self.checkpoint_file = os.path.join(Config.PDF_DIR, "metadata.partial.jsonl")
         self.metadata = self.load_metadata()
 
     def load_metadata(self):
@@ -21,30 +25,24 @@ class PDFEnhancer:
         return {}
 
     def save_metadata(self):
-        """保存元数据"""
-        with open(self.metadata_file, "w", encoding="utf-8") as f:
+        """保存元数据（写入临时文件后原子替换）"""
+        tmp_path = f"{self.metadata_file}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
             json.dump(self.metadata, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.metadata_file)
 
     def extract_basic_info(self, pdf_path):
         """提取PDF基本信息"""
-        reader = PdfReader(pdf_path)
         text = ""
-        for i, page in enumerate(reader.pages):
-            if i < 3:  # 只读取前三页
-                text += page.extract_text() + "\n"
-        return text[:5000]  # 限制文本长度
-
-    def generate_metadata(self, pdf_path, file_name):
-        """使用LLM生成元数据"""
-        # 检查是否已有元数据
-        if file_name in self.metadata:
-            return self.metadata[file_name]
-
-        # 提取基础信息
-        basic_text = self.extract_basic_info(pdf_path)
-
-        # 构建LLM提示
-        prompt = f"""
+        with fitz.open(pdf_path) as pdf:
+            for page in pdf.pages(0, min(Config.ENRICH_PDF_PAGES, pdf.page_count)):
+                text += page.get_text() + "\n"
+        return text[:Config.ENRICH_PDF_CHARS]  # 限制文本长度
+
+    @staticmethod
+    def build_prompt(basic_text):
+        """构建LLM提示（结构化抽取不需要思考过程，关闭 Qwen3 的思考模式以减少生成的 token）"""
+        return f"""
         你是一名金融分析师，请根据以下上市公司年报片段生成结构化元数据：
 
         {basic_text}
@@ -58,49 +56,80 @@ class PDFEnhancer:
           "key_topics": ["主题1", "主题2", "主题3"],
           "summary": "报告摘要（100字以内）"
         }}
+        /no_think
         """
 
-        # 调用LLM生成元数据
-        response = self.llm.generate_response(prompt, max_tokens=8192)
+    @staticmethod
+    def parse_metadata(response):
+        """从响应中提取JSON，解析失败时抛出 ValueError"""
+        start_idx = response.find("{")
+        end_idx = response.rfind("}") + 1
+        if start_idx < 0 or end_idx <= start_idx:
+            raise ValueError("响应中没有JSON")
+        return json.loads(response[start_idx:end_idx])
+
+    async def generate_metadata_async(self, pdf_path):
+        """使用LLM生成元数据，PDF 解析在线程中进行，不阻塞其他请求"""
+        basic_text = await asyncio.to_thread(self.extract_basic_info, pdf_path)
+        response = await self.llm.generate_response_async(self.build_prompt(basic_text), max_tokens=8192)
+        metadata = self.parse_metadata(response)
+        metadata["file_path"] = pdf_path
+        return metadata
+
+    def generate_metadata(self, pdf_path, file_name):
+        """使用LLM生成单个文件的元数据"""
+        # 检查是否已有元数据
+        if file_name in self.metadata:
+            return self.metadata[file_name]
 
         try:
-            # 尝试从响应中提取JSON
-            start_idx = response.find("{")
-            end_idx = response.rfind("}") + 1
-            json_str = response[start_idx:end_idx]
-            metadata = json.loads(json_str)
-
-            # 添加文件路径
-            metadata["file_path"] = pdf_path
-            self.metadata[file_name] = metadata
-            self.save_metadata()
-
-            return metadata
+            metadata = asyncio.run(self.generate_metadata_async(pdf_path))
         except Exception as e:
             print(f"解析元数据失败: {str(e)}")
             return None
+        self.metadata[file_name] = metadata
+        self.save_metadata()
+        return metadata
 
-    def process_directory(self):
-        """处理整个PDF目录"""
-        for file_name in os.listdir(Config.PDF_DIR):
-            if file_name.endswith(".pdf"):
-                pdf_path = os.path.join(Config.PDF_DIR, file_name)
-
-                # 跳过已处理的文件
-                if file_name in self.metadata:
-                    continue
+    async def process_directory_async(self):
+        """
+        并发处理整个PDF目录
 
-                print(f"处理文件: {file_name}")
-                metadata = self.generate_metadata(pdf_path, file_name)
+        每份年报的元数据生成后追加到检查点，中断后重新运行只处理剩余文件；
+        全部完成后 metadata.json 只写入一次。生成失败的文件不写入，下次运行时重试
 
-                if metadata:
-                    print(f"生成元数据: {metadata['company_name']} {metadata['report_year']}")
-                else:
-                    print(f"无法为 {file_name} 生成元数据")
+        返回:
+            本次新生成元数据的文件数
+        """
+        pending = sorted(
+            file_name for file_name in os.listdir(Config.PDF_DIR)
+            if file_name.endswith(".pdf") and file_name not in self.metadata  # 跳过已处理的文件
+        )
+        if not pending:
+            print("所有PDF均已有元数据")
+            return 0
+
+        runner = EnrichmentRunner(self.checkpoint_file)
+        tasks = {
+            file_name: functools.partial(self.generate_metadata_async, os.path.join(Config.PDF_DIR, file_name))
+            for file_name in pending
+        }
+        stats = await runner.run(tasks, desc="生成年报元数据")
+
+        generated = {file_name: metadata for file_name, metadata in runner.completed().items() if file_name in tasks}
+        self.metadata.update(generated)
+        self.save_metadata()
+        runner.clear()
+
+        print(f"生成元数据 {len(generated)} 份（其中 {stats['skipped']} 份来自上次中断前的进度），"
+              f"失败 {stats['failed']} 份")
+        return len(generated)
 
-                time.sleep(1)  # 避免请求过快
+    def process_directory(self):
+        """处理整个PDF目录"""
+        return asyncio.run(self.process_directory_async())
 
 
 if __name__ == "__main__":
     enhancer = PDFEnhancer()
-    enhancer.process_directory()
\ No newline at end of file
+    enhancer.process_directory()
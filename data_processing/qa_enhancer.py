@@ -1,16 +1,48 @@
-from data_processing.ollama_integration import Qwen3Model
-import os
+import asyncio
+import functools
+import hashlib
 import json
+import os
 import re
+
 from config import Config
+from data_processing.enrichment_runner import EnrichmentRunner
+from data_processing.ollama_integration import Qwen3Model
+from data_processing.question_classifier import CATEGORY_DESCRIPTIONS, QuestionClassifier
+
+CATEGORIES = list(CATEGORY_DESCRIPTIONS)
+DEFAULT_CATEGORY = "其他"
+# 批量分类的输出行: "3. 公司财报" / "3: 公司财报" / "3、公司财报"
+NUMBERED_LINE_PATTERN = re.compile(r"^\s*(\d+)\s*[.、:：)）]\s*(.+?)\s*$")
+
+
+def normalize_category(text):
+    """把模型输出规范为类别选项之一，无法识别时归为“其他”"""
+    text = (text or "").strip().strip("\"'“”[]【】")
+    if text in CATEGORIES:
+        return text
+    for category in CATEGORIES:
+        if category in text:
+            return category
+    return DEFAULT_CATEGORY
 
 
 class QAEnhancer:
     def __init__(self):
         self.llm = Qwen3Model()
         self.enhanced_dir = os.path.join(Config.JSON_DIR, "enhanced")
+        self.checkpoint_file = os.path.join(self.enhanced_dir, "progress.partial.jsonl")
+        self.batch_size = max(Config.ENRICH_CLASSIFY_BATCH_SIZE, 1)
+        self._classifier = None
         os.makedirs(self.enhanced_dir, exist_ok=True)
 
+    @property
+    def classifier(self):
+        """嵌入分类器，QA_CLASSIFIER 为 llm 时为 None（首次使用时创建，需要嵌入类别描述）"""
+        if self._classifier is None and Config.QA_CLASSIFIER == "embedding":
+            self._classifier = QuestionClassifier()
+        return self._classifier
+
     def clean_text(self, text):
         """基础文本清洗"""
         if not text:
@@ -22,9 +54,9 @@ class QAEnhancer:
         text = re.sub(r'[^\w\s.,?;:!()\-—\'"@#$%&*+=/\\]', '', text)
         return text.strip()
 
-    def categorize_question(self, question):
-        """使用LLM对问题进行分类"""
-        prompt = f"""
+    @staticmethod
+    def _question_prompt(question):
+        return f"""
             # 指令
             你是一名金融专家，请对以下问题进行主题分类。
             你的回答必须只包含类别名称，不要包含任何思考过程、解释或额外文本。
@@ -33,77 +65,220 @@ class QAEnhancer:
             "{question}"
 
             # 类别选项
-            [股票分析, 公司财报, 投资策略, 经济政策, 行业趋势, 交易规则, 金融产品, 风险管理, 其他]
+            [{", ".join(CATEGORIES)}]
 
             # 输出要求
             只需返回类别名称，不要添加任何其他内容。
+            /no_think
             """
 
-        response = self.llm.generate_response(prompt, max_tokens=8192)
-        return response.strip()
+    @staticmethod
+    def _batch_prompt(questions):
+        numbered = "\n".join(f"{i}. {question}" for i, question in enumerate(questions, start=1))
+        return f"""
+            # 指令
+            你是一名金融专家，请对以下 {len(questions)} 个问题逐一进行主题分类。
+            你的回答必须只包含分类结果，不要包含任何思考过程、解释或额外文本。
 
-    def enhance_qa(self, qa_item):
-        """增强单条QA数据"""
-        # 基础清洗
-        cleaned_question = self.clean_text(qa_item.get("question", ""))
-        cleaned_answer = self.clean_text(qa_item.get("answer", ""))
+            # 问题
+            {numbered}
 
+            # 类别选项
+            [{", ".join(CATEGORIES)}]
+
+            # 输出要求
+            每个问题输出一行，格式为“编号. 类别名称”，按编号顺序输出全部 {len(questions)} 行，不要添加任何其他内容。
+            /no_think
+            """
+
+    def categorize_question(self, question):
+        """对问题进行分类，嵌入分类不确定时使用LLM"""
+        if self.classifier is not None:
+            labels, uncertain = self.classifier.classify([question])
+            if not uncertain or not Config.CLASSIFY_LLM_FALLBACK:
+                return labels[0]
+        response = self.llm.generate_response(self._question_prompt(question), max_tokens=8192)
+        return normalize_category(response)
+
+    async def categorize_question_async(self, question):
+        """categorize_question 的异步版本"""
+        response = await self.llm.generate_response_async(self._question_prompt(question), max_tokens=8192)
+        return normalize_category(response)
+
+    async def categorize_questions_async(self, questions):
+        """
+        一次模型调用对一批问题分类
+
+        输出中缺失编号或类别不在选项中的问题再逐条分类
+
+        返回:
+            与 questions 顺序一致的类别列表
+        """
+        if len(questions) == 1:
+            return [await self.categorize_question_async(questions[0])]
+
+        response = await self.llm.generate_response_async(self._batch_prompt(questions), max_tokens=8192)
+        categories = [None] * len(questions)
+        for line in response.splitlines():
+            match = NUMBERED_LINE_PATTERN.match(line)
+            if not match:
+                continue
+            index = int(match.group(1)) - 1
+            label = match.group(2).strip("\"'“”[]【】 ")
+            if 0 <= index < len(questions) and label in CATEGORIES:
+                categories[index] = label
+
+        missing = [i for i, category in enumerate(categories) if category is None]
+        if missing:
+            retried = await asyncio.gather(*(self.categorize_question_async(questions[i]) for i in missing))
+            for i, category in zip(missing, retried):
+                categories[i] = category
+        return categories
+
+    def clean_item(self, qa_item):
+        """清洗单条QA数据，问题为空时返回 None"""
+        cleaned_question = self.clean_text(qa_item.get("question", ""))
         if not cleaned_question:
             return None
+        return {
+            "id": qa_item.get("id", ""),
+            "question": cleaned_question,
+            "answer": self.clean_text(qa_item.get("answer", "")),
+            "timestamp": qa_item.get("timestamp", "")
+        }
 
-        # 分类
-        category = self.categorize_question(cleaned_question)
-
+    @staticmethod
+    def build_item(cleaned_item, category):
+        """组装增强后的QA数据"""
         # 评估质量
         quality = "high"
-        if len(cleaned_question) < 5:
+        if len(cleaned_item["question"]) < 5:
             quality = "low"
 
         return {
-            "id": qa_item.get("id", ""),
-            "question": cleaned_question,
-            "answer": cleaned_answer,
+            "id": cleaned_item["id"],
+            "question": cleaned_item["question"],
+            "answer": cleaned_item["answer"],
             "category": category,
             "quality": quality,
             "source": "sseinfo.com",
-            "timestamp": qa_item.get("timestamp", "")
+            "timestamp": cleaned_item["timestamp"]
         }
 
-    def process_file(self, file_path):
-        """处理单个JSON文件"""
-        with open(file_path, "r", encoding="utf-8") as f:
+    def enhance_qa(self, qa_item):
+        """增强单条QA数据"""
+        cleaned_item = self.clean_item(qa_item)
+        if cleaned_item is None:
+            return None
+        return self.build_item(cleaned_item, self.categorize_question(cleaned_item["question"]))
+
+    def _output_path(self, file_name):
+        return os.path.join(self.enhanced_dir, f"enhanced_{file_name}")
+
+    def _is_up_to_date(self, file_name):
+        """增强结果比原始文件新时跳过"""
+        output_path = self._output_path(file_name)
+        return (os.path.exists(output_path)
+                and os.path.getmtime(output_path) >= os.path.getmtime(os.path.join(Config.JSON_DIR, file_name)))
+
+    def _plan_file(self, file_name):
+        """
+        清洗文件中的问答并按批划分分类任务
+
+        返回:
+            (清洗后的问答列表, 嵌入分类结果（未使用嵌入分类时为 None）, [(批次 key, 问答位置)], {key: 分类任务})
+            嵌入分类时只有不确定的问题交给模型；key 包含问题内容的摘要，原始文件变化后旧的检查点结果不会被误用
+        """
+        with open(os.path.join(Config.JSON_DIR, file_name), "r", encoding="utf-8") as f:
             data = json.load(f)
 
-        enhanced_data = []
-        for item in data:
-            enhanced_item = self.enhance_qa(item)
-            if enhanced_item:
-                enhanced_data.append(enhanced_item)
+        items = [item for item in map(self.clean_item, data) if item is not None]
+        questions = [item["question"] for item in items]
+        categories, pending = None, list(range(len(items)))
+        if self.classifier is not None:
+            categories, pending = self.classifier.classify(questions)
+            if not Config.CLASSIFY_LLM_FALLBACK:
+                pending = []
 
-        # 保存增强后的数据
-        base_name = os.path.basename(file_path)
-        output_path = os.path.join(self.enhanced_dir, f"enhanced_{base_name}")
+        batches, tasks = [], {}
+        for start in range(0, len(pending), self.batch_size):
+            positions = pending[start:start + self.batch_size]
+            batch_questions = [questions[i] for i in positions]
+            digest = hashlib.sha1("\n".join(batch_questions).encode("utf-8")).hexdigest()[:12]
+            key = f"{file_name}:{positions[0]}:{digest}"
+            batches.append((key, positions))
+            tasks[key] = functools.partial(self.categorize_questions_async, batch_questions)
+        return items, categories, batches, tasks
 
-        with open(output_path, "w", encoding="utf-8") as f:
+    def _write_file(self, file_name, enhanced_data):
+        """保存增强后的数据（写入临时文件后原子替换）"""
+        output_path = self._output_path(file_name)
+        tmp_path = f"{output_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
             json.dump(enhanced_data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, output_path)
 
-        return len(enhanced_data)
+    async def run_async(self, file_names=None):
+        """
+        分类并写出增强文件（先按 QA_CLASSIFIER 进行嵌入分类，再由模型并发批量分类其余问题）
 
-    def run(self):
-        """处理所有JSON文件"""
-        total_enhanced = 0
+        所有文件的分类批次共用一个检查点，中断后重新运行只处理未完成的批次；
+        文件的全部批次完成后才写出该文件，有批次失败的文件保留进度，下次运行时补齐
+
+        参数:
+            file_names: 要处理的 JSON 文件名，默认为 JSON_DIR 下所有未处理或已更新的文件
+
+        返回:
+            本次增强的问答条数
+        """
+        if file_names is None:
+            file_names = sorted(
+                file_name for file_name in os.listdir(Config.JSON_DIR)
+                if file_name.endswith(".json") and "enhanced" not in file_name
+                and not self._is_up_to_date(file_name)
+            )
 
-        for file_name in os.listdir(Config.JSON_DIR):
-            if file_name.endswith(".json") and "enhanced" not in file_name:
-                file_path = os.path.join(Config.JSON_DIR, file_name)
-                print(f"处理文件: {file_name}")
+        plans, tasks = {}, {}
+        for file_name in file_names:
+            items, categories, batches, file_tasks = self._plan_file(file_name)
+            plans[file_name] = (items, categories, batches)
+            tasks.update(file_tasks)
 
-                count = self.process_file(file_path)
-                total_enhanced += count
-                print(f"增强 {count} 条问答")
+        runner = EnrichmentRunner(self.checkpoint_file)
+        stats = await runner.run(tasks, desc="问答分类")
+        results = runner.completed()
 
+        total_enhanced, incomplete = 0, []
+        for file_name, (items, categories, batches) in plans.items():
+            if any(key not in results for key, _ in batches):
+                incomplete.append(file_name)
+                continue
+            categories = list(categories or [None] * len(items))
+            for key, positions in batches:
+                for i, category in zip(positions, results[key]):
+                    categories[i] = category
+            self._write_file(file_name, [self.build_item(item, category) for item, category in zip(items, categories)])
+            total_enhanced += len(items)
+            print(f"处理文件: {file_name}，增强 {len(items)} 条问答")
+
+        if incomplete:
+            print(f"{len(incomplete)} 个文件有 {stats['failed']} 个分类批次失败，进度已保留，重新运行时继续: "
+                  f"{', '.join(incomplete)}")
+        elif all(key.split(":", 1)[0] in plans for key in results):
+            # 只处理部分文件时，检查点中可能还有其他文件的进度，此时保留
+            runner.clear()
+        return total_enhanced
+
+    def process_file(self, file_path):
+        """处理单个JSON文件（文件需位于 JSON_DIR 下）"""
+        return asyncio.run(self.run_async([os.path.basename(file_path)]))
+
+    def run(self):
+        """处理所有JSON文件"""
+        total_enhanced = asyncio.run(self.run_async())
         print(f"处理完成，共增强 {total_enhanced} 条问答数据")
 
+
 if __name__ == "__main__":
     enhancer = QAEnhancer()
-    enhancer.run()
\ No newline at end of file
+    enhancer.run()
@@ -0,0 +1,112 @@
+"""
+基于嵌入的零样本问题分类
+类别描述只嵌入一次（取各描述归一化向量的均值作为类别中心），问题按批嵌入后
+与类别中心做矩阵余弦相似度，取最相似的类别；最高与次高相似度之差（置信间隔）
+低于阈值的问题标记为不确定，可交由模型再分类
+"""
+
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from config import Config
+from vector_store import OllamaEmbedder
+
+# 每个类别的描述与典型问法，用于计算类别中心
+CATEGORY_DESCRIPTIONS: Dict[str, List[str]] = {
+    "股票分析": [
+        "股票分析：股价走势、估值、市值、股东户数、股票回购与增减持",
+        "公司股价为什么下跌？目前市值和市盈率是否被低估？",
+    ],
+    "公司财报": [
+        "公司财报：营业收入、净利润、毛利率、现金流、年报季报披露的财务数据",
+        "公司今年的营收和净利润是多少？财报什么时候披露？",
+    ],
+    "投资策略": [
+        "投资策略：资产配置、买入卖出时机、长期投资、分红与投资回报",
+        "现在适合买入吗？公司会提高分红比例回报投资者吗？",
+    ],
+    "经济政策": [
+        "经济政策：货币政策、财政政策、产业政策、监管政策与宏观经济对公司的影响",
+        "国家出台的新政策对公司业务有什么影响？",
+    ],
+    "行业趋势": [
+        "行业趋势：行业竞争格局、市场需求、技术发展、市场份额与未来前景",
+        "公司所在行业的发展前景如何？市场占有率排名第几？",
+    ],
+    "交易规则": [
+        "交易规则：停牌复牌、涨跌停、信息披露规则、股东大会与交易所规定",
+        "公司股票为什么停牌？股东大会的投票规则是什么？",
+    ],
+    "金融产品": [
+        "金融产品：可转债、基金、理财产品、期货期权、债券发行",
+        "公司发行的可转债什么时候转股？是否购买了理财产品？",
+    ],
+    "风险管理": [
+        "风险管理：经营风险、诉讼、债务违约、商誉减值、质押风险与应对措施",
+        "公司面临哪些风险？大股东股权质押是否存在平仓风险？",
+    ],
+    "其他": [
+        "其他：与以上金融主题无关的问题，如公司日常经营、产品使用、招聘、联系方式",
+        "公司的办公地址在哪里？产品在哪里可以买到？",
+    ],
+}
+
+
+class QuestionClassifier:
+    """嵌入余弦相似度分类器"""
+
+    def __init__(self, embedder: OllamaEmbedder = None, categories: Dict[str, List[str]] = None,
+                 min_margin: float = None):
+        """
+        参数:
+            embedder: 嵌入生成器，默认使用 Config.EMB_MODEL
+            categories: {类别: 描述列表}，默认为 CATEGORY_DESCRIPTIONS
+            min_margin: 置信间隔阈值，默认为 Config.CLASSIFY_MIN_MARGIN
+        """
+        self.embedder = embedder or OllamaEmbedder(Config.EMB_MODEL)
+        categories = categories or CATEGORY_DESCRIPTIONS
+        self.labels = list(categories)
+        self.min_margin = Config.CLASSIFY_MIN_MARGIN if min_margin is None else min_margin
+
+        texts = [text for label in self.labels for text in categories[label]]
+        vectors = self._normalize(self.embedder.get_embeddings_batch(texts, priority="enrichment"))
+        centroids, start = [], 0
+        for label in self.labels:
+            count = len(categories[label])
+            centroids.append(vectors[start:start + count].mean(axis=0))
+            start += count
+        self.centroids = self._normalize(centroids)
+
+    @staticmethod
+    def _normalize(vectors) -> np.ndarray:
+        matrix = np.asarray(vectors, dtype='float32')
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.maximum(norms, 1e-12)
+
+    def predict(self, questions: List[str]) -> Tuple[List[str], np.ndarray]:
+        """
+        对一批问题分类
+
+        返回:
+            (类别列表, 置信间隔数组)，置信间隔为最高与次高类别相似度之差
+        """
+        if not questions:
+            return [], np.empty(0, dtype='float32')
+        vectors = self._normalize(self.embedder.get_embeddings_batch(questions, priority="enrichment"))
+        scores = vectors @ self.centroids.T
+        if scores.shape[1] < 2:
+            return [self.labels[0]] * len(questions), np.ones(len(questions), dtype='float32')
+        top2 = np.partition(scores, -2, axis=1)[:, -2:]
+        margins = top2[:, 1] - top2[:, 0]
+        return [self.labels[i] for i in scores.argmax(axis=1)], margins
+
+    def classify(self, questions: List[str]) -> Tuple[List[str], List[int]]:
+        """
+        对一批问题分类
+
+        返回:
+            (类别列表, 置信间隔低于阈值的问题位置)
+        """
+        labels, margins = self.predict(questions)
+        return labels, np.flatnonzero(margins < self.min_margin).tolist()
@@ -0,0 +1,183 @@
+"""
+近似重复分块检测
+入库时为分块计算 MinHash 签名（去除空白后的字符 n-gram），通过 LSH 分桶查找候选，
+再用完整签名估计 Jaccard 相似度确认；年报中反复出现的风险提示、公司治理模板
+以及问答爬虫重叠页面中的重复问答只存储、嵌入一次
+文本相近但数字不同的分块（不同公司、不同年份的同类表述）记载的是不同的数据，不视为重复
+"""
+
+import os
+import re
+import zlib
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from config import Config
+
+MERSENNE_PRIME = (1 << 31) - 1
+NUMBER_PATTERN = re.compile(r"\d+(?:\.\d+)?")
+FINGERPRINT_WORDS = 2  # 签名末尾存放数字指纹的 uint32 个数
+SEED = 20240601  # 固定种子，保证保存的签名与重新计算的签名一致
+LSH_RECALL_MARGIN = 0.1  # LSH 分桶阈值低于确认阈值的幅度，降低漏检
+# 合并到已有分块的重复分块保留的元数据字段（原分块删除时据此改由重复来源持有）
+DUPLICATE_EXCLUDED_FIELDS = ("duplicate_sources",)
+
+
+def lsh_bands(num_perm: int, threshold: float) -> Tuple[int, int]:
+    """
+    选择分桶数与每桶行数
+
+    返回:
+        (bands, rows)，取分桶阈值 (1/bands)^(1/rows) 不超过 threshold - LSH_RECALL_MARGIN 的最大 rows
+    """
+    target = max(threshold - LSH_RECALL_MARGIN, 0.0)
+    best = (num_perm, 1)
+    for rows in range(1, num_perm + 1):
+        bands = num_perm // rows
+        if (1 / bands) ** (1 / rows) > target:
+            break
+        best = (bands, rows)
+    return best
+
+
+def duplicate_entry(metadata: Dict) -> Dict:
+    """重复分块登记到已有分块 duplicate_sources 中的元数据"""
+    return {key: value for key, value in metadata.items() if key not in DUPLICATE_EXCLUDED_FIELDS}
+
+
+class NearDuplicateIndex:
+    """
+    MinHash 签名 + LSH 分桶
+
+    签名为 num_perm 个最小哈希值加 FINGERPRINT_WORDS 个数字指纹，只有数字指纹相同的分块才比较相似度
+    """
+
+    def __init__(self, num_perm: int = None, threshold: float = None, shingle_size: int = None):
+        """
+        参数:
+            num_perm: 签名长度，默认为 Config.DEDUP_NUM_PERM
+            threshold: 判定为重复的 Jaccard 相似度，默认为 Config.DEDUP_THRESHOLD
+            shingle_size: 字符 n-gram 长度，默认为 Config.DEDUP_SHINGLE_SIZE
+        """
+        self.num_perm = num_perm or Config.DEDUP_NUM_PERM
+        self.threshold = threshold or Config.DEDUP_THRESHOLD
+        self.shingle_size = shingle_size or Config.DEDUP_SHINGLE_SIZE
+        self.bands, self.rows = lsh_bands(self.num_perm, self.threshold)
+        rng = np.random.RandomState(SEED)
+        self._a = rng.randint(1, MERSENNE_PRIME, size=self.num_perm, dtype=np.uint64)
+        self._b = rng.randint(0, MERSENNE_PRIME, size=self.num_perm, dtype=np.uint64)
+        self._signatures = {}
+        self._buckets = [{} for _ in range(self.bands)]
+
+    def __len__(self) -> int:
+        return len(self._signatures)
+
+    def signature(self, text: str) -> np.ndarray:
+        """计算文本的 MinHash 签名（末尾附带文本中数字序列的指纹）"""
+        numbers = "|".join(NUMBER_PATTERN.findall(text)).encode("utf-8")
+        fingerprint = np.array([zlib.crc32(numbers), zlib.adler32(numbers)], dtype=np.uint32)
+        text = re.sub(r"\s+", "", text)
+        size = self.shingle_size
+        shingles = {text[i:i + size] for i in range(max(len(text) - size + 1, 1))}
+        hashes = np.fromiter(
+            (zlib.crc32(shingle.encode("utf-8")) % MERSENNE_PRIME for shingle in shingles),
+            dtype=np.uint64, count=len(shingles)
+        )
+        permuted = (self._a[:, None] * hashes[None, :] + self._b[:, None]) % MERSENNE_PRIME
+        return np.concatenate([permuted.min(axis=1).astype(np.uint32), fingerprint])
+
+    def _band_keys(self, signature: np.ndarray) -> Iterable[Tuple[int, bytes]]:
+        for band in range(self.bands):
+            yield band, signature[band * self.rows:(band + 1) * self.rows].tobytes()
+
+    def match(self, signature: np.ndarray) -> Optional[Tuple[int, float]]:
+        """
+        查找最相似的已登记分块
+
+        返回:
+            (doc_id, 估计的 Jaccard 相似度)，没有达到阈值的分块时返回 None
+        """
+        candidates = set()
+        for band, key in self._band_keys(signature):
+            candidates.update(self._buckets[band].get(key, ()))
+        best = None
+        minhash, fingerprint = signature[:self.num_perm], signature[self.num_perm:]
+        for doc_id in candidates:
+            other = self._signatures[doc_id]
+            if not np.array_equal(other[self.num_perm:], fingerprint):
+                continue
+            similarity = float(np.mean(other[:self.num_perm] == minhash))
+            if similarity >= self.threshold and (best is None or similarity > best[1]):
+                best = (doc_id, similarity)
+        return best
+
+    def add(self, doc_id: int, signature: np.ndarray):
+        """登记分块签名"""
+        self._signatures[doc_id] = signature
+        for band, key in self._band_keys(signature):
+            self._buckets[band].setdefault(key, set()).add(doc_id)
+
+    def remove(self, doc_ids: Iterable[int]):
+        """注销分块"""
+        for doc_id in doc_ids:
+            signature = self._signatures.pop(doc_id, None)
+            if signature is None:
+                continue
+            for band, key in self._band_keys(signature):
+                bucket = self._buckets[band].get(key)
+                if bucket is not None:
+                    bucket.discard(doc_id)
+                    if not bucket:
+                        del self._buckets[band][key]
+
+    def save(self, path: str):
+        """以 npz 格式原子写入（分桶在加载时按签名重建）"""
+        ids = np.fromiter(self._signatures, dtype='int64', count=len(self._signatures))
+        signatures = (np.stack([self._signatures[doc_id] for doc_id in ids.tolist()])
+                      if len(ids) else np.empty((0, self.num_perm + FINGERPRINT_WORDS), dtype=np.uint32))
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(tmp_path, ids=ids, signatures=signatures,
+                 params=np.array([self.num_perm, self.shingle_size, SEED], dtype='int64'))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> Optional["NearDuplicateIndex"]:
+        """从 npz 文件加载，签名参数与当前配置不一致时返回 None（需按文档重新计算）"""
+        index = cls()
+        with np.load(path) as data:
+            if data["params"].tolist() != [index.num_perm, index.shingle_size, SEED]:
+                return None
+            for doc_id, signature in zip(data["ids"].tolist(), data["signatures"]):
+                index.add(doc_id, signature)
+        return index
+
+    @classmethod
+    def build(cls, items: Iterable[Tuple[int, str]]) -> "NearDuplicateIndex":
+        """由 (doc_id, 文本) 构造（用于为没有签名文件的旧版向量库补建）"""
+        index = cls()
+        for doc_id, text in items:
+            index.add(doc_id, index.signature(text))
+        return index
+
+    def deduplicate(self, signatures: List[np.ndarray]) -> List[Tuple[str, int]]:
+        """
+        判断一批分块是否与已登记分块或同批中靠前的分块重复（不登记）
+
+        返回:
+            与输入顺序一致的 ("existing", doc_id) / ("batch", 同批位置) / ("new", 同批位置)
+        """
+        batch = NearDuplicateIndex(self.num_perm, self.threshold, self.shingle_size)
+        decisions = []
+        for i, signature in enumerate(signatures):
+            existing = self.match(signature)
+            if existing is not None:
+                decisions.append(("existing", existing[0]))
+                continue
+            earlier = batch.match(signature)
+            if earlier is not None:
+                decisions.append(("batch", earlier[0]))
+                continue
+            batch.add(i, signature)
+            decisions.append(("new", i))
+        return decisions
@@ -0,0 +1,196 @@
+"""
+文档存储
+以偏移表 + UTF-8 数据块的二进制格式保存分块文本和元数据，通过 mmap 打开，
+检索时只解码命中的文档；多个工作进程打开同一文件时共享页缓存
+
+文件布局（小端）:
+    头部        魔数 b"AQDOCS01" | 文档数 N (uint64) | 下一个可用 id (int64)
+    ids         int64[N]，升序
+    文本偏移    uint64[N + 1]，相对文本数据块起点
+    元数据偏移  uint64[N + 1]，相对元数据数据块起点
+    文本数据块  UTF-8
+    元数据数据块 UTF-8 JSON
+"""
+
+import json
+import mmap
+import os
+import struct
+from typing import Dict, Iterator, List, Tuple
+
+import numpy as np
+
+MAGIC = b"AQDOCS01"
+HEADER = struct.Struct("<8sQq")
+
+
+class DocStore:
+    """基于 mmap 的只读基础文件 + 内存增量的文档存储"""
+
+    def __init__(self):
+        self.next_id = 0
+        # 基础文件（只读 mmap）
+        self._mm = None
+        self._ids = np.empty(0, dtype='<i8')
+        self._content_offsets = np.zeros(1, dtype='<u8')
+        self._meta_offsets = np.zeros(1, dtype='<u8')
+        self._content_start = 0
+        self._meta_start = 0
+        # 尚未落盘的增量
+        self._added = {}
+        self._removed = set()
+        self._metadata_updates = {}
+
+    @classmethod
+    def open(cls, path: str) -> "DocStore":
+        """以 mmap 方式打开文档存储文件"""
+        store = cls()
+        store._map(path)
+        return store
+
+    def _map(self, path: str):
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                raise ValueError(f"文档存储文件为空: {path}")
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, count, next_id = HEADER.unpack_from(mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"无法识别的文档存储格式: {path}")
+        pos = HEADER.size
+        self._ids = np.frombuffer(mm, dtype='<i8', count=count, offset=pos)
+        pos += 8 * count
+        self._content_offsets = np.frombuffer(mm, dtype='<u8', count=count + 1, offset=pos)
+        pos += 8 * (count + 1)
+        self._meta_offsets = np.frombuffer(mm, dtype='<u8', count=count + 1, offset=pos)
+        pos += 8 * (count + 1)
+        self._content_start = pos
+        self._meta_start = pos + int(self._content_offsets[-1])
+        self._mm = mm
+        self.next_id = next_id
+        self._added = {}
+        self._removed = set()
+        self._metadata_updates = {}
+
+    def _position(self, doc_id: int) -> int:
+        """文档在基础文件中的位置，不存在时返回 -1"""
+        pos = int(np.searchsorted(self._ids, doc_id))
+        if pos < len(self._ids) and self._ids[pos] == doc_id:
+            return pos
+        return -1
+
+    def __len__(self) -> int:
+        return len(self._ids) - len(self._removed) + len(self._added)
+
+    def __contains__(self, doc_id: int) -> bool:
+        if doc_id in self._added:
+            return True
+        return doc_id not in self._removed and self._position(doc_id) >= 0
+
+    def ids(self) -> Iterator[int]:
+        """按 id 升序遍历全部文档 id"""
+        for doc_id in self._ids:
+            doc_id = int(doc_id)
+            if doc_id not in self._removed:
+                yield doc_id
+        yield from sorted(self._added)
+
+    def get_content(self, doc_id: int) -> str:
+        """读取文档文本"""
+        if doc_id in self._added:
+            return self._added[doc_id][0]
+        pos = self._position(doc_id)
+        if pos < 0 or doc_id in self._removed:
+            raise KeyError(doc_id)
+        start = self._content_start + int(self._content_offsets[pos])
+        end = self._content_start + int(self._content_offsets[pos + 1])
+        return self._mm[start:end].decode("utf-8")
+
+    def get_metadata(self, doc_id: int) -> Dict:
+        """读取文档元数据"""
+        if doc_id in self._metadata_updates:
+            return self._metadata_updates[doc_id]
+        if doc_id in self._added:
+            return self._added[doc_id][1]
+        pos = self._position(doc_id)
+        if pos < 0 or doc_id in self._removed:
+            raise KeyError(doc_id)
+        start = self._meta_start + int(self._meta_offsets[pos])
+        end = self._meta_start + int(self._meta_offsets[pos + 1])
+        return json.loads(self._mm[start:end].decode("utf-8"))
+
+    def iter_metadata(self) -> Iterator[Tuple[int, Dict]]:
+        """遍历全部 (id, 元数据)"""
+        for doc_id in self.ids():
+            yield doc_id, self.get_metadata(doc_id)
+
+    def add(self, doc_id: int, content: str, metadata: Dict):
+        """新增文档"""
+        self._added[doc_id] = (content, metadata)
+        self.next_id = max(self.next_id, doc_id + 1)
+
+    def update_metadata(self, doc_id: int, metadata: Dict):
+        """替换文档元数据"""
+        if doc_id in self._added:
+            self._added[doc_id] = (self._added[doc_id][0], metadata)
+        elif doc_id in self:
+            self._metadata_updates[doc_id] = metadata
+        else:
+            raise KeyError(doc_id)
+
+    def remove(self, doc_id: int):
+        """删除文档"""
+        if self._added.pop(doc_id, None) is None:
+            self._removed.add(doc_id)
+        self._metadata_updates.pop(doc_id, None)
+
+    def save(self, path: str):
+        """
+        合并基础文件与增量后写入新文件，原子替换后重新 mmap
+
+        写入过程中先占位偏移表，流式写出数据块后再回填，
+        不需要把全部文本同时放进内存
+        """
+        ids = sorted(self.ids())
+        count = len(ids)
+        content_offsets = np.zeros(count + 1, dtype='<u8')
+        meta_offsets = np.zeros(count + 1, dtype='<u8')
+
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, count, self.next_id))
+            f.write(np.asarray(ids, dtype='<i8').tobytes())
+            offsets_pos = f.tell()
+            f.write(b"\0" * (16 * (count + 1)))
+
+            size = 0
+            for i, doc_id in enumerate(ids):
+                data = self.get_content(doc_id).encode("utf-8")
+                f.write(data)
+                size += len(data)
+                content_offsets[i + 1] = size
+            size = 0
+            for i, doc_id in enumerate(ids):
+                data = json.dumps(self.get_metadata(doc_id), ensure_ascii=False).encode("utf-8")
+                f.write(data)
+                size += len(data)
+                meta_offsets[i + 1] = size
+
+            f.seek(offsets_pos)
+            f.write(content_offsets.tobytes())
+            f.write(meta_offsets.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+        # 旧 mmap 上可能仍有数组视图，不主动关闭，由垃圾回收释放
+        self._map(path)
+
+    @classmethod
+    def from_lists(cls, ids: List[int], contents: List[str], metadatas: List[Dict], next_id: int) -> "DocStore":
+        """由内存列表构造（用于迁移旧版 JSON 文档文件）"""
+        store = cls()
+        for doc_id, content, metadata in zip(ids, contents, metadatas):
+            store.add(doc_id, content, metadata)
+        store.next_id = max(store.next_id, next_id)
+        return store
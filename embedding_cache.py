@@ -0,0 +1,193 @@
+"""
+嵌入向量缓存
+以 (模型名, 规范化文本哈希) 为键，磁盘层使用 SQLite 存储 float32 二进制向量，
+内存层为按条数淘汰的 LRU，磁盘层按总字节数淘汰最久未访问的条目
+"""
+
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, List
+
+import numpy as np
+
+from config import Config
+
+
+class EmbeddingCache:
+    """内容寻址的嵌入向量缓存，供索引构建和查询共享"""
+
+    def __init__(self, db_path: str = None, max_bytes: int = None, memory_items: int = None):
+        """
+        初始化缓存
+
+        参数:
+            db_path: SQLite 文件路径，默认为 Config.EMBED_CACHE_PATH
+            max_bytes: 磁盘层向量总字节上限，默认为 Config.EMBED_CACHE_MAX_BYTES
+            memory_items: 内存 LRU 层的最大条数，默认为 Config.EMBED_CACHE_MEMORY_ITEMS
+        """
+        self.db_path = db_path or Config.EMBED_CACHE_PATH
+        self.max_bytes = max_bytes or Config.EMBED_CACHE_MAX_BYTES
+        self.memory_items = memory_items or Config.EMBED_CACHE_MEMORY_ITEMS
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON embeddings(last_access)")
+        self._conn.commit()
+        self._disk_bytes = self._total_size()
+
+    def _total_size(self) -> int:
+        """磁盘层向量总字节数"""
+        return self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM embeddings").fetchone()[0]
+
+    @staticmethod
+    def normalize_text(text: str) -> str:
+        """规范化文本：统一全角/半角并折叠空白"""
+        text = unicodedata.normalize("NFKC", text)
+        return re.sub(r"\s+", " ", text).strip()
+
+    @classmethod
+    def make_key(cls, model_name: str, text: str) -> str:
+        """生成 (模型名, 规范化文本) 的内容哈希键"""
+        digest = hashlib.sha256(cls.normalize_text(text).encode("utf-8")).hexdigest()
+        return f"{model_name}:{digest}"
+
+    def _remember(self, key: str, vector: np.ndarray):
+        """写入内存 LRU 层（调用方需持有锁）"""
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def get_many(self, model_name: str, texts: List[str]) -> Dict[int, List[float]]:
+        """
+        批量查询缓存
+
+        返回:
+            {输入位置: 嵌入向量}，未命中的位置不包含在结果中
+        """
+        keys = [self.make_key(model_name, text) for text in texts]
+        found = {}
+        missing = {}
+        with self._lock:
+            for i, key in enumerate(keys):
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    found[i] = vector
+                else:
+                    missing.setdefault(key, []).append(i)
+
+            if missing:
+                now = time.time()
+                disk_keys = list(missing)
+                for start in range(0, len(disk_keys), 500):
+                    part = disk_keys[start:start + 500]
+                    rows = self._conn.execute(
+                        f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(part))})",
+                        part
+                    ).fetchall()
+                    for key, blob in rows:
+                        vector = np.frombuffer(blob, dtype=np.float32)
+                        self._remember(key, vector)
+                        for i in missing[key]:
+                            found[i] = vector
+                    if rows:
+                        self._conn.executemany(
+                            "UPDATE embeddings SET last_access = ? WHERE key = ?",
+                            [(now, key) for key, _ in rows]
+                        )
+                self._conn.commit()
+
+            self.hits += len(found)
+            self.misses += len(texts) - len(found)
+
+        return {i: vector.tolist() for i, vector in found.items()}
+
+    def put_many(self, model_name: str, texts: List[str], embeddings: List[List[float]]):
+        """批量写入缓存，写入后按磁盘容量淘汰"""
+        now = time.time()
+        rows = []
+        with self._lock:
+            for text, embedding in zip(texts, embeddings):
+                key = self.make_key(model_name, text)
+                vector = np.asarray(embedding, dtype=np.float32)
+                self._remember(key, vector)
+                blob = vector.tobytes()
+                rows.append((key, model_name, blob, len(blob), now))
+                # 覆盖写入时会高估总量，淘汰前会重新统计
+                self._disk_bytes += len(blob)
+
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, model, vector, size, last_access) VALUES (?, ?, ?, ?, ?)",
+                rows
+            )
+            self._conn.commit()
+            self._evict()
+
+    def _evict(self):
+        """磁盘层超出容量时删除最久未访问的条目（调用方需持有锁）"""
+        if self._disk_bytes <= self.max_bytes:
+            return
+        total = self._disk_bytes = self._total_size()
+        if total <= self.max_bytes:
+            return
+
+        # 一次淘汰到上限的 90%，避免每次写入都触发淘汰
+        target = total - int(self.max_bytes * 0.9)
+        freed = 0
+        evicted = []
+        for key, size in self._conn.execute("SELECT key, size FROM embeddings ORDER BY last_access"):
+            evicted.append((key,))
+            freed += size
+            if freed >= target:
+                break
+        self._conn.executemany("DELETE FROM embeddings WHERE key = ?", evicted)
+        self._conn.commit()
+        for (key,) in evicted:
+            self._memory.pop(key, None)
+        self._disk_bytes -= freed
+        print(f"嵌入缓存淘汰 {len(evicted)} 条，释放 {freed / 1024 / 1024:.1f} MB")
+
+    def stats(self) -> Dict[str, int]:
+        """缓存命中统计"""
+        with self._lock:
+            count, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM embeddings"
+            ).fetchone()
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "memory_items": len(self._memory),
+                "disk_items": count,
+                "disk_bytes": size
+            }
+
+    def close(self):
+        """关闭数据库连接"""
+        with self._lock:
+            self._conn.close()
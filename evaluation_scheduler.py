@@ -0,0 +1,127 @@
+"""
+后台置信度评估
+回答生成后立即返回，模型评估在线程池中排队执行；
+结果按 request_id 保存，可通过接口查询或在流式接口中等待，条目按 TTL 过期、按数量上限淘汰
+"""
+
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+from config import Config
+
+
+class EvaluationScheduler:
+    """后台评估调度器"""
+
+    def __init__(self, max_workers: int = None, ttl: float = None, max_results: int = None):
+        """
+        参数:
+            max_workers: 同时执行的评估数，默认为 Config.EVALUATION_MAX_WORKERS
+            ttl: 评估结果保留时间（秒），默认为 Config.EVALUATION_RESULT_TTL
+            max_results: 最多保留的评估结果数，默认为 Config.EVALUATION_MAX_RESULTS
+        """
+        self.ttl = ttl or Config.EVALUATION_RESULT_TTL
+        self.max_results = max_results or Config.EVALUATION_MAX_RESULTS
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers or Config.EVALUATION_MAX_WORKERS, thread_name_prefix="evaluation"
+        )
+        # request_id -> {"status", "confidence", "evaluation", "future", "expires"}
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.completed = 0
+        self.failed = 0
+
+    def submit(self, request_id: str, evaluate: Callable[[], Dict]) -> Future:
+        """
+        提交后台评估
+
+        参数:
+            request_id: 分析请求标识
+            evaluate: 执行评估的函数，返回包含 confidence 与 confidence_evaluation 的消息
+        """
+        future = self._executor.submit(evaluate)
+        with self._lock:
+            self._expire(time.time())
+            self._entries[request_id] = {
+                "status": "pending",
+                "confidence": None,
+                "evaluation": None,
+                "future": future,
+                "expires": time.time() + self.ttl
+            }
+            while len(self._entries) > self.max_results:
+                self._entries.popitem(last=False)
+        future.add_done_callback(lambda f: self._finish(request_id, f))
+        return future
+
+    def _finish(self, request_id: str, future: Future):
+        """评估完成后记录结果"""
+        try:
+            response = future.result()
+            update = {
+                "status": "completed",
+                "confidence": response["confidence"],
+                "evaluation": response.get("confidence_evaluation", "")
+            }
+        except Exception as e:
+            print(f"后台评估 {request_id} 失败: {str(e)}")
+            update = {"status": "failed", "evaluation": f"评估失败: {str(e)}"}
+
+        with self._lock:
+            if update["status"] == "completed":
+                self.completed += 1
+            else:
+                self.failed += 1
+            entry = self._entries.get(request_id)
+            if entry is not None:
+                entry.update(update)
+
+    def get(self, request_id: str) -> Optional[Dict]:
+        """查询评估状态，未知或已过期的请求返回 None"""
+        with self._lock:
+            self._expire(time.time())
+            entry = self._entries.get(request_id)
+            if entry is None:
+                return None
+            return {
+                "request_id": request_id,
+                "status": entry["status"],
+                "confidence": entry["confidence"],
+                "evaluation": entry["evaluation"]
+            }
+
+    async def wait(self, request_id: str, timeout: float = None) -> Optional[Dict]:
+        """等待评估完成并返回结果，超时后返回当前状态"""
+        with self._lock:
+            entry = self._entries.get(request_id)
+            future = entry["future"] if entry else None
+        if future is None:
+            return None
+        try:
+            await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), timeout)
+        except asyncio.TimeoutError:
+            pass
+        except Exception:
+            # 失败信息已由 _finish 记录（该回调先于 wrap_future 的回调注册，此时已执行）
+            pass
+        return self.get(request_id)
+
+    def _expire(self, now: float):
+        """删除已过期且执行完毕的条目（调用方需持有锁）"""
+        expired = [key for key, entry in self._entries.items()
+                   if entry["expires"] <= now and entry["future"].done()]
+        for key in expired:
+            del self._entries[key]
+
+    def stats(self) -> Dict[str, int]:
+        """评估统计"""
+        with self._lock:
+            return {
+                "pending": sum(1 for entry in self._entries.values() if entry["status"] == "pending"),
+                "completed": self.completed,
+                "failed": self.failed
+            }
@@ -0,0 +1,129 @@
+"""
+索引清单
+记录已入库文件的路径、大小、修改时间、内容哈希以及对应的向量 id，
+用于判断哪些文件需要新增、重建或删除
+"""
+
+import hashlib
+import json
+import os
+from typing import Dict, List, Tuple
+
+from config import Config
+
+# 分块元数据格式变化时递增，旧版本清单中的文件会全部重新入库（嵌入可从嵌入缓存复用）
+SCHEMA_VERSION = 4
+
+
+class IndexManifest:
+    """已索引文件清单"""
+
+    def __init__(self, path: str):
+        """
+        初始化清单
+
+        参数:
+            path: 清单文件路径
+        """
+        self.path = path
+        # 键为相对 Config.DATA_DIR 的路径，如 pdfs/xxx.pdf
+        self.files = {}
+        self.version = 1
+        self.load()
+
+    def load(self):
+        """从磁盘加载清单"""
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.files = data.get("files", {})
+            self.version = data.get("version", 1)
+
+    def save(self):
+        """原子写入清单文件（调用方已按当前格式处理完全部差异）"""
+        self.version = SCHEMA_VERSION
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": self.version, "files": self.files}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def reset(self):
+        """清空清单"""
+        self.files = {}
+        self.version = SCHEMA_VERSION
+
+    @staticmethod
+    def file_hash(path: str) -> str:
+        """计算文件内容的 SHA-256"""
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    @staticmethod
+    def scan() -> Dict[str, Dict]:
+        """
+        扫描数据目录中的可索引文件
+
+        返回:
+            {相对路径: {"size": 字节数, "mtime": 修改时间}}
+        """
+        current = {}
+        for directory, suffix in ((Config.PDF_DIR, ".pdf"), (Config.JSON_DIR, ".json")):
+            if not os.path.isdir(directory):
+                continue
+            for entry in os.scandir(directory):
+                if entry.is_file() and entry.name.endswith(suffix):
+                    stat = entry.stat()
+                    key = os.path.relpath(entry.path, Config.DATA_DIR)
+                    current[key] = {"size": stat.st_size, "mtime": stat.st_mtime}
+        return current
+
+    def diff(self, current: Dict[str, Dict]) -> Tuple[List[str], List[str], List[str]]:
+        """
+        对比当前文件与清单
+
+        大小和修改时间均未变化的文件视为未变更；否则计算内容哈希，
+        内容未变的文件只刷新修改时间。清单版本落后于 SCHEMA_VERSION 时，
+        已登记的文件全部视为变更。
+
+        返回:
+            (新增文件, 变更文件, 已删除文件)
+        """
+        added, changed = [], []
+        outdated = self.version < SCHEMA_VERSION
+        for key, state in current.items():
+            entry = self.files.get(key)
+            if entry is None:
+                state["hash"] = self.file_hash(os.path.join(Config.DATA_DIR, key))
+                added.append(key)
+                continue
+            if entry["size"] == state["size"] and entry["mtime"] == state["mtime"]:
+                if outdated:
+                    state["hash"] = entry["hash"]
+                    changed.append(key)
+                continue
+
+            state["hash"] = self.file_hash(os.path.join(Config.DATA_DIR, key))
+            if state["hash"] == entry["hash"] and not outdated:
+                entry["mtime"] = state["mtime"]
+            else:
+                changed.append(key)
+
+        removed = [key for key in self.files if key not in current]
+        return added, changed, removed
+
+    def record(self, key: str, state: Dict, chunk_ids: List[int]):
+        """记录文件及其向量 id"""
+        self.files[key] = {
+            "size": state["size"],
+            "mtime": state["mtime"],
+            "hash": state.get("hash") or self.file_hash(os.path.join(Config.DATA_DIR, key)),
+            "chunk_ids": chunk_ids
+        }
+
+    def forget(self, key: str) -> List[int]:
+        """移除文件记录，返回其向量 id"""
+        entry = self.files.pop(key, None)
+        return entry["chunk_ids"] if entry else []
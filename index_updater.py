@@ -0,0 +1,209 @@
+"""
+向量索引增量更新
+根据索引清单只嵌入新增或变更的文件，并删除已移除文件的向量
+
+索引、文档存储、清单等文件的写入都在索引文件锁内进行：多个 worker 进程同时启动或更新时依次执行，
+后获得锁的进程先重新加载其他进程已保存的索引与清单，不会覆盖彼此的临时文件或发布新旧混杂的索引
+"""
+
+import os
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from config import Config
+from data_loader import DataLoader, batched, prefetch
+from index_manifest import IndexManifest
+from vector_store import VectorStore
+
+try:
+    import fcntl
+except ImportError:
+    # Windows 没有 fcntl，此时不加锁（只应以单个进程运行服务）
+    fcntl = None
+
+
+class IndexUpdater:
+    """增量维护向量索引与索引清单"""
+
+    def __init__(self, vector_store: VectorStore, index_path: str = None):
+        """
+        初始化更新器
+
+        参数:
+            vector_store: 向量存储实例
+            index_path: FAISS 索引文件路径，默认为 Config.VECTOR_STORE_PATH
+        """
+        self.vector_store = vector_store
+        self.index_path = index_path or Config.VECTOR_STORE_PATH
+        self.manifest = IndexManifest(self.index_path.replace(".faiss", ".manifest.json"))
+        self.lock_path = self.index_path.replace(".faiss", ".lock")
+        self.loader = DataLoader()
+        # 本进程最近一次加载或保存的清单文件状态，用于发现其他进程写入的新版本
+        self._manifest_stamp = self._stamp()
+
+    def _stamp(self) -> Optional[Tuple[int, int]]:
+        """清单文件的 (修改时间, 大小)，文件不存在时为 None"""
+        try:
+            stat = os.stat(self.manifest.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    @contextmanager
+    def _exclusive(self) -> Iterator[None]:
+        """持有索引文件锁（进程间互斥，进程退出时由系统释放）"""
+        if fcntl is None:
+            yield
+            return
+        with open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _reload(self):
+        """重新加载磁盘上的索引与清单"""
+        self.vector_store.load_index(self.index_path)
+        self.manifest.load()
+        self._manifest_stamp = self._stamp()
+
+    def load_or_build(self) -> Dict:
+        """
+        启动时调用：加载现有索引并增量纳入新增、变更或删除的数据文件，索引不存在时全量构建
+
+        返回:
+            与 update 相同的统计信息
+        """
+        with self._exclusive():
+            if os.path.exists(self.index_path):
+                print("加载现有金融知识库...")
+                self._reload()
+            else:
+                print("构建金融知识库索引...")
+                self.vector_store.create_index()
+                self.manifest.reset()
+            return self._update()
+
+    def rebuild(self) -> Dict:
+        """清空索引后全量构建"""
+        with self._exclusive():
+            self.vector_store.create_index()
+            self.manifest.reset()
+            return self._update()
+
+    def update(self) -> Dict:
+        """
+        增量更新索引（其他进程已更新过索引时先加载其结果，再处理剩余差异）
+
+        返回:
+            与 DataUpdateResponse 字段一致的统计信息
+        """
+        with self._exclusive():
+            if self._stamp() != self._manifest_stamp and os.path.exists(self.index_path):
+                print("检测到其他进程已更新索引，重新加载")
+                self._reload()
+            return self._update()
+
+    def _update(self) -> Dict:
+        """增量更新索引（调用方持有索引文件锁）"""
+        start_time = time.time()
+
+        # 旧版索引没有清单，按文档来源重建清单
+        bootstrapped = not self.manifest.files and len(self.vector_store) > 0
+        documents_removed = self._bootstrap_manifest() if bootstrapped else 0
+
+        current = self.manifest.scan()
+        added, changed, removed = self.manifest.diff(current)
+        if not (added or changed or removed or bootstrapped):
+            print("金融知识库已是最新，无需更新")
+            return self._stats(0, 0, start_time)
+
+        print(f"检测到新增 {len(added)} 个、变更 {len(changed)} 个、删除 {len(removed)} 个文件")
+        stale_ids = []
+        for key in changed + removed:
+            # 与其他文件合并的重复分块只解除关联，不删除
+            stale_ids.extend(self.vector_store.detach_source(self.manifest.forget(key), os.path.basename(key)))
+        documents_removed += self.vector_store.remove_ids(stale_ids)
+        chunks, duplicates = self._index_files(added + changed, current)
+        self.vector_store.optimize_index()
+
+        self.vector_store.save_index(self.index_path)
+        self.manifest.save()
+        self._manifest_stamp = self._stamp()
+        return self._stats(chunks - duplicates, documents_removed, start_time, chunks, duplicates)
+
+    def _index_files(self, keys: List[str], current: Dict[str, Dict]) -> Tuple[int, int]:
+        """
+        加载、嵌入并登记指定文件
+
+        返回:
+            (分块数, 其中合并到已有文档的近似重复分块数)
+        """
+        if not keys:
+            return 0, 0
+
+        pdf_files = [os.path.basename(key) for key in keys if key.endswith(".pdf")]
+        json_files = [os.path.basename(key) for key in keys if key.endswith(".json")]
+        documents = self.loader.iter_documents(pdf_files, json_files)
+
+        # 分批嵌入入库，后台线程同时解析后续批次，全部分块不会同时驻留内存
+        chunk_ids = {key: [] for key in keys}
+        chunks = 0
+        merged_before = self.vector_store.dedup_stats["merged"]
+        for batch in prefetch(batched(documents, Config.INGEST_BATCH_SIZE), Config.INGEST_PREFETCH_BATCHES):
+            content_list = []
+            metadata_list = []
+            doc_keys = []
+            for doc in batch:
+                source = doc["metadata"].get("source", "未标注来源")
+                directory = Config.PDF_DIR if doc["metadata"].get("type") == "pdf" else Config.JSON_DIR
+                content_list.append(doc["content"])
+                # 保留完整的结构化元数据，供检索时按公司、代码、年份等过滤
+                metadata_list.append(doc["metadata"])
+                doc_keys.append(os.path.relpath(os.path.join(directory, source), Config.DATA_DIR))
+
+            ids = self.vector_store.add_documents(content_list, metadata_list)
+            for key, doc_id in zip(doc_keys, ids):
+                chunk_ids[key].append(doc_id)
+            chunks += len(ids)
+
+        for key in keys:
+            # 文件内的重复分块对应同一个 id
+            self.manifest.record(key, current[key], list(dict.fromkeys(chunk_ids[key])))
+        return chunks, self.vector_store.dedup_stats["merged"] - merged_before
+
+    def _bootstrap_manifest(self) -> int:
+        """
+        为没有清单的旧版索引按 source 字段登记文件，
+        找不到对应文件的向量视为过期并删除
+
+        返回:
+            删除的文档数
+        """
+        by_source = {}
+        for doc_id, metadata in self.vector_store.doc_store.iter_metadata():
+            by_source.setdefault(metadata.get("source"), []).append(doc_id)
+
+        for key, state in self.manifest.scan().items():
+            ids = by_source.pop(os.path.basename(key), None)
+            if ids is not None:
+                self.manifest.record(key, state, ids)
+
+        orphan_ids = [doc_id for ids in by_source.values() for doc_id in ids]
+        print(f"已根据现有索引重建清单，登记 {len(self.manifest.files)} 个文件")
+        return self.vector_store.remove_ids(orphan_ids)
+
+    def _stats(self, documents_added: int, documents_removed: int, start_time: float,
+               chunks: int = 0, duplicates: int = 0) -> Dict:
+        """组装更新统计"""
+        return {
+            "status": "success",
+            "documents_added": documents_added,
+            "documents_removed": documents_removed,
+            "duplicates_merged": duplicates,
+            "dedup_ratio": round(duplicates / chunks, 4) if chunks else 0.0,
+            "total_documents": len(self.vector_store),
+            "time_elapsed": round(time.time() - start_time, 3)
+        }
@@ -0,0 +1,334 @@
+"""
+词法倒排索引（BM25）
+与 FAISS 索引并行维护，弥补稠密向量对股票代码、公司名称、年份等精确词的漏检。
+中文分词使用 jieba（未安装时退化为中文二元组切分）
+
+文件布局（小端），与文档存储一样以 mmap 打开:
+    头部        魔数 b"AQLEX001" | 词项数 T (uint64) | 倒排项数 P (uint64) | 文档数 N (uint64)
+    文档 id     int64[N]，升序
+    文档长度    uint32[N]
+    倒排偏移    uint64[T + 1]
+    倒排文档    uint32[P]，为文档 id 数组中的位置
+    词频        uint16[P]
+    词表        UTF-8，按字典序排列、以换行分隔，第 i 个词项对应第 i 段倒排
+"""
+
+import math
+import mmap
+import os
+import re
+import struct
+import threading
+import unicodedata
+from collections import Counter
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+
+from config import Config
+
+try:
+    import jieba
+    jieba.setLogLevel(60)
+except ImportError:
+    jieba = None
+
+MAGIC = b"AQLEX001"
+HEADER = struct.Struct("<8sQQQ")
+MAX_TF = np.iinfo(np.uint16).max
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:\.[0-9]+)?|[一-鿿]+")
+STOPWORDS = {"的", "了", "是", "在", "和", "与", "及", "或", "吗", "呢", "吧", "啊", "有", "为", "对", "就", "也", "都"}
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    分词：统一全角/半角并转小写后，用 jieba 搜索引擎模式切分；
+    未安装 jieba 时中文按二元组切分，英文和数字整体保留
+    """
+    text = unicodedata.normalize("NFKC", text).lower()
+    if jieba is not None:
+        tokens = (token.strip() for token in jieba.cut_for_search(text))
+        return [token for token in tokens if token and TOKEN_PATTERN.match(token) and token not in STOPWORDS]
+
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text):
+        if token[0] < "一":
+            tokens.append(token)
+        elif len(token) == 1:
+            if token not in STOPWORDS:
+                tokens.append(token)
+        else:
+            tokens.extend(token[i:i + 2] for i in range(len(token) - 1))
+    return tokens
+
+
+class LexicalIndex:
+    """基于 mmap 的只读基础文件 + 内存增量的 BM25 倒排索引"""
+
+    def __init__(self, k1: float = None, b: float = None):
+        """
+        初始化倒排索引
+
+        参数:
+            k1: BM25 词频饱和参数，默认为 Config.BM25_K1
+            b: BM25 文档长度归一化参数，默认为 Config.BM25_B
+        """
+        self.k1 = k1 or Config.BM25_K1
+        self.b = Config.BM25_B if b is None else b
+        # 基础文件（只读 mmap）
+        self._mm = None
+        self._terms = {}
+        self._doc_ids = np.empty(0, dtype='<i8')
+        self._doc_lens = np.empty(0, dtype='<u4')
+        self._posting_offsets = np.zeros(1, dtype='<u8')
+        self._posting_docs = np.empty(0, dtype='<u4')
+        self._posting_tfs = np.empty(0, dtype='<u2')
+        self._base_total_len = 0
+        # 尚未落盘的增量
+        self._added = {}  # doc_id -> (文档长度, Counter)
+        self._delta_postings = {}  # term -> {doc_id: tf}
+        self._removed = set()
+        self._removed_len = 0
+        self._lock = threading.RLock()
+
+    @classmethod
+    def open(cls, path: str) -> "LexicalIndex":
+        """以 mmap 方式打开倒排索引文件"""
+        index = cls()
+        index._map(path)
+        return index
+
+    def _map(self, path: str):
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                raise ValueError(f"倒排索引文件为空: {path}")
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, n_terms, n_postings, n_docs = HEADER.unpack_from(mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"无法识别的倒排索引格式: {path}")
+        pos = HEADER.size
+        self._doc_ids = np.frombuffer(mm, dtype='<i8', count=n_docs, offset=pos)
+        pos += 8 * n_docs
+        self._doc_lens = np.frombuffer(mm, dtype='<u4', count=n_docs, offset=pos)
+        pos += 4 * n_docs
+        self._posting_offsets = np.frombuffer(mm, dtype='<u8', count=n_terms + 1, offset=pos)
+        pos += 8 * (n_terms + 1)
+        self._posting_docs = np.frombuffer(mm, dtype='<u4', count=n_postings, offset=pos)
+        pos += 4 * n_postings
+        self._posting_tfs = np.frombuffer(mm, dtype='<u2', count=n_postings, offset=pos)
+        pos += 2 * n_postings
+        vocab = mm[pos:].decode("utf-8")
+        self._terms = {term: i for i, term in enumerate(vocab.split("\n"))} if n_terms else {}
+        self._base_total_len = int(self._doc_lens.sum(dtype='uint64'))
+        self._mm = mm
+        self._added = {}
+        self._delta_postings = {}
+        self._removed = set()
+        self._removed_len = 0
+
+    def _position(self, doc_id: int) -> int:
+        """文档在基础文件中的位置，不存在时返回 -1"""
+        pos = int(np.searchsorted(self._doc_ids, doc_id))
+        if pos < len(self._doc_ids) and self._doc_ids[pos] == doc_id:
+            return pos
+        return -1
+
+    def __len__(self) -> int:
+        return len(self._doc_ids) - len(self._removed) + len(self._added)
+
+    def add(self, doc_id: int, text: str):
+        """新增文档"""
+        counts = Counter(tokenize(text))
+        with self._lock:
+            self._added[doc_id] = (sum(counts.values()), counts)
+            for term, tf in counts.items():
+                self._delta_postings.setdefault(term, {})[doc_id] = tf
+
+    def add_many(self, items: Iterable[Tuple[int, str]]):
+        """批量新增 (doc_id, 文本)"""
+        for doc_id, text in items:
+            self.add(doc_id, text)
+
+    def remove(self, doc_ids: Iterable[int]):
+        """删除文档"""
+        with self._lock:
+            for doc_id in doc_ids:
+                added = self._added.pop(doc_id, None)
+                if added is not None:
+                    for term in added[1]:
+                        self._delta_postings[term].pop(doc_id, None)
+                        if not self._delta_postings[term]:
+                            del self._delta_postings[term]
+                    continue
+                pos = self._position(doc_id)
+                if pos >= 0 and doc_id not in self._removed:
+                    self._removed.add(doc_id)
+                    self._removed_len += int(self._doc_lens[pos])
+
+    def search(self, query: str, k: int = 10, allowed: np.ndarray = None) -> List[Tuple[int, float]]:
+        """
+        BM25 检索
+
+        参数:
+            query: 查询文本
+            k: 返回结果数
+            allowed: 有序的候选 id 数组，只在这些文档中检索；为 None 时不过滤
+
+        返回:
+            按得分降序的 [(doc_id, bm25 得分), ...]
+        """
+        terms = set(tokenize(query))
+        with self._lock:
+            n_docs = len(self)
+            if not terms or n_docs == 0:
+                return []
+            total_len = self._base_total_len - self._removed_len + sum(n for n, _ in self._added.values())
+            avgdl = max(total_len / n_docs, 1.0)
+            removed_pos = np.array([self._position(doc_id) for doc_id in self._removed], dtype='int64')
+
+            base_scores = None
+            delta_scores = {}
+            for term in terms:
+                postings = self._base_postings(term)
+                delta = self._delta_postings.get(term, {})
+                df = len(delta)
+                if postings is not None:
+                    df += len(postings[0])
+                    if len(removed_pos):
+                        df -= int(np.isin(postings[0], removed_pos).sum())
+                if df <= 0:
+                    continue
+                idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+
+                if postings is not None and len(postings[0]):
+                    positions, tfs = postings
+                    tfs = tfs.astype('float32')
+                    norm = self.k1 * (1 - self.b + self.b * self._doc_lens[positions] / avgdl)
+                    if base_scores is None:
+                        base_scores = np.zeros(len(self._doc_ids), dtype='float32')
+                    base_scores[positions] += idf * tfs * (self.k1 + 1) / (tfs + norm)
+                for doc_id, tf in delta.items():
+                    norm = self.k1 * (1 - self.b + self.b * self._added[doc_id][0] / avgdl)
+                    delta_scores[doc_id] = delta_scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+
+            if allowed is not None and delta_scores:
+                delta_ids = np.fromiter(delta_scores, dtype='int64')
+                keep = np.isin(delta_ids, allowed)
+                delta_scores = {int(doc_id): delta_scores[int(doc_id)] for doc_id in delta_ids[keep]}
+            candidates = list(delta_scores.items())
+            if base_scores is not None:
+                if len(removed_pos):
+                    base_scores[removed_pos] = 0
+                if allowed is not None:
+                    base_scores *= self._base_mask(allowed)
+                nonzero = np.flatnonzero(base_scores)
+                if len(nonzero) > k:
+                    nonzero = nonzero[np.argpartition(-base_scores[nonzero], k)[:k]]
+                candidates.extend((int(self._doc_ids[pos]), float(base_scores[pos])) for pos in nonzero)
+
+        candidates.sort(key=lambda item: item[1], reverse=True)
+        return candidates[:k]
+
+    def _base_mask(self, allowed: np.ndarray) -> np.ndarray:
+        """候选 id 在基础文件文档数组上的掩码"""
+        mask = np.zeros(len(self._doc_ids), dtype='float32')
+        if len(self._doc_ids) and len(allowed):
+            positions = np.minimum(np.searchsorted(self._doc_ids, allowed), len(self._doc_ids) - 1)
+            positions = positions[self._doc_ids[positions] == allowed]
+            mask[positions] = 1
+        return mask
+
+    def _base_postings(self, term: str):
+        """基础文件中词项的 (文档位置, 词频)，不存在时返回 None"""
+        i = self._terms.get(term)
+        if i is None:
+            return None
+        start, end = int(self._posting_offsets[i]), int(self._posting_offsets[i + 1])
+        return self._posting_docs[start:end], self._posting_tfs[start:end]
+
+    def save(self, path: str):
+        """合并基础文件与增量后写入新文件，原子替换后重新 mmap"""
+        with self._lock:
+            # 基础文件中仍然有效的倒排项，展开为 (词项, 文档 id, 词频)
+            base_vocab = sorted(self._terms, key=self._terms.get)
+            counts = np.diff(self._posting_offsets.astype('int64'))
+            base_term_idx = np.repeat(np.arange(len(base_vocab), dtype='int64'), counts)
+            base_doc = self._doc_ids[self._posting_docs.astype('int64')] if len(self._posting_docs) else \
+                np.empty(0, dtype='int64')
+            base_tf = np.asarray(self._posting_tfs)
+            if self._removed:
+                keep = ~np.isin(base_doc, np.fromiter(self._removed, dtype='int64'))
+                base_term_idx, base_doc, base_tf = base_term_idx[keep], base_doc[keep], base_tf[keep]
+
+            vocab = sorted(set(base_vocab) | set(self._delta_postings))
+            new_idx = {term: i for i, term in enumerate(vocab)}
+            base_map = np.array([new_idx[term] for term in base_vocab], dtype='int64')
+            delta = [(new_idx[term], doc_id, min(tf, MAX_TF))
+                     for term, docs in self._delta_postings.items() for doc_id, tf in docs.items()]
+            delta = np.array(delta, dtype='int64').reshape(-1, 3)
+
+            term_idx = np.concatenate([base_map[base_term_idx], delta[:, 0]])
+            doc = np.concatenate([base_doc, delta[:, 1]])
+            tf = np.concatenate([base_tf.astype('int64'), delta[:, 2]])
+            order = np.lexsort((doc, term_idx))
+            term_idx, doc, tf = term_idx[order], doc[order], tf[order]
+
+            # 删除后不再出现的词项从词表中去掉
+            term_counts = np.bincount(term_idx, minlength=len(vocab))
+            used = term_counts > 0
+            vocab = [term for term, u in zip(vocab, used) if u]
+            posting_offsets = np.zeros(len(vocab) + 1, dtype='<u8')
+            np.cumsum(term_counts[used], out=posting_offsets[1:])
+
+            live = ~np.isin(self._doc_ids, np.fromiter(self._removed, dtype='int64')) if self._removed else \
+                np.ones(len(self._doc_ids), dtype=bool)
+            doc_ids = np.concatenate([self._doc_ids[live], np.fromiter(self._added, dtype='int64')])
+            doc_lens = np.concatenate([self._doc_lens[live], np.array([n for n, _ in self._added.values()],
+                                                                       dtype='<u4')])
+            order = np.argsort(doc_ids, kind="stable")
+            doc_ids, doc_lens = doc_ids[order].astype('<i8'), doc_lens[order].astype('<u4')
+            posting_docs = np.searchsorted(doc_ids, doc).astype('<u4')
+
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(HEADER.pack(MAGIC, len(vocab), len(doc), len(doc_ids)))
+                f.write(doc_ids.tobytes())
+                f.write(doc_lens.tobytes())
+                f.write(posting_offsets.tobytes())
+                f.write(posting_docs.tobytes())
+                f.write(tf.astype('<u2').tobytes())
+                f.write("\n".join(vocab).encode("utf-8"))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+
+            # 旧 mmap 上可能仍有数组视图，不主动关闭，由垃圾回收释放
+            self._map(path)
+
+    @classmethod
+    def build(cls, items: Iterable[Tuple[int, str]]) -> "LexicalIndex":
+        """由 (doc_id, 文本) 构造（用于为没有倒排索引的旧版向量库补建）"""
+        index = cls()
+        index.add_many(items)
+        return index
+
+
+def reciprocal_rank_fusion(rankings: List[List[int]], k: int = None) -> Dict[int, float]:
+    """
+    倒数排名融合：score(d) = Σ 1 / (k + rank)，rank 从 1 开始
+
+    参数:
+        rankings: 多路检索各自按相关度排序的文档 id 列表
+        k: 平滑常数，默认为 Config.RRF_K
+
+    返回:
+        doc_id -> 融合得分
+    """
+    k = k or Config.RRF_K
+    scores = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return scores
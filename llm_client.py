@@ -0,0 +1,331 @@
+"""
+Ollama 请求调度
+所有模型请求（生成、评估、重排序、数据增强、嵌入）共享连接池，并经过同一个优先级调度器：
+1. 同时发往 Ollama 的请求数不超过 Config.LLM_MAX_IN_FLIGHT，其中一部分只留给交互请求
+2. 空闲时按优先级放行：interactive > evaluation > enrichment > embedding
+3. 各优先级的排队数有上限，排队超过上限或等待超时时抛出 LLMBusyError
+"""
+
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncIterator, Dict, Optional
+
+import ollama
+
+from config import Config
+from metrics import record_llm_call, record_queue_wait
+
+PRIORITIES = {"interactive": 0, "evaluation": 1, "enrichment": 2, "embedding": 3}
+
+
+class LLMBusyError(RuntimeError):
+    """调度器排队已满或等待超时"""
+
+
+class _Waiter:
+    """排队中的请求，线程调用方等待 Event，协程调用方等待 Future"""
+
+    def __init__(self, priority: str, loop: asyncio.AbstractEventLoop = None):
+        self.priority = priority
+        self.granted = False
+        self.cancelled = False
+        self.enqueued_at = time.perf_counter()
+        self.granted_at = None
+        self.loop = loop
+        self.event = None if loop else threading.Event()
+        self.future = loop.create_future() if loop else None
+
+    def grant(self):
+        self.granted = True
+        self.granted_at = time.perf_counter()
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(self._resolve)
+
+    def _resolve(self):
+        if not self.future.done():
+            self.future.set_result(True)
+
+
+class LLMScheduler:
+    """按优先级分配 Ollama 并发名额"""
+
+    def __init__(self, max_in_flight: int = None, reserved_interactive: int = None, max_queued: int = None):
+        """
+        参数:
+            max_in_flight: 同时在途的请求数，默认为 Config.LLM_MAX_IN_FLIGHT
+            reserved_interactive: 只留给交互请求的名额，默认为 Config.LLM_RESERVED_INTERACTIVE
+            max_queued: 每个优先级最多排队的请求数，默认为 Config.LLM_MAX_QUEUED
+        """
+        self.max_in_flight = max_in_flight or Config.LLM_MAX_IN_FLIGHT
+        reserved = Config.LLM_RESERVED_INTERACTIVE if reserved_interactive is None else reserved_interactive
+        self.reserved_interactive = min(reserved, self.max_in_flight - 1)
+        self.max_queued = max_queued or Config.LLM_MAX_QUEUED
+        self._heap = []
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self._stats = {
+            name: {"queued": 0, "in_flight": 0, "completed": 0, "rejected": 0, "timeouts": 0, "wait_time": 0.0}
+            for name in PRIORITIES
+        }
+
+    @staticmethod
+    def _check_priority(priority: str):
+        if priority not in PRIORITIES:
+            raise ValueError(f"不支持的请求优先级: {priority}，可选: {', '.join(PRIORITIES)}")
+
+    def _limit(self, priority: str) -> int:
+        """该优先级可占用的名额上限"""
+        if priority == "interactive":
+            return self.max_in_flight
+        return self.max_in_flight - self.reserved_interactive
+
+    def _enqueue(self, waiter: _Waiter):
+        """加入队列并尝试放行（调用方需持有锁）"""
+        stats = self._stats[waiter.priority]
+        if stats["queued"] >= self.max_queued:
+            stats["rejected"] += 1
+            raise LLMBusyError(f"{waiter.priority} 请求排队已满（{self.max_queued}），请稍后重试")
+        stats["queued"] += 1
+        heapq.heappush(self._heap, (PRIORITIES[waiter.priority], next(self._seq), waiter))
+        self._dispatch()
+
+    def _dispatch(self):
+        """按优先级放行排队的请求（调用方需持有锁）"""
+        while self._heap:
+            _, _, waiter = self._heap[0]
+            if waiter.cancelled:
+                heapq.heappop(self._heap)
+                continue
+            # 队首是优先级最高的请求，它拿不到名额时后面的请求也拿不到
+            if self.in_flight >= self._limit(waiter.priority):
+                break
+            heapq.heappop(self._heap)
+            self.in_flight += 1
+            stats = self._stats[waiter.priority]
+            stats["queued"] -= 1
+            stats["in_flight"] += 1
+            stats["wait_time"] += time.perf_counter() - waiter.enqueued_at
+            waiter.grant()
+
+    def _abandon(self, waiter: _Waiter) -> bool:
+        """
+        放弃等待（超时或取消），返回是否已经拿到名额（调用方需持有锁）
+
+        已拿到名额时由调用方释放，否则从统计中移除
+        """
+        if waiter.granted:
+            return True
+        waiter.cancelled = True
+        stats = self._stats[waiter.priority]
+        stats["queued"] -= 1
+        stats["timeouts"] += 1
+        return False
+
+    def acquire(self, priority: str, timeout: float = None) -> _Waiter:
+        """阻塞等待名额，超时抛出 LLMBusyError"""
+        self._check_priority(priority)
+        waiter = _Waiter(priority)
+        with self._lock:
+            self._enqueue(waiter)
+        if waiter.event.wait(timeout):
+            return waiter
+        with self._lock:
+            if self._abandon(waiter):
+                return waiter
+        raise LLMBusyError(f"{priority} 请求排队超过 {timeout} 秒")
+
+    async def acquire_async(self, priority: str, timeout: float = None) -> _Waiter:
+        """acquire 的异步版本"""
+        self._check_priority(priority)
+        waiter = _Waiter(priority, asyncio.get_running_loop())
+        with self._lock:
+            self._enqueue(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), timeout)
+            return waiter
+        except asyncio.TimeoutError:
+            with self._lock:
+                if self._abandon(waiter):
+                    return waiter
+            raise LLMBusyError(f"{priority} 请求排队超过 {timeout} 秒")
+        except asyncio.CancelledError:
+            with self._lock:
+                granted = self._abandon(waiter)
+            if granted:
+                self.release(waiter)
+            raise
+
+    def release(self, waiter: _Waiter):
+        """归还名额并放行下一个请求"""
+        with self._lock:
+            self.in_flight -= 1
+            stats = self._stats[waiter.priority]
+            stats["in_flight"] -= 1
+            stats["completed"] += 1
+            self._dispatch()
+
+    @contextmanager
+    def slot(self, priority: str, timeout: float = None):
+        """占用一个名额执行请求"""
+        waiter = self.acquire(priority, timeout)
+        record_queue_wait(priority, waiter.granted_at - waiter.enqueued_at)
+        try:
+            yield
+        finally:
+            self.release(waiter)
+
+    @asynccontextmanager
+    async def slot_async(self, priority: str, timeout: float = None):
+        """slot 的异步版本"""
+        waiter = await self.acquire_async(priority, timeout)
+        record_queue_wait(priority, waiter.granted_at - waiter.enqueued_at)
+        try:
+            yield
+        finally:
+            self.release(waiter)
+
+    def metrics(self) -> Dict[str, Any]:
+        """各优先级的排队数、在途数、完成数、拒绝与超时次数以及平均排队时间"""
+        with self._lock:
+            queues = {}
+            for name, stats in self._stats.items():
+                granted = stats["in_flight"] + stats["completed"]
+                queues[name] = {
+                    "queued": stats["queued"],
+                    "in_flight": stats["in_flight"],
+                    "completed": stats["completed"],
+                    "rejected": stats["rejected"],
+                    "timeouts": stats["timeouts"],
+                    "avg_wait": round(stats["wait_time"] / granted, 3) if granted else 0.0
+                }
+            return {"max_in_flight": self.max_in_flight, "in_flight": self.in_flight, "queues": queues}
+
+
+_scheduler: Optional[LLMScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> LLMScheduler:
+    """进程内共享的调度器"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = LLMScheduler()
+        return _scheduler
+
+
+class LLMClient:
+    """
+    经过调度器的 Ollama 客户端，同一实例的请求复用 HTTP 连接池
+
+    异步客户端的连接池绑定创建时的事件循环，因此按事件循环分别创建：
+    数据增强、爬虫等脚本多次调用 asyncio.run 时，每个循环使用自己的连接池，循环关闭后随之丢弃
+    """
+
+    def __init__(self, timeout: float = None, scheduler: LLMScheduler = None):
+        """
+        参数:
+            timeout: 单次请求超时（秒），默认为 Config.LLM_REQUEST_TIMEOUT
+            scheduler: 调度器，默认为进程内共享的调度器
+        """
+        self.timeout = timeout or Config.LLM_REQUEST_TIMEOUT
+        self.scheduler = scheduler or get_scheduler()
+        self.client = ollama.Client(host=Config.OLLAMA_HOST, timeout=self.timeout)
+        self._async_clients = {}  # 事件循环 -> AsyncClient
+        self._async_lock = threading.Lock()
+
+    @property
+    def async_client(self) -> ollama.AsyncClient:
+        """当前事件循环的异步客户端（需在协程中访问）"""
+        loop = asyncio.get_running_loop()
+        with self._async_lock:
+            client = self._async_clients.get(loop)
+            if client is None:
+                # 客户端引用着所属的循环，已关闭循环的客户端在这里清理
+                for closed in [other for other in self._async_clients if other.is_closed()]:
+                    del self._async_clients[closed]
+                client = ollama.AsyncClient(host=Config.OLLAMA_HOST, timeout=self.timeout)
+                self._async_clients[loop] = client
+            return client
+
+    @staticmethod
+    def _queue_timeout(priority: str) -> float:
+        return Config.LLM_QUEUE_TIMEOUT.get(priority)
+
+    def chat(self, priority: str = "interactive", **kwargs) -> Dict:
+        """同步 chat 请求"""
+        with self.scheduler.slot(priority, self._queue_timeout(priority)):
+            try:
+                response = self.client.chat(**kwargs)
+            except Exception:
+                record_llm_call("chat", kwargs.get("model"), priority, error=True)
+                raise
+        record_llm_call("chat", kwargs.get("model"), priority, response)
+        return response
+
+    async def chat_async(self, priority: str = "interactive", **kwargs) -> Dict:
+        """异步 chat 请求"""
+        async with self.scheduler.slot_async(priority, self._queue_timeout(priority)):
+            try:
+                response = await self.async_client.chat(**kwargs)
+            except Exception:
+                record_llm_call("chat", kwargs.get("model"), priority, error=True)
+                raise
+        record_llm_call("chat", kwargs.get("model"), priority, response)
+        return response
+
+    async def chat_stream_async(self, priority: str = "interactive", **kwargs) -> AsyncIterator[Dict]:
+        """异步流式 chat 请求，整个流式输出期间占用名额"""
+        async with self.scheduler.slot_async(priority, self._queue_timeout(priority)):
+            try:
+                stream = await self.async_client.chat(stream=True, **kwargs)
+                async for chunk in stream:
+                    if chunk.get("done"):
+                        # token 数与模型耗时只在最后一个片段中返回
+                        record_llm_call("chat", kwargs.get("model"), priority, chunk)
+                    yield chunk
+            except Exception:
+                record_llm_call("chat", kwargs.get("model"), priority, error=True)
+                raise
+
+    def embed(self, priority: str = "embedding", **kwargs) -> Dict:
+        """同步 embed 请求"""
+        with self.scheduler.slot(priority, self._queue_timeout(priority)):
+            try:
+                response = self.client.embed(**kwargs)
+            except Exception:
+                record_llm_call("embed", kwargs.get("model"), priority, error=True)
+                raise
+        record_llm_call("embed", kwargs.get("model"), priority, response)
+        return response
+
+    async def embed_async(self, priority: str = "embedding", **kwargs) -> Dict:
+        """异步 embed 请求"""
+        async with self.scheduler.slot_async(priority, self._queue_timeout(priority)):
+            try:
+                response = await self.async_client.embed(**kwargs)
+            except Exception:
+                record_llm_call("embed", kwargs.get("model"), priority, error=True)
+                raise
+        record_llm_call("embed", kwargs.get("model"), priority, response)
+        return response
+
+
+_default_client: Optional[LLMClient] = None
+_client_lock = threading.Lock()
+
+
+def get_llm_client() -> LLMClient:
+    """进程内共享的客户端（共享连接池）"""
+    global _default_client
+    with _client_lock:
+        if _default_client is None:
+            _default_client = LLMClient()
+        return _default_client
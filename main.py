@@ -3,12 +3,16 @@
 集成知识检索与智能问答功能，支持专业金融分析
 """
 
+import argparse
+import asyncio
 import os
 from agentscope.pipelines import SequentialPipeline
 from agentscope.message import Msg
-from data_loader import DataLoader
+from index_updater import IndexUpdater
+from qa_router import QARouter
 from vector_store import VectorStore
 from agents import RetrievalAgent, GenerationAgent, ConfidenceEvaluator, DialogueManager
+from batch_runner import BatchRunner
 from config import Config
 
 
@@ -41,6 +45,11 @@ class QuantAnalysisSystem:
             qa_crawler = QACrawler()
             qa_crawler.run(max_pages=20)
 
+        # 命令行为单用户单会话
+        self.session_id = "cli"
+        # 问答库路由在知识库加载后创建，索引更新时需要重建
+        self.qa_router = None
+
         # 初始化向量存储
         self.vector_store = VectorStore(embed_model=Config.EMB_MODEL)
 
@@ -51,39 +60,26 @@ class QuantAnalysisSystem:
         self._initialize_agents()
 
     def _setup_vector_store(self):
-        """配置向量存储索引"""
-        if os.path.exists(Config.VECTOR_STORE_PATH):
-            print("加载现有金融知识库...")
-            self.vector_store.load_index(Config.VECTOR_STORE_PATH)
-        else:
-            print("构建金融知识库索引...")
-            self._build_vector_index()
-
-    def _build_vector_index(self):
-        """构建向量索引"""
-        # 创建索引结构
-        self.vector_store.create_index()
-
-        # 加载数据文档
-        loader = DataLoader()
-        documents = loader.load_all_data()
+        """配置向量存储索引：加载现有索引并增量更新，索引不存在时全量构建（多个 worker 同时启动时依次执行）"""
+        self.index_updater = IndexUpdater(self.vector_store, Config.VECTOR_STORE_PATH)
+        stats = self.index_updater.load_or_build()
+        print(f"金融知识库就绪，包含 {stats['total_documents']} 条文档，本次新增 {stats['documents_added']} 条，"
+              f"删除 {stats['documents_removed']} 条，耗时 {stats['time_elapsed']:.1f} 秒")
 
-        # 准备索引内容
-        content_list = []
-        metadata_list = []
-
-        for doc in documents:
-            content_list.append(doc["content"])
-            metadata_list.append({
-                "source": doc["metadata"].get("source", "未标注来源")
-            })
-
-        # 添加文档到索引
-        self.vector_store.add_documents(content_list, metadata_list)
+    def update_index(self) -> dict:
+        """
+        增量更新向量索引：只嵌入新增或变更的文件，删除已移除文件的向量
 
-        # 保存索引
-        self.vector_store.save_index(Config.VECTOR_STORE_PATH)
-        print(f"金融知识库构建完成，包含 {len(content_list)} 条文档")
+        返回:
+            更新统计信息（新增/删除/合并重复/总文档数与耗时）
+        """
+        stats = self.index_updater.update()
+        print(f"金融知识库更新完成，新增 {stats['documents_added']} 条，"
+              f"删除 {stats['documents_removed']} 条，合并近似重复 {stats['duplicates_merged']} 条"
+              f"（去重率 {stats['dedup_ratio']:.1%}），耗时 {stats['time_elapsed']:.1f} 秒")
+        if self.qa_router is not None and (stats["documents_added"] or stats["documents_removed"]):
+            self.qa_router.rebuild()
+        return stats
 
     def _initialize_agents(self):
         """初始化处理代理"""
@@ -96,10 +92,15 @@ class QuantAnalysisSystem:
         # 置信度评估 - 负责答案质量评估
         self.confidence_evaluator = ConfidenceEvaluator()
 
+        # 问答库路由 - 常见问题直接返回官方回答
+        if Config.QA_ROUTER_ENABLED:
+            self.qa_router = QARouter(self.vector_store)
+
         # 对话管理 - 协调处理流程
         self.dialogue_manager = DialogueManager(
             self.retrieval_agent,
-            self.generation_agent
+            self.generation_agent,
+            router=self.qa_router
         )
 
     def analyze_query(self, user_query: str) -> dict:
@@ -114,14 +115,15 @@ class QuantAnalysisSystem:
         """
         # 步骤1: 对话管理处理用户输入
         manager_response = self.dialogue_manager.reply(
-            Msg(role="user", content=user_query,name="quant")
+            Msg(role="user", content=user_query,name="quant"), session_id=self.session_id
         )
 
         # 步骤2: 置信度评估
         eval_msg = {
-            "question": user_query,
+            "query": user_query,
             "content": manager_response["content"],
-            "context": manager_response.get("context", [])
+            "context": manager_response.get("context", []),
+            "route": manager_response.get("route")
         }
         final_response = self.confidence_evaluator.reply(eval_msg)
 
@@ -133,6 +135,23 @@ class QuantAnalysisSystem:
             "evaluation": final_response.get("confidence_evaluation", "")
         }
 
+    def run_batch(self, input_path: str, output_path: str = None, concurrency: int = None) -> dict:
+        """
+        批量分析 JSONL 问题文件，结果逐条追加写入 output_path，中断后重新运行会跳过已完成的问题
+
+        参数:
+            input_path: 问题文件，每行为 {"id": 可选, "query": 问题, "filters": 可选}
+            output_path: 结果文件，默认为 <问题文件名>.results.jsonl
+            concurrency: 同时进行生成与评估的问题数，默认为 Config.BATCH_CONCURRENCY
+        """
+        output_path = output_path or f"{os.path.splitext(input_path)[0]}.results.jsonl"
+        runner = BatchRunner(self.retrieval_agent, self.generation_agent, self.confidence_evaluator,
+                             concurrency=concurrency)
+        stats = asyncio.run(runner.run_file(input_path, output_path))
+        print(f"批量分析完成: 共 {stats['total']} 个问题，跳过 {stats['skipped']} 个，"
+              f"成功 {stats['succeeded']} 个，失败 {stats['failed']} 个，结果已写入 {output_path}")
+        return stats
+
     def run(self):
         """启动系统交互界面"""
         print("金融量化分析系统已启动")
@@ -199,5 +218,14 @@ class QuantAnalysisSystem:
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="金融量化分析系统")
+    parser.add_argument("--batch", help="批量分析的问题文件（JSONL）")
+    parser.add_argument("--output", help="批量分析结果文件，默认为 <问题文件名>.results.jsonl")
+    parser.add_argument("--concurrency", type=int, help="批量分析时同时生成与评估的问题数")
+    args = parser.parse_args()
+
     analysis_system = QuantAnalysisSystem()
-    analysis_system.run()
\ No newline at end of file
+    if args.batch:
+        analysis_system.run_batch(args.batch, args.output, args.concurrency)
+    else:
+        analysis_system.run()
\ No newline at end of file
@@ -0,0 +1,148 @@
+"""
+元数据过滤索引
+为可过滤字段（公司、股票代码、报告年份、报告类型、文档类型）的每个取值
+预先维护有序的文档 id 数组，检索时直接构造 FAISS IDSelector，
+不需要多取候选再在 Python 中逐条过滤
+"""
+
+import os
+import re
+import unicodedata
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+FILTER_FIELDS = ("company_name", "stock_code", "report_year", "report_type", "type")
+# 标识问题主体的字段，两个问题提到的取值不同即视为针对不同公司
+ENTITY_FIELDS = ("company_name", "stock_code")
+KEY_SEPARATOR = "\x1f"
+
+
+def normalize_value(value: Any) -> str:
+    """统一过滤取值：全角转半角、去空白，年份等数字统一为字符串"""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return re.sub(r"\s+", "", unicodedata.normalize("NFKC", str(value)))
+
+
+class MetadataIndex:
+    """字段取值 -> 有序文档 id 数组"""
+
+    def __init__(self):
+        self._ids = {field: {} for field in FILTER_FIELDS}
+
+    @staticmethod
+    def _keys(metadata: Dict) -> Iterable[Tuple[str, str]]:
+        # 合并了近似重复分块的文档按任一来源的取值都能过滤到
+        keys = set()
+        for source in [metadata, *metadata.get("duplicate_sources", ())]:
+            for field in FILTER_FIELDS:
+                value = source.get(field)
+                if value not in (None, ""):
+                    keys.add((field, normalize_value(value)))
+        return keys
+
+    @staticmethod
+    def _group(items: Iterable[Tuple[int, Dict]]) -> Dict[Tuple[str, str], List[int]]:
+        groups = {}
+        for doc_id, metadata in items:
+            for key in MetadataIndex._keys(metadata):
+                groups.setdefault(key, []).append(doc_id)
+        return groups
+
+    def add_many(self, items: Iterable[Tuple[int, Dict]]):
+        """批量登记 (doc_id, 元数据)，每个取值只合并一次"""
+        for (field, value), ids in self._group(items).items():
+            current = self._ids[field].get(value)
+            ids = np.asarray(ids, dtype='int64')
+            self._ids[field][value] = np.union1d(current, ids) if current is not None else np.unique(ids)
+
+    def remove_many(self, items: Iterable[Tuple[int, Dict]]):
+        """批量注销 (doc_id, 删除前的元数据)"""
+        for (field, value), ids in self._group(items).items():
+            current = self._ids[field].get(value)
+            if current is None:
+                continue
+            remaining = np.setdiff1d(current, np.asarray(ids, dtype='int64'), assume_unique=True)
+            if len(remaining):
+                self._ids[field][value] = remaining
+            else:
+                del self._ids[field][value]
+
+    def select(self, filters: Dict[str, Any]) -> Optional[np.ndarray]:
+        """
+        计算满足过滤条件的文档 id
+
+        参数:
+            filters: {字段: 取值或取值列表}，字段之间为且，同一字段的多个取值为或
+
+        返回:
+            有序 id 数组；filters 为空时返回 None（不过滤）
+        """
+        if not filters:
+            return None
+        selected = None
+        for field, values in filters.items():
+            if field not in FILTER_FIELDS:
+                raise ValueError(f"不支持的过滤字段: {field}，可选: {', '.join(FILTER_FIELDS)}")
+            if not isinstance(values, (list, tuple, set)):
+                values = [values]
+            arrays = [self._ids[field].get(normalize_value(value)) for value in values]
+            arrays = [ids for ids in arrays if ids is not None]
+            ids = np.unique(np.concatenate(arrays)) if arrays else np.empty(0, dtype='int64')
+            selected = ids if selected is None else np.intersect1d(selected, ids, assume_unique=True)
+            if not len(selected):
+                break
+        return selected
+
+    def mentions(self, text: str, fields: Tuple[str, ...] = ENTITY_FIELDS) -> FrozenSet[Tuple[str, str]]:
+        """
+        文本中出现的已登记取值
+
+        返回:
+            {(字段, 取值)}，如问题中提到的公司名称与股票代码
+        """
+        text = normalize_value(text)
+        return frozenset((field, value) for field in fields for value in self._ids[field] if value and value in text)
+
+    def values(self, field: str) -> Dict[str, int]:
+        """字段各取值的文档数"""
+        return {value: len(ids) for value, ids in self._ids[field].items()}
+
+    def save(self, path: str):
+        """以 npz 格式原子写入"""
+        keys, arrays = [], []
+        for field, by_value in self._ids.items():
+            for value, ids in by_value.items():
+                keys.append(f"{field}{KEY_SEPARATOR}{value}")
+                arrays.append(ids)
+        offsets = np.zeros(len(arrays) + 1, dtype='int64')
+        np.cumsum([len(ids) for ids in arrays], out=offsets[1:])
+
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(
+            tmp_path,
+            keys=np.array(keys, dtype=str),
+            offsets=offsets,
+            ids=np.concatenate(arrays) if arrays else np.empty(0, dtype='int64')
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "MetadataIndex":
+        """从 npz 文件加载"""
+        index = cls()
+        with np.load(path) as data:
+            offsets, ids = data["offsets"], data["ids"]
+            for i, key in enumerate(data["keys"]):
+                field, value = str(key).split(KEY_SEPARATOR, 1)
+                if field in index._ids:
+                    index._ids[field][value] = ids[offsets[i]:offsets[i + 1]]
+        return index
+
+    @classmethod
+    def build(cls, items: Iterable[Tuple[int, Dict]]) -> "MetadataIndex":
+        """由 (doc_id, 元数据) 构造（用于为没有过滤索引的旧版向量库补建）"""
+        index = cls()
+        index.add_many(items)
+        return index
@@ -0,0 +1,219 @@
+"""
+流水线观测
+1. 各阶段（嵌入、向量检索、生成、评估等）耗时记录到 Prometheus 直方图，同时按请求累计到 contextvars 中，
+   可作为单次请求的耗时明细返回
+2. Ollama 请求的 prompt_eval_count / eval_count / prompt_eval_duration / eval_duration 与调度器排队时间，
+   按所在阶段归入请求明细
+3. 嵌入缓存、答案缓存、问答库路由的命中计数
+4. 开启 TRACING_ENABLED 时每个阶段同时是一个 OpenTelemetry span（导出由全局 TracerProvider 决定）
+
+prometheus_client 与 opentelemetry 为可选依赖，未安装时对应功能关闭，请求耗时明细不受影响
+"""
+
+import functools
+import inspect
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+from config import Config
+
+try:
+    import prometheus_client
+except ImportError:
+    prometheus_client = None
+
+try:
+    from opentelemetry import trace
+except ImportError:
+    trace = None
+
+NANOSECONDS = 1e9
+# 各阶段耗时分布，覆盖从毫秒级的缓存命中到分钟级的长文本生成
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+if prometheus_client is not None:
+    STAGE_SECONDS = prometheus_client.Histogram(
+        "rag_stage_seconds", "流水线各阶段耗时（秒）", ["stage"], buckets=STAGE_BUCKETS)
+    REQUEST_SECONDS = prometheus_client.Histogram(
+        "rag_request_seconds", "分析请求总耗时（秒）", ["outcome"], buckets=STAGE_BUCKETS)
+    LLM_REQUESTS = prometheus_client.Counter(
+        "ollama_requests_total", "Ollama 请求数", ["operation", "model", "priority", "status"])
+    LLM_TOKENS = prometheus_client.Counter(
+        "ollama_tokens_total", "Ollama 处理的 token 数（prompt 为提示词，completion 为生成）", ["model", "kind"])
+    LLM_SECONDS = prometheus_client.Counter(
+        "ollama_model_seconds_total", "Ollama 报告的模型耗时（prompt_eval 为提示词处理，decode 为逐 token 生成）",
+        ["model", "phase"])
+    QUEUE_WAIT_SECONDS = prometheus_client.Histogram(
+        "llm_queue_wait_seconds", "模型请求在调度器中的排队时间（秒）", ["priority"], buckets=STAGE_BUCKETS)
+    CACHE_EVENTS = prometheus_client.Counter(
+        "rag_cache_events_total", "缓存与路由的命中情况", ["cache", "result"])
+
+# 当前请求的耗时明细与所在阶段，由 begin_request 为每个请求创建
+_request_stats: ContextVar[Optional[Dict[str, Any]]] = ContextVar("request_stats", default=None)
+_current_stage: ContextVar[Optional[str]] = ContextVar("current_stage", default=None)
+
+
+def begin_request() -> Dict[str, Any]:
+    """
+    为当前请求（当前协程或线程的上下文）创建耗时明细
+
+    返回:
+        {"stages": {阶段: 秒}, "llm": {阶段: {token 数与模型耗时}}}，由 request_timings 读取
+    """
+    stats = {"started": time.perf_counter(), "stages": {}, "llm": {}}
+    _request_stats.set(stats)
+    return stats
+
+
+def request_timings(stats: Dict[str, Any] = None) -> Optional[Dict[str, Any]]:
+    """当前请求的耗时明细快照（秒，保留 4 位小数），未调用 begin_request 时返回 None"""
+    stats = stats or _request_stats.get()
+    if stats is None:
+        return None
+    return {
+        "total": round(time.perf_counter() - stats["started"], 4),
+        "stages": {name: round(seconds, 4) for name, seconds in stats["stages"].items()},
+        "llm": {name: {key: round(value, 4) if isinstance(value, float) else value for key, value in usage.items()}
+                for name, usage in stats["llm"].items()}
+    }
+
+
+def finish_request(outcome: str, stats: Dict[str, Any] = None):
+    """记录请求总耗时，outcome 为 cached / routed / generated"""
+    stats = stats or _request_stats.get()
+    if stats is not None and prometheus_client is not None:
+        REQUEST_SECONDS.labels(outcome).observe(time.perf_counter() - stats["started"])
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """
+    统计一个阶段的耗时
+
+    同一请求中重复进入的阶段耗时累加；阶段可以嵌套（如 retrieval 包含 embedding 与 faiss），
+    嵌套阶段的耗时同时计入外层阶段
+    """
+    span = None
+    if Config.TRACING_ENABLED and trace is not None:
+        span = trace.get_tracer(__name__).start_as_current_span(f"rag.{name}")
+        span.__enter__()
+    token = _current_stage.set(name)
+    start = time.perf_counter()
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        # 流式输出被提前关闭（GeneratorExit）不算阶段失败
+        if not isinstance(e, GeneratorExit):
+            error = e
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        try:
+            _current_stage.reset(token)
+        except ValueError:
+            # 流式生成器可能在其他上下文中被关闭，此时无需还原
+            pass
+        if prometheus_client is not None:
+            STAGE_SECONDS.labels(name).observe(elapsed)
+        stats = _request_stats.get()
+        if stats is not None:
+            stats["stages"][name] = stats["stages"].get(name, 0.0) + elapsed
+        if span is not None:
+            # 把异常交给 span，由其记录异常并把状态设为 ERROR
+            if error is not None:
+                span.__exit__(type(error), error, error.__traceback__)
+            else:
+                span.__exit__(None, None, None)
+
+
+def timed(name: str) -> Callable:
+    """把整个函数（同步函数、协程或异步生成器）作为一个阶段统计耗时的装饰器"""
+    def decorator(func: Callable) -> Callable:
+        if inspect.isasyncgenfunction(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                with stage(name):
+                    async for item in func(*args, **kwargs):
+                        yield item
+        elif inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                with stage(name):
+                    return await func(*args, **kwargs)
+        else:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with stage(name):
+                    return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _field(response: Any, name: str):
+    """读取 Ollama 响应字段（dict 或 ollama 的响应对象），缺失时返回 None"""
+    try:
+        return response[name]
+    except (KeyError, TypeError, AttributeError):
+        return None
+
+
+def record_llm_call(operation: str, model: str, priority: str, response: Any = None, error: bool = False):
+    """
+    记录一次 Ollama 请求
+
+    参数:
+        operation: chat / embed
+        model: 模型名称
+        priority: 调度优先级
+        response: Ollama 的完整响应（流式请求为最后一个 done 片段），用于读取 token 数与模型耗时
+        error: 请求是否失败
+    """
+    model = model or "unknown"
+    if prometheus_client is not None:
+        LLM_REQUESTS.labels(operation, model, priority, "error" if error else "ok").inc()
+    if response is None:
+        return
+
+    usage = {
+        "prompt_tokens": _field(response, "prompt_eval_count") or 0,
+        "completion_tokens": _field(response, "eval_count") or 0,
+        "prompt_eval_seconds": (_field(response, "prompt_eval_duration") or 0) / NANOSECONDS,
+        "decode_seconds": (_field(response, "eval_duration") or 0) / NANOSECONDS,
+    }
+    if prometheus_client is not None:
+        LLM_TOKENS.labels(model, "prompt").inc(usage["prompt_tokens"])
+        LLM_TOKENS.labels(model, "completion").inc(usage["completion_tokens"])
+        LLM_SECONDS.labels(model, "prompt_eval").inc(usage["prompt_eval_seconds"])
+        LLM_SECONDS.labels(model, "decode").inc(usage["decode_seconds"])
+
+    stats = _request_stats.get()
+    if stats is not None:
+        totals = stats["llm"].setdefault(_current_stage.get() or operation, {"calls": 0})
+        totals["calls"] += 1
+        for key, value in usage.items():
+            totals[key] = totals.get(key, 0) + value
+
+
+def record_queue_wait(priority: str, seconds: float):
+    """记录调度器排队时间，同时计入当前请求的 queue_wait"""
+    if prometheus_client is not None:
+        QUEUE_WAIT_SECONDS.labels(priority).observe(seconds)
+    stats = _request_stats.get()
+    if stats is not None:
+        stats["stages"]["queue_wait"] = stats["stages"].get("queue_wait", 0.0) + seconds
+
+
+def record_cache(cache: str, hit: bool, count: int = 1):
+    """记录缓存或路由的命中 / 未命中次数"""
+    if prometheus_client is not None and count:
+        CACHE_EVENTS.labels(cache, "hit" if hit else "miss").inc(count)
+
+
+def render() -> Optional[Tuple[bytes, str]]:
+    """Prometheus 文本格式的指标，未安装 prometheus_client 时返回 None"""
+    if prometheus_client is None:
+        return None
+    return prometheus_client.generate_latest(), prometheus_client.CONTENT_TYPE_LATEST
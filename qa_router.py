@@ -0,0 +1,210 @@
+"""
+问答库路由
+问答语料（DataLoader 由问答 JSON 生成、type 为 json 的文档）中的问题单独建一个小索引：
+问题嵌入按行归一化存放在矩阵中，用户问题与某条问答的问题完全一致，或嵌入相似度达到阈值且问题中的数字一致时，
+直接返回该条官方回答及来源，不再经过检索、生成与评估；其余问题仍走完整流程
+
+问答语料没有公司字段，不同公司的投资者常问相同的问题（如“请问公司分红计划？”），各自的回答不同。
+因此先取出全部匹配的问答，只保留与用户问题提到的公司名称 / 股票代码一致的条目，
+剩余条目的回答（规范化后）全部相同才直接返回，有歧义时交给检索与生成
+"""
+
+import re
+import threading
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+
+import numpy as np
+
+from config import Config
+from dedup import NUMBER_PATTERN
+from embedding_cache import EmbeddingCache
+from metrics import record_cache, timed
+
+QA_PATTERN = re.compile(r"^Q: (.*?)\nA: (.*)$", re.S)
+TRAILING_PUNCTUATION = "?？。.!！ "
+
+
+class QARouter:
+    """问答库直达路由"""
+
+    def __init__(self, vector_store: Any, threshold: float = None):
+        """
+        参数:
+            vector_store: 向量存储，问答文档与嵌入生成器都取自该实例
+            threshold: 判定为命中的 cosine 相似度，默认为 Config.QA_ROUTER_SIMILARITY
+        """
+        self.vector_store = vector_store
+        self.embedder = vector_store.embedder
+        self.threshold = threshold or Config.QA_ROUTER_SIMILARITY
+        self._entries = []  # [{"id", "content", "metadata", "question", "answer", "answer_key", "numbers"}]
+        self._ids = np.empty(0, dtype='int64')
+        self._matrix = None
+        self._exact = {}  # 规范化问题 -> 条目位置列表
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.ambiguous = 0
+        self.misses = 0
+        self.rebuild()
+
+    @staticmethod
+    def normalize_question(question: str) -> str:
+        """规范化问题文本，作为精确匹配的键"""
+        return EmbeddingCache.normalize_text(question).lower().rstrip(TRAILING_PUNCTUATION)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def rebuild(self):
+        """从向量库中的问答文档重建索引（启动及知识库更新后调用；问题嵌入优先取自嵌入缓存）"""
+        entries = []
+        for doc in self.vector_store.documents({"type": "json"}):
+            match = QA_PATTERN.match(doc["content"])
+            if not match or not match.group(1).strip() or not match.group(2).strip():
+                continue
+            question, answer = match.group(1).strip(), match.group(2).strip()
+            entries.append(dict(doc, question=question, answer=answer, answer_key=self.normalize_question(answer),
+                                numbers=NUMBER_PATTERN.findall(question)))
+
+        matrix = None
+        if entries:
+            vectors = self.embedder.get_embeddings_batch([entry["question"] for entry in entries])
+            matrix = np.asarray(vectors, dtype='float32')
+            matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+        exact = {}
+        for i, entry in enumerate(entries):
+            exact.setdefault(self.normalize_question(entry["question"]), []).append(i)
+
+        with self._lock:
+            self._entries = entries
+            self._ids = np.fromiter((entry["id"] for entry in entries), dtype='int64', count=len(entries))
+            self._matrix = matrix
+            self._exact = exact
+        print(f"问答库路由索引包含 {len(entries)} 条问答")
+
+    def _allowed(self, filters: Dict[str, Any] = None) -> Optional[np.ndarray]:
+        """满足过滤条件的条目掩码，无过滤条件时返回 None"""
+        if not filters:
+            return None
+        return np.isin(self._ids, self.vector_store.metadata_index.select(filters))
+
+    def _entities(self, position: int) -> FrozenSet:
+        """条目问题中提到的公司名称与股票代码（首次用到时计算，调用方需持有锁）"""
+        entry = self._entries[position]
+        if "entities" not in entry:
+            entry["entities"] = self.vector_store.mentioned_entities(entry["question"])
+        return entry["entities"]
+
+    def _resolve(self, positions: List[int], entities: FrozenSet) -> Tuple[Optional[int], bool]:
+        """
+        从按得分排序的匹配条目中选出可直接返回的条目（调用方需持有锁）
+
+        只保留提到的公司名称 / 股票代码与用户问题一致的条目，剩余条目的回答不一致时视为有歧义
+
+        返回:
+            (得分最高的条目位置，没有匹配或有歧义时为 None, 是否有歧义)
+        """
+        positions = [i for i in positions if self._entities(i) == entities]
+        if not positions:
+            return None, False
+        if len({self._entries[i]["answer_key"] for i in positions}) > 1:
+            self.ambiguous += 1
+            self.misses += 1
+            record_cache("qa_router", False)
+            return None, True
+        return positions[0], False
+
+    def _lookup_exact(self, query: str, filters: Dict[str, Any] = None) -> Tuple[Optional[Dict], bool]:
+        """精确匹配，返回 (命中, 是否有歧义)"""
+        entities = self.vector_store.mentioned_entities(query)
+        with self._lock:
+            positions = self._exact.get(self.normalize_question(query))
+            if not positions:
+                return None, False
+            allowed = self._allowed(filters)
+            best, ambiguous = self._resolve([i for i in positions if allowed is None or allowed[i]], entities)
+            if best is None:
+                return None, ambiguous
+            self.exact_hits += 1
+            record_cache("qa_router", True)
+            return self._hit(best, 1.0), False
+
+    def match_exact(self, query: str, filters: Dict[str, Any] = None) -> Optional[Dict]:
+        """按规范化问题精确匹配，不需要嵌入；多条问答的问题相同而回答不同时不命中"""
+        return self._lookup_exact(query, filters)[0]
+
+    def match_embedding(self, query: str, embedding, filters: Dict[str, Any] = None) -> Optional[Dict]:
+        """按问题嵌入匹配：相似度达到阈值且数字一致的问答中，回答唯一时命中"""
+        vector = np.asarray(embedding, dtype='float32')
+        norm = np.linalg.norm(vector)
+        entities = self.vector_store.mentioned_entities(query)
+        numbers = NUMBER_PATTERN.findall(query)
+        with self._lock:
+            if self._matrix is None or norm == 0:
+                self.misses += 1
+                record_cache("qa_router", False)
+                return None
+            scores = self._matrix @ (vector / norm)
+            allowed = self._allowed(filters)
+            if allowed is not None:
+                scores = np.where(allowed, scores, -np.inf)
+            candidates = np.flatnonzero(scores >= self.threshold)
+            candidates = candidates[np.argsort(-scores[candidates])]
+            best, ambiguous = self._resolve(
+                [int(i) for i in candidates if self._entries[i]["numbers"] == numbers], entities)
+            if best is not None:
+                self.semantic_hits += 1
+                record_cache("qa_router", True)
+                return self._hit(best, float(scores[best]))
+            if not ambiguous:
+                self.misses += 1
+                record_cache("qa_router", False)
+        return None
+
+    @timed("routing")
+    def match(self, query: str, filters: Dict[str, Any] = None) -> Optional[Dict]:
+        """
+        查找可直接回答的问答
+
+        返回:
+            {"id", "content", "metadata", "question", "answer", "score"}，未命中时返回 None
+        """
+        if not self._entries:
+            return None
+        hit, ambiguous = self._lookup_exact(query, filters)
+        if hit is not None or ambiguous:
+            # 相同问题的回答不一致时，嵌入匹配只会找到更多候选，不必再计算
+            return hit
+        # 查询嵌入写入嵌入缓存，未命中时检索阶段直接复用
+        return self.match_embedding(query, self.embedder.get_embedding(query), filters)
+
+    @timed("routing")
+    async def match_async(self, query: str, filters: Dict[str, Any] = None) -> Optional[Dict]:
+        """match 的异步版本"""
+        if not self._entries:
+            return None
+        hit, ambiguous = self._lookup_exact(query, filters)
+        if hit is not None or ambiguous:
+            return hit
+        return self.match_embedding(query, await self.embedder.get_embedding_async(query), filters)
+
+    def _hit(self, position: int, score: float) -> Dict:
+        entry = self._entries[position]
+        return {
+            "id": entry["id"],
+            "content": entry["content"],
+            "metadata": entry["metadata"],
+            "question": entry["question"],
+            "answer": entry["answer"],
+            "score": score
+        }
+
+    def stats(self) -> Dict[str, int]:
+        """路由统计"""
+        return {
+            "entries": len(self._entries),
+            "exact_hits": self.exact_hits,
+            "semantic_hits": self.semantic_hits,
+            "ambiguous": self.ambiguous,
+            "misses": self.misses
+        }
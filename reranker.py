@@ -0,0 +1,223 @@
+"""
+检索结果重排序
+向量检索多取候选（如前 50 条），再用本地交叉编码器或批量调用 Ollama 打分，只保留最相关的前 N 条。
+重排序有时间预算，超时或出错时退回向量检索的原始顺序
+"""
+
+import asyncio
+import json
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Dict, List, Optional
+
+from config import Config
+from llm_client import LLMClient
+
+
+class BaseReranker:
+    """重排序器基类：子类实现 score / score_async，基类负责时间预算与回退"""
+
+    name = "base"
+
+    def __init__(self, time_budget: float = None, max_chars: int = None):
+        """
+        参数:
+            time_budget: 单次重排序的时间预算（秒），默认为 Config.RERANK_TIME_BUDGET
+            max_chars: 每个候选参与打分的最大字符数，默认为 Config.RERANK_MAX_CHARS
+        """
+        self.time_budget = time_budget or Config.RERANK_TIME_BUDGET
+        self.max_chars = max_chars or Config.RERANK_MAX_CHARS
+        # 超时后打分任务仍会在后台跑完，这里只负责不让调用方继续等待
+        self._executor = ThreadPoolExecutor(max_workers=Config.RERANK_MAX_WORKERS, thread_name_prefix="rerank")
+
+    def score(self, query: str, passages: List[str], priority: str = "interactive") -> List[float]:
+        raise NotImplementedError
+
+    async def score_async(self, query: str, passages: List[str], priority: str = "interactive") -> List[float]:
+        return await asyncio.to_thread(self.score, query, passages, priority)
+
+    def _passages(self, results: List[Dict]) -> List[str]:
+        return [res["content"][:self.max_chars] for res in results]
+
+    def rerank(self, query: str, results: List[Dict], top_n: int = None, priority: str = "interactive") -> Dict:
+        """
+        对检索结果重排序
+
+        参数:
+            query: 查询文本
+            results: 向量检索结果（按向量相似度排序）
+            top_n: 保留的结果数，默认为 Config.RERANK_TOP_N
+            priority: 打分请求的调度优先级，批量分析传入 Config.BATCH_PRIORITY，不占用交互请求的名额
+
+        返回:
+            {"results": 重排序后的前 top_n 条, "stats": 耗时、是否回退等信息}
+        """
+        top_n = top_n or Config.RERANK_TOP_N
+        start = time.perf_counter()
+        if len(results) <= 1:
+            return self._finish(results, None, top_n, start)
+        future = self._executor.submit(self.score, query, self._passages(results), priority)
+        try:
+            scores = future.result(timeout=self.time_budget)
+        except FutureTimeoutError:
+            print(f"重排序超过时间预算 {self.time_budget}s，使用向量检索顺序")
+            scores = None
+        except Exception as e:
+            print(f"重排序失败，使用向量检索顺序: {str(e)}")
+            scores = None
+        return self._finish(results, scores, top_n, start)
+
+    async def rerank_async(self, query: str, results: List[Dict], top_n: int = None,
+                           priority: str = "interactive") -> Dict:
+        """rerank 的异步版本"""
+        top_n = top_n or Config.RERANK_TOP_N
+        start = time.perf_counter()
+        if len(results) <= 1:
+            return self._finish(results, None, top_n, start)
+        try:
+            scores = await asyncio.wait_for(self.score_async(query, self._passages(results), priority),
+                                            self.time_budget)
+        except asyncio.TimeoutError:
+            print(f"重排序超过时间预算 {self.time_budget}s，使用向量检索顺序")
+            scores = None
+        except Exception as e:
+            print(f"重排序失败，使用向量检索顺序: {str(e)}")
+            scores = None
+        return self._finish(results, scores, top_n, start)
+
+    def _finish(self, results: List[Dict], scores: Optional[List[float]], top_n: int, start: float) -> Dict:
+        """按分数排序并截断；scores 为 None 时保持原顺序"""
+        fallback = scores is None or len(scores) != len(results)
+        if not fallback:
+            for res, score in zip(results, scores):
+                res["rerank_score"] = score
+            # 稳定排序，同分时保留向量检索的先后
+            results = sorted(results, key=lambda res: res["rerank_score"], reverse=True)
+        return {
+            "results": results[:top_n],
+            "stats": {
+                "backend": self.name,
+                "candidates": len(results),
+                "kept": min(top_n, len(results)),
+                "elapsed": round(time.perf_counter() - start, 3),
+                "fallback": fallback
+            }
+        }
+
+
+class CrossEncoderReranker(BaseReranker):
+    """本地交叉编码器（sentence-transformers）"""
+
+    name = "cross_encoder"
+
+    def __init__(self, model_name: str = None, **kwargs):
+        super().__init__(**kwargs)
+        try:
+            from sentence_transformers import CrossEncoder
+        except ImportError as e:
+            raise ImportError("交叉编码器重排序需要安装 sentence-transformers") from e
+        self.model_name = model_name or Config.RERANK_CROSS_ENCODER
+        self.model = CrossEncoder(self.model_name)
+
+    def score(self, query: str, passages: List[str], priority: str = "interactive") -> List[float]:
+        return [float(s) for s in self.model.predict([(query, passage) for passage in passages])]
+
+
+class OllamaReranker(BaseReranker):
+    """批量调用 Ollama 为候选打分：每次请求对一批候选给出 0-10 的相关度"""
+
+    name = "ollama"
+
+    SCHEMA = {
+        "type": "object",
+        "properties": {"scores": {"type": "array", "items": {"type": "number"}}},
+        "required": ["scores"]
+    }
+
+    def __init__(self, model_name: str = None, batch_size: int = None, **kwargs):
+        super().__init__(**kwargs)
+        self.model_name = model_name or Config.RERANK_MODEL
+        self.batch_size = batch_size or Config.RERANK_BATCH_SIZE
+        # 单独的连接池以使用时间预算作为请求超时，并发名额仍由共享调度器分配
+        self.llm = LLMClient(timeout=self.time_budget)
+
+    def format_prompt(self, query: str, passages: List[str]) -> str:
+        """构建批量打分提示"""
+        numbered = "\n\n".join(f"[{i + 1}] {passage}" for i, passage in enumerate(passages))
+        return f"""你是金融检索系统的相关度评估器。请判断每个候选片段对回答问题的帮助程度，
+按 0-10 打分（10 表示直接包含答案，0 表示无关）。
+
+问题: {query}
+
+候选片段:
+{numbered}
+
+只输出 JSON: {{"scores": [第1个片段的分数, 第2个片段的分数, ...]}}，共 {len(passages)} 个分数。"""
+
+    def _chat_kwargs(self, query: str, passages: List[str]) -> Dict:
+        return {
+            "model": self.model_name,
+            "messages": [{"role": "user", "content": self.format_prompt(query, passages)}],
+            "format": self.SCHEMA,
+            "think": False,
+            "options": {"temperature": 0, "num_predict": 16 * len(passages) + 32}
+        }
+
+    @staticmethod
+    def parse_scores(text: str, expected: int) -> List[float]:
+        """解析模型输出的分数列表，数量不符时报错"""
+        text = re.sub(r"<think>.*?</think>", "", text, flags=re.S)
+        try:
+            scores = json.loads(text[text.find("{"):text.rfind("}") + 1])["scores"]
+        except (ValueError, KeyError, TypeError):
+            scores = re.findall(r"-?\d+(?:\.\d+)?", text)
+        scores = [float(s) for s in scores]
+        if len(scores) != expected:
+            raise ValueError(f"打分数量 {len(scores)} 与候选数 {expected} 不一致")
+        return scores
+
+    def _batches(self, passages: List[str]) -> List[List[str]]:
+        return [passages[i:i + self.batch_size] for i in range(0, len(passages), self.batch_size)]
+
+    def _score_batch(self, query: str, passages: List[str], priority: str = "interactive") -> List[float]:
+        response = self.llm.chat(priority, **self._chat_kwargs(query, passages))
+        return self.parse_scores(response["message"]["content"], len(passages))
+
+    async def _score_batch_async(self, query: str, passages: List[str], priority: str = "interactive") -> List[float]:
+        response = await self.llm.chat_async(priority, **self._chat_kwargs(query, passages))
+        return self.parse_scores(response["message"]["content"], len(passages))
+
+    def score(self, query: str, passages: List[str], priority: str = "interactive") -> List[float]:
+        batches = self._batches(passages)
+        if len(batches) == 1:
+            return self._score_batch(query, batches[0], priority)
+        # 各批次并行请求，整体耗时约等于单批次耗时
+        with ThreadPoolExecutor(max_workers=len(batches)) as executor:
+            return [s for scores in executor.map(lambda batch: self._score_batch(query, batch, priority), batches)
+                    for s in scores]
+
+    async def score_async(self, query: str, passages: List[str], priority: str = "interactive") -> List[float]:
+        results = await asyncio.gather(*(self._score_batch_async(query, batch, priority)
+                                         for batch in self._batches(passages)))
+        return [s for scores in results for s in scores]
+
+
+RERANKERS = {
+    "ollama": OllamaReranker,
+    "cross_encoder": CrossEncoderReranker,
+}
+
+
+def create_reranker() -> Optional[BaseReranker]:
+    """按 Config.RERANK_BACKEND 创建重排序器，未开启重排序或依赖缺失时返回 None"""
+    if not Config.RERANK_ENABLED:
+        return None
+    backend = RERANKERS.get(Config.RERANK_BACKEND)
+    if backend is None:
+        raise ValueError(f"不支持的重排序后端: {Config.RERANK_BACKEND}，可选: {', '.join(RERANKERS)}")
+    try:
+        return backend()
+    except ImportError as e:
+        print(f"重排序器初始化失败，关闭重排序: {str(e)}")
+        return None
@@ -0,0 +1,161 @@
+"""
+会话存储
+按 session_id 保存对话历史，每个会话只保留最近的消息窗口，
+过期（TTL）或超出会话数上限（LRU）的会话会被淘汰。
+后端可选内存或 SQLite
+"""
+
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from config import Config
+
+
+class InMemorySessionBackend:
+    """进程内会话后端，按最近访问顺序维护"""
+
+    def __init__(self):
+        self._sessions = OrderedDict()
+
+    def get(self, session_id: str) -> Optional[Dict]:
+        return self._sessions.get(session_id)
+
+    def put(self, session_id: str, messages: List[Dict], last_access: float):
+        self._sessions[session_id] = {"messages": messages, "last_access": last_access}
+        self._sessions.move_to_end(session_id)
+
+    def delete(self, session_id: str):
+        self._sessions.pop(session_id, None)
+
+    def evict(self, expire_before: float, max_sessions: int) -> int:
+        evicted = 0
+        # 最久未访问的会话在前
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if session["last_access"] >= expire_before and len(self._sessions) <= max_sessions:
+                break
+            self._sessions.popitem(last=False)
+            evicted += 1
+        return evicted
+
+    def count(self) -> int:
+        return len(self._sessions)
+
+
+class SQLiteSessionBackend:
+    """SQLite 会话后端，多进程部署时可共享同一个数据库文件"""
+
+    def __init__(self, db_path: str = None):
+        self._conn = sqlite3.connect(db_path or Config.SESSION_DB_PATH, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS sessions (
+                session_id TEXT PRIMARY KEY,
+                messages TEXT NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_access ON sessions(last_access)")
+        self._conn.commit()
+
+    def get(self, session_id: str) -> Optional[Dict]:
+        row = self._conn.execute(
+            "SELECT messages, last_access FROM sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {"messages": json.loads(row[0]), "last_access": row[1]}
+
+    def put(self, session_id: str, messages: List[Dict], last_access: float):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO sessions (session_id, messages, last_access) VALUES (?, ?, ?)",
+            (session_id, json.dumps(messages, ensure_ascii=False), last_access)
+        )
+        self._conn.commit()
+
+    def delete(self, session_id: str):
+        self._conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+        self._conn.commit()
+
+    def evict(self, expire_before: float, max_sessions: int) -> int:
+        evicted = self._conn.execute("DELETE FROM sessions WHERE last_access < ?", (expire_before,)).rowcount
+        overflow = self.count() - max_sessions
+        if overflow > 0:
+            evicted += self._conn.execute(
+                "DELETE FROM sessions WHERE session_id IN "
+                "(SELECT session_id FROM sessions ORDER BY last_access LIMIT ?)",
+                (overflow,)
+            ).rowcount
+        self._conn.commit()
+        return evicted
+
+    def count(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+
+class SessionStore:
+    """有界的多会话对话历史存储"""
+
+    def __init__(self, backend=None, window: int = None, ttl: float = None, max_sessions: int = None):
+        """
+        初始化会话存储
+
+        参数:
+            backend: 会话后端，默认按 Config.SESSION_BACKEND 创建
+            window: 每个会话保留的最近消息数，默认为 Config.SESSION_HISTORY_WINDOW
+            ttl: 会话空闲过期时间（秒），默认为 Config.SESSION_TTL
+            max_sessions: 最多保留的会话数，默认为 Config.SESSION_MAX_COUNT
+        """
+        if backend is None:
+            backend = SQLiteSessionBackend() if Config.SESSION_BACKEND == "sqlite" else InMemorySessionBackend()
+        self.backend = backend
+        self.window = window or Config.SESSION_HISTORY_WINDOW
+        self.ttl = ttl or Config.SESSION_TTL
+        self.max_sessions = max_sessions or Config.SESSION_MAX_COUNT
+        self._lock = threading.Lock()
+
+    def get_history(self, session_id: str) -> List[Dict]:
+        """
+        获取会话的最近消息，会话不存在或已过期时返回空列表
+
+        返回:
+            [{"role": "user"/"assistant", "content": 文本}, ...]
+        """
+        with self._lock:
+            session = self.backend.get(session_id)
+            if session is None:
+                return []
+            if session["last_access"] < time.time() - self.ttl:
+                self.backend.delete(session_id)
+                return []
+            return list(session["messages"])
+
+    def append(self, session_id: str, *messages: Dict):
+        """追加消息，只保留最近 window 条，并淘汰过期和超量的会话"""
+        now = time.time()
+        with self._lock:
+            session = self.backend.get(session_id)
+            history = session["messages"] if session and session["last_access"] >= now - self.ttl else []
+            for message in messages:
+                history.append({
+                    "role": message["role"],
+                    "content": message["content"][:Config.SESSION_MESSAGE_MAX_CHARS]
+                })
+            self.backend.put(session_id, history[-self.window:], now)
+            self.backend.evict(now - self.ttl, self.max_sessions)
+
+    def clear(self, session_id: str):
+        """删除会话"""
+        with self._lock:
+            self.backend.delete(session_id)
+
+    def stats(self) -> Dict[str, int]:
+        """会话统计"""
+        with self._lock:
+            return {"sessions": self.backend.count()}
@@ -0,0 +1,26 @@
+from fastapi.testclient import TestClient
+
+from app.dependencies import get_quant_system
+from app.main import app
+
+
+class FakeSystem:
+    async def analyze_query_stream(self, query, **kwargs):
+        yield "answer", {"query": query}
+
+
+def test_malformed_message_returns_error_and_keeps_connection():
+    app.dependency_overrides[get_quant_system] = lambda: FakeSystem()
+    try:
+        client = TestClient(app)
+        with client.websocket_connect("/api/v1/ws/analyze") as websocket:
+            for message in ("not json", "[1, 2]", '{"session_id": "s"}'):
+                websocket.send_text(message)
+                assert websocket.receive_json()["event"] == "error"
+                assert websocket.receive_json()["event"] == "done"
+
+            websocket.send_json({"query": "平安银行2023年营收"})
+            assert websocket.receive_json() == {"event": "answer", "data": {"query": "平安银行2023年营收"}}
+            assert websocket.receive_json()["event"] == "done"
+    finally:
+        app.dependency_overrides.clear()
@@ -0,0 +1,29 @@
+import fitz
+
+from chunker import PDFChunker
+
+
+def _chunk_text(build_page):
+    pdf = fitz.open()
+    build_page(pdf.new_page())
+    chunks = list(PDFChunker(chunk_size=500, chunk_overlap=0, detect_tables=False).chunk(pdf))
+    return "\n".join(chunk["content"] for chunk in chunks)
+
+
+def test_bare_number_body_block_is_kept():
+    def build(page):
+        page.insert_text((72, 300), "营业收入（万元）", fontname="china-s")
+        page.insert_text((72, 400), "2023")
+        page.insert_text((72, 500), "2022-2023")
+
+    text = _chunk_text(build)
+    assert "2023" in text.splitlines()
+    assert "2022-2023" in text.splitlines()
+
+
+def test_page_number_in_footer_is_dropped():
+    def build(page):
+        page.insert_text((72, 300), "营业收入（万元）", fontname="china-s")
+        page.insert_text((290, page.rect.height - 20), "12")
+
+    assert _chunk_text(build).splitlines() == ["营业收入（万元）"]
@@ -0,0 +1,46 @@
+import json
+
+import httpx
+
+from config import Config
+from data_collection.qa_crawler import QACrawler
+
+FEED_PAGE = """
+<div class="m_feed_item">
+  <div class="m_feed_txt">{question}</div>
+  <div class="m_feed_reply">{answer}</div>
+</div>
+"""
+
+
+def test_second_run_refetches_feed_pages(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "JSON_DIR", str(tmp_path / "jsons"))
+    monkeypatch.setattr(Config, "CRAWL_STATE_DIR", str(tmp_path / "crawl_state"))
+    requests = []
+
+    def handler(request):
+        # 与上证e互动一致：不返回 ETag / Last-Modified，列表内容随新问答变化
+        requests.append(request)
+        body = FEED_PAGE.format(question=f"问题{len(requests)}", answer="回答")
+        return httpx.Response(200, text=body)
+
+    crawler = QACrawler(base_url="http://feed.test/ajax/feeds.do", transport=httpx.MockTransport(handler))
+    crawler.run(max_pages=1)
+    second = crawler.run(max_pages=1)
+
+    assert len(requests) == 2
+    assert second == [{"question": "问题2", "answer": "回答"}]
+
+
+def test_existing_page_file_is_refetched(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "JSON_DIR", str(tmp_path / "jsons"))
+    monkeypatch.setattr(Config, "CRAWL_STATE_DIR", str(tmp_path / "crawl_state"))
+    (tmp_path / "jsons").mkdir()
+    # 旧版爬虫留下的问答页
+    (tmp_path / "jsons" / "qa_page_1.json").write_text(json.dumps([{"question": "旧问题", "answer": "旧回答"}]))
+    page = FEED_PAGE.format(question="新问题", answer="新回答")
+    transport = httpx.MockTransport(lambda request: httpx.Response(200, text=page))
+
+    assert QACrawler(base_url="http://feed.test/ajax/feeds.do", transport=transport).run(max_pages=1) == [
+        {"question": "新问题", "answer": "新回答"}
+    ]
@@ -2,18 +2,35 @@ import faiss
 import numpy as np
 import requests
 import json
-from typing import List, Dict, Any
+from typing import List, Dict, Any, FrozenSet, Tuple
 from tqdm import tqdm
 from config import Config
+import os
 import time
-import ollama
+import threading
+import asyncio
+import contextvars
+from llm_client import LLMBusyError, get_llm_client
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from tqdm import tqdm
+from embedding_cache import EmbeddingCache
+from doc_store import DocStore
+from lexical_index import LexicalIndex, reciprocal_rank_fusion
+from metadata_index import MetadataIndex
+from dedup import NearDuplicateIndex, duplicate_entry
+from metrics import record_cache, timed
 class OllamaEmbedder:
     """使用 Ollama API 生成嵌入向量"""
 
-    def __init__(self, model_name: str = "qwen3:4b"):
+    def __init__(self, model_name: str = "qwen3:4b", batch_size: int = None,
+                 max_workers: int = None, max_retries: int = None, cache: EmbeddingCache = None):
         self.model_name = model_name
+        if cache is None and Config.EMBED_CACHE_ENABLED:
+            cache = EmbeddingCache()
+        self.cache = cache
+        self.batch_size = batch_size or Config.EMBED_BATCH_SIZE
+        self.max_workers = max_workers or Config.EMBED_MAX_WORKERS
+        self.max_retries = Config.EMBED_MAX_RETRIES if max_retries is None else max_retries
+        self.llm = get_llm_client()
         self.dimension = self._get_embedding_dimension()
 
     def _get_embedding_dimension(self) -> int:
@@ -22,22 +39,284 @@ class OllamaEmbedder:
         embedding = self.get_embedding(test_text)
         return len(embedding)
 
-    def get_embedding(self, text: str):
-        if type(text)==dict:
+    @staticmethod
+    def _prepare_text(text) -> str:
+        """将输入统一为字符串"""
+        if type(text) == dict:
             text = json.dumps(text)
-        r = ollama.embeddings(model=self.model_name, prompt=text)
-        return r['embedding']
+        return text
+
+    def _embed_batch(self, texts: List[str], priority: str = "embedding") -> List[List[float]]:
+        """
+        通过 embed 接口一次请求嵌入一批文本，失败时按指数退避重试
+
+        参数:
+            texts: 待嵌入文本
+            priority: 请求优先级，查询嵌入为 interactive，入库嵌入为 embedding
+
+        返回的向量顺序与输入顺序一致
+        """
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            try:
+                r = self.llm.embed(priority, model=self.model_name, input=texts)
+                embeddings = r['embeddings']
+                if len(embeddings) != len(texts):
+                    raise ValueError(f"返回向量数 {len(embeddings)} 与输入文本数 {len(texts)} 不一致")
+                return embeddings
+            except LLMBusyError:
+                # 调度器排队已满或等待超时，重试只会加重拥塞，直接交给调用方
+                raise
+            except Exception as e:
+                last_error = e
+                if attempt < self.max_retries:
+                    wait = Config.EMBED_RETRY_BACKOFF * (2 ** attempt)
+                    print(f"嵌入批次失败（第 {attempt + 1} 次）: {str(e)}，{wait:.1f} 秒后重试")
+                    time.sleep(wait)
+        raise RuntimeError(f"嵌入批次在 {self.max_retries} 次重试后仍然失败: {str(last_error)}") from last_error
+
+    async def _embed_batch_async(self, texts: List[str], priority: str = "embedding") -> List[List[float]]:
+        """_embed_batch 的异步版本，等待期间不阻塞事件循环"""
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            try:
+                r = await self.llm.embed_async(priority, model=self.model_name, input=texts)
+                embeddings = r['embeddings']
+                if len(embeddings) != len(texts):
+                    raise ValueError(f"返回向量数 {len(embeddings)} 与输入文本数 {len(texts)} 不一致")
+                return embeddings
+            except LLMBusyError:
+                # 调度器排队已满或等待超时，重试只会加重拥塞，直接交给调用方
+                raise
+            except Exception as e:
+                last_error = e
+                if attempt < self.max_retries:
+                    wait = Config.EMBED_RETRY_BACKOFF * (2 ** attempt)
+                    print(f"嵌入批次失败（第 {attempt + 1} 次）: {str(e)}，{wait:.1f} 秒后重试")
+                    await asyncio.sleep(wait)
+        raise RuntimeError(f"嵌入批次在 {self.max_retries} 次重试后仍然失败: {str(last_error)}") from last_error
+
+    @timed("embedding")
+    async def get_embedding_async(self, text: str):
+        """get_embedding 的异步版本（嵌入缓存的 SQLite 读写在线程中执行，不阻塞事件循环）"""
+        text = self._prepare_text(text)
+        if self.cache is not None:
+            cached = await asyncio.to_thread(self.cache.get_many, self.model_name, [text])
+            record_cache("embedding", bool(cached))
+            if cached:
+                return cached[0]
+
+        embedding = (await self._embed_batch_async([text], priority="interactive"))[0]
+        if self.cache is not None:
+            await asyncio.to_thread(self.cache.put_many, self.model_name, [text], [embedding])
+        return embedding
+
+    @timed("embedding")
+    def get_embedding(self, text: str):
+        text = self._prepare_text(text)
+        if self.cache is not None:
+            cached = self.cache.get_many(self.model_name, [text])
+            record_cache("embedding", bool(cached))
+            if cached:
+                return cached[0]
+
+        embedding = self._embed_batch([text], priority="interactive")[0]
+        if self.cache is not None:
+            self.cache.put_many(self.model_name, [text], [embedding])
+        return embedding
+
+    @timed("embedding")
+    def get_embeddings_batch(self, texts: List[str], max_workers: int = None,
+                             priority: str = "embedding") -> List[List[float]]:
+        """
+        批量生成嵌入向量
+
+        参数:
+            texts: 待嵌入文本列表
+            max_workers: 同时在途的批次数，默认为 Config.EMBED_MAX_WORKERS
+            priority: 请求优先级，默认为入库嵌入使用的 embedding
 
-    def get_embeddings_batch(self, texts: List[str], max_workers=8) -> List[List[float]]:
-        embeddings = []
+        返回:
+            与 texts 顺序一一对应的嵌入向量列表
+        """
+        texts = [self._prepare_text(text) for text in texts]
+        embeddings = [None] * len(texts)
+        if not texts:
+            return embeddings
+
+        # 先查缓存，只对未命中的文本发起请求（相同文本只嵌入一次）
+        if self.cache is not None:
+            cached = self.cache.get_many(self.model_name, texts)
+            for i, vector in cached.items():
+                embeddings[i] = vector
+            record_cache("embedding", True, len(cached))
+            record_cache("embedding", False, len(texts) - len(cached))
+        pending = {}
+        for i, text in enumerate(texts):
+            if embeddings[i] is None:
+                pending.setdefault(text, []).append(i)
+        if not pending:
+            return embeddings
+
+        pending_texts = list(pending)
+        new_embeddings = self._embed_uncached(pending_texts, max_workers or self.max_workers, priority)
+        if self.cache is not None:
+            self.cache.put_many(self.model_name, pending_texts, new_embeddings)
+        for text, vector in zip(pending_texts, new_embeddings):
+            for i in pending[text]:
+                embeddings[i] = vector
+        return embeddings
+
+    def _embed_uncached(self, texts: List[str], max_workers: int, priority: str) -> List[List[float]]:
+        """分批并发请求嵌入接口，结果顺序与输入一致"""
+        embeddings = [None] * len(texts)
+        batches = [
+            (start, texts[start:start + self.batch_size])
+            for start in range(0, len(texts), self.batch_size)
+        ]
         with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            futures = {executor.submit(self.get_embedding, text): text for text in texts}
-            for future in tqdm(as_completed(futures), total=len(texts), desc="生成嵌入向量"):
-                embedding = future.result()
-                embeddings.append(embedding)
+            # 各批次在调用方上下文的副本中执行，嵌入请求的 token 数与排队时间计入当前请求的耗时明细
+            futures = {
+                executor.submit(contextvars.copy_context().run, self._embed_batch, batch, priority): start
+                for start, batch in batches
+            }
+            with tqdm(total=len(texts), desc="生成嵌入向量") as progress:
+                for future in as_completed(futures):
+                    start = futures[future]
+                    vectors = future.result()
+                    # 按批次起始位置回填，保证向量与文档一一对应
+                    embeddings[start:start + len(vectors)] = vectors
+                    progress.update(len(vectors))
         return embeddings
 
 
+INDEX_TYPES = ("flat", "hnsw", "ivf_flat", "ivf_pq")
+
+
+def resolve_index_type(index_type: str, n_vectors: int) -> str:
+    """
+    解析索引类型，auto 模式按语料规模选择
+
+    auto 不选择 HNSW：HNSW 不支持删除向量，增量更新时需要整体重建
+    """
+    if index_type != "auto":
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"不支持的索引类型: {index_type}")
+        return index_type
+    if n_vectors <= Config.INDEX_AUTO_FLAT_MAX:
+        return "flat"
+    if n_vectors <= Config.INDEX_AUTO_IVF_FLAT_MAX:
+        return "ivf_flat"
+    return "ivf_pq"
+
+
+def default_nlist(n_vectors: int) -> int:
+    """IVF 聚类中心数：4*sqrt(N)，并保证每个中心至少有 39 个训练样本"""
+    nlist = Config.IVF_NLIST or int(4 * np.sqrt(max(n_vectors, 1)))
+    return max(1, min(nlist, n_vectors // 39))
+
+
+def default_pq_m(dimension: int) -> int:
+    """PQ 子量化器数：取能整除维度且最接近 dim/8 的值"""
+    if Config.PQ_M:
+        return Config.PQ_M
+    candidates = [m for m in range(1, dimension // 4 + 1) if dimension % m == 0] or [1]
+    return min(candidates, key=lambda m: abs(m - dimension // 8))
+
+
+def faiss_metric(metric: str = None) -> int:
+    """将相似度度量名称转换为 FAISS 度量类型"""
+    metric = metric or Config.SIMILARITY_METRIC
+    if metric == "cosine":
+        return faiss.METRIC_INNER_PRODUCT
+    if metric == "l2":
+        return faiss.METRIC_L2
+    raise ValueError(f"不支持的相似度度量: {metric}")
+
+
+def create_faiss_index(index_type: str, dimension: int, n_vectors: int = 0, metric: str = None):
+    """
+    按类型和度量创建 FAISS 索引
+
+    flat/hnsw 外层包装 IndexIDMap2 以支持自定义 id；
+    IVF 系列原生支持 id，并开启哈希直接映射以便按 id 重建向量
+    """
+    metric_type = faiss_metric(metric)
+    if index_type == "flat":
+        return faiss.IndexIDMap2(faiss.IndexFlat(dimension, metric_type))
+    if index_type == "hnsw":
+        base = faiss.IndexHNSWFlat(dimension, Config.HNSW_M, metric_type)
+        base.hnsw.efConstruction = Config.HNSW_EF_CONSTRUCTION
+        return faiss.IndexIDMap2(base)
+
+    nlist = default_nlist(n_vectors)
+    quantizer = faiss.IndexFlat(dimension, metric_type)
+    if index_type == "ivf_flat":
+        index = faiss.IndexIVFFlat(quantizer, dimension, nlist, metric_type)
+    elif index_type == "ivf_pq":
+        # 每个子量化器的码本大小不能超过训练样本数
+        nbits = int(min(Config.PQ_NBITS, max(1, np.log2(max(n_vectors, 2)))))
+        index = faiss.IndexIVFPQ(quantizer, dimension, nlist, default_pq_m(dimension), nbits, metric_type)
+    else:
+        raise ValueError(f"不支持的索引类型: {index_type}")
+    index.set_direct_map_type(faiss.DirectMap.Hashtable)
+    return index
+
+
+def infer_index_type(index) -> str:
+    """根据 FAISS 索引对象推断索引类型"""
+    base = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+    if isinstance(base, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(base, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(base, faiss.IndexIVF):
+        return "ivf_flat"
+    return "flat"
+
+
+def train_faiss_index(index, vectors: np.ndarray):
+    """在采样向量上训练索引（无需训练的索引直接返回）"""
+    if index.is_trained:
+        return
+    sample_size = min(len(vectors), max(Config.INDEX_TRAIN_SAMPLE, 39 * index.nlist))
+    if sample_size < len(vectors):
+        rng = np.random.default_rng(0)
+        vectors = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+    print(f"训练索引，样本数: {len(vectors)}")
+    index.train(vectors)
+
+
+def export_vectors(index):
+    """
+    导出索引中全部 (id, 向量)
+
+    IVF-PQ 为有损压缩，导出的是重建后的近似向量
+    """
+    if index.ntotal == 0:
+        return np.empty(0, dtype='int64'), np.empty((0, index.d), dtype='float32')
+    if isinstance(index, faiss.IndexIDMap):
+        ids = faiss.vector_to_array(index.id_map).astype('int64')
+        return ids, faiss.downcast_index(index.index).reconstruct_n(0, index.ntotal)
+
+    invlists = index.invlists
+    ids = np.concatenate([
+        faiss.rev_swig_ptr(invlists.get_ids(list_no), invlists.list_size(list_no)).copy()
+        for list_no in range(index.nlist) if invlists.list_size(list_no) > 0
+    ]).astype('int64')
+    return ids, index.reconstruct_batch(ids)
+
+
+def search_parameters(index, nprobe: int = None, ef_search: int = None, sel=None):
+    """构造查询期参数（nprobe / efSearch / id 过滤器），不修改索引本身的状态"""
+    index_type = infer_index_type(index)
+    if index_type == "hnsw":
+        return faiss.SearchParametersHNSW(efSearch=ef_search or Config.HNSW_EF_SEARCH, sel=sel)
+    if index_type in ("ivf_flat", "ivf_pq"):
+        return faiss.SearchParametersIVF(nprobe=nprobe or Config.IVF_NPROBE, sel=sel)
+    return faiss.SearchParameters(sel=sel) if sel is not None else None
+
+
 class VectorStore:
     """使用 Ollama 嵌入模型的向量存储"""
 
@@ -45,93 +324,599 @@ class VectorStore:
         self.embedder = OllamaEmbedder(embed_model)
         self.dimension = self.embedder.dimension
         self.index = None
-        self.documents = []
-        self.metadata = []
+        self.index_type = None
+        self.metric = Config.SIMILARITY_METRIC
+        # 以稳定的向量 id 为键，支持增量增删
+        self.doc_store = DocStore()
+        # 与向量索引共用 id 的 BM25 倒排索引，关闭混合检索时为 None
+        self.lexical_index = LexicalIndex() if Config.HYBRID_SEARCH else None
+        # 过滤字段取值 -> 文档 id
+        self.metadata_index = MetadataIndex()
+        # 入库时检测近似重复分块的 MinHash 签名，关闭去重时为 None
+        self.dedup_index = NearDuplicateIndex() if Config.DEDUP_ENABLED else None
+        self.dedup_stats = {"checked": 0, "merged": 0}
+        self._lexical_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="lexical")
+        # 以 mmap 只读方式加载的索引在写入前需重新加载为可写
+        self._index_path = None
+        self._index_mmapped = False
+        # 需要训练的索引在样本足够前暂存的 (向量, id)
+        self._pending = []
+        # 保护索引的增删与检索，嵌入生成不在锁内
+        self._lock = threading.RLock()
+
+    def create_index(self, expected_size: int = None):
+        """
+        创建或重置 FAISS 索引
 
-    def create_index(self):
-        """创建或重置 FAISS 索引"""
+        参数:
+            expected_size: 预计向量数；auto 模式下未知规模时推迟到首次写入索引时再决定类型
+        """
         if self.index is not None:
             print("重置现有索引")
-        self.index = faiss.IndexFlatL2(self.dimension)
-        print(f"创建新索引，维度: {self.dimension}")
+        with self._lock:
+            self.index = None
+            self.index_type = None
+            self.doc_store = DocStore()
+            self.lexical_index = LexicalIndex() if Config.HYBRID_SEARCH else None
+            self.metadata_index = MetadataIndex()
+            self.dedup_index = NearDuplicateIndex() if Config.DEDUP_ENABLED else None
+            self.dedup_stats = {"checked": 0, "merged": 0}
+            self._index_mmapped = False
+            self._pending = []
+            if Config.INDEX_TYPE != "auto" or expected_size is not None:
+                self._init_index(resolve_index_type(Config.INDEX_TYPE, expected_size or 0), expected_size or 0)
+
+    def _init_index(self, index_type: str, n_vectors: int):
+        """实例化指定类型的索引"""
+        self.index_type = index_type
+        self.index = create_faiss_index(index_type, self.dimension, n_vectors, self.metric)
+        print(f"创建新索引，类型: {index_type}，度量: {self.metric}，维度: {self.dimension}")
+
+    def __len__(self) -> int:
+        return len(self.doc_store)
+
+    def _ensure_writable(self):
+        """mmap 加载的索引为只读，写入前重新完整加载到内存"""
+        if self._index_mmapped:
+            self.index = faiss.read_index(self._index_path)
+            self._index_mmapped = False
 
-    def add_documents(self, docs: List[str], metadatas: List[Dict] = None):
-        """添加文档到向量存储"""
+    def _prepare_vectors(self, embeddings) -> np.ndarray:
+        """转换为 float32 矩阵，cosine 度量下做 L2 归一化"""
+        vectors = np.ascontiguousarray(np.array(embeddings, dtype='float32'))
+        if self.metric == "cosine":
+            faiss.normalize_L2(vectors)
+        return vectors
+
+    def add_documents(self, docs: List[str], metadatas: List[Dict] = None) -> List[int]:
+        """
+        添加文档到向量存储
+
+        开启去重时，与已有文档或同批靠前文档近似重复的文档不再嵌入和存储，
+        其元数据登记到保留文档的 duplicate_sources 中
+
+        返回:
+            为每个文档分配的向量 id，顺序与 docs 一致；重复文档返回保留文档的 id
+        """
         if metadatas is None:
             metadatas = [{}] * len(docs)
 
         if len(docs) != len(metadatas):
             raise ValueError("文档和元数据数量必须一致")
+        if not docs:
+            return []
+
+        if self.dedup_index is not None:
+            signatures = [self.dedup_index.signature(doc) for doc in docs]
+            with self._lock:
+                decisions = self.dedup_index.deduplicate(signatures)
+        else:
+            signatures = None
+            decisions = [("new", i) for i in range(len(docs))]
+        unique = [i for kind, i in decisions if kind == "new"]
+
+        # 生成嵌入向量（只嵌入不重复的文档）
+        embeddings = self.embedder.get_embeddings_batch([docs[i] for i in unique]) if unique else []
 
-        # 生成嵌入向量
-        embeddings = self.embedder.get_embeddings_batch(docs)
-        embeddings_np = np.array(embeddings).astype('float32')
+        # 分配稳定 id 并添加到索引
+        with self._lock:
+            self._ensure_writable()
+            start_id = self.doc_store.next_id
+            new_ids = dict(zip(unique, range(start_id, start_id + len(unique))))
+            if unique:
+                self._add_vectors(self._prepare_vectors(embeddings), np.array(list(new_ids.values()), dtype='int64'))
+                for i, doc_id in new_ids.items():
+                    self.doc_store.add(doc_id, docs[i], metadatas[i])
+                self.metadata_index.add_many((doc_id, metadatas[i]) for i, doc_id in new_ids.items())
+                if signatures is not None:
+                    for i, doc_id in new_ids.items():
+                        self.dedup_index.add(doc_id, signatures[i])
+
+            ids = []
+            duplicates = {}
+            for i, (kind, target) in enumerate(decisions):
+                doc_id = target if kind == "existing" else new_ids[target]
+                ids.append(doc_id)
+                if kind != "new":
+                    duplicates.setdefault(doc_id, []).append(metadatas[i])
+            self._merge_duplicates(duplicates)
+            if signatures is not None:
+                self.dedup_stats["checked"] += len(docs)
+                self.dedup_stats["merged"] += len(docs) - len(unique)
+        if self.lexical_index is not None and unique:
+            self.lexical_index.add_many((doc_id, docs[i]) for i, doc_id in new_ids.items())
+        merged = f"（合并近似重复 {len(docs) - len(unique)} 个）" if len(unique) < len(docs) else ""
+        print(f"添加 {len(unique)} 个文档{merged}，总文档数: {len(self.doc_store)}")
+        return ids
+
+    def _merge_duplicates(self, duplicates: Dict[int, List[Dict]]):
+        """把重复文档的元数据登记到保留文档的 duplicate_sources（调用方需持有锁）"""
+        for doc_id, entries in duplicates.items():
+            if doc_id not in self.doc_store:
+                continue
+            metadata = self.doc_store.get_metadata(doc_id)
+            sources = list(metadata.get("duplicate_sources", []))
+            known = {metadata.get("source")} | {entry.get("source") for entry in sources}
+            for entry in entries:
+                # 每个来源只登记一次，同一文件内的重复不登记
+                if entry.get("source") not in known:
+                    sources.append(duplicate_entry(entry))
+                    known.add(entry.get("source"))
+            if len(sources) != len(metadata.get("duplicate_sources", [])):
+                self._update_metadata(doc_id, metadata, {**metadata, "duplicate_sources": sources})
+
+    def _update_metadata(self, doc_id: int, old: Dict, new: Dict):
+        """替换文档元数据并同步过滤索引（调用方需持有锁）"""
+        self.metadata_index.remove_many([(doc_id, old)])
+        self.doc_store.update_metadata(doc_id, new)
+        self.metadata_index.add_many([(doc_id, new)])
+
+    def detach_source(self, ids: List[int], source: str) -> List[int]:
+        """
+        解除来源文件与文档的关联（文件删除或变更时调用）
+
+        文档由该文件持有且没有其他来源时返回其 id，由调用方删除；
+        由该文件持有但合并了其他来源的重复分块时，改由第一个重复来源持有；
+        该文件只是重复来源时，从 duplicate_sources 中移除
+
+        返回:
+            需要删除的文档 id
+        """
+        removable = []
+        with self._lock:
+            for doc_id in dict.fromkeys(ids):
+                if doc_id not in self.doc_store:
+                    continue
+                metadata = self.doc_store.get_metadata(doc_id)
+                sources = metadata.get("duplicate_sources", [])
+                if metadata.get("source") == source:
+                    if not sources:
+                        removable.append(doc_id)
+                        continue
+                    promoted = dict(sources[0])
+                    if len(sources) > 1:
+                        promoted["duplicate_sources"] = sources[1:]
+                    self._update_metadata(doc_id, metadata, promoted)
+                else:
+                    remaining = [entry for entry in sources if entry.get("source") != source]
+                    if len(remaining) != len(sources):
+                        updated = {key: value for key, value in metadata.items() if key != "duplicate_sources"}
+                        if remaining:
+                            updated["duplicate_sources"] = remaining
+                        self._update_metadata(doc_id, metadata, updated)
+        return removable
+
+    def _add_vectors(self, vectors: np.ndarray, ids: np.ndarray):
+        """写入向量；索引尚未确定类型或未训练时先暂存，样本足够后统一训练写入"""
+        if self.index is not None and self.index.is_trained:
+            self.index.add_with_ids(vectors, ids)
+            return
+
+        self._pending.append((vectors, ids))
+        pending_count = sum(len(part) for part, _ in self._pending)
+        # 类型未定时攒到超过 flat 阈值即可确定类型，已定类型时攒够训练样本即可
+        threshold = Config.INDEX_TRAIN_SAMPLE if self.index is not None else Config.INDEX_AUTO_FLAT_MAX + 1
+        if pending_count >= threshold:
+            self._flush_pending()
+
+    def _flush_pending(self):
+        """确定索引类型、完成训练并写入暂存向量"""
+        if not self._pending:
+            return
+        vectors = np.vstack([part for part, _ in self._pending])
+        ids = np.concatenate([part for _, part in self._pending])
+        self._pending = []
 
-        # 初始化索引（如果尚未创建）
         if self.index is None:
-            self.create_index()
+            self._init_index(resolve_index_type(Config.INDEX_TYPE, len(vectors)), len(vectors))
+        elif not self.index.is_trained and self.index.ntotal == 0:
+            # 按实际样本数重新确定聚类中心数，避免样本少于中心数
+            self.index = create_faiss_index(self.index_type, self.dimension, len(vectors), self.metric)
+        train_faiss_index(self.index, vectors)
+        self.index.add_with_ids(vectors, ids)
+
+    def remove_ids(self, ids: List[int]) -> int:
+        """
+        按 id 删除向量及对应文档
+
+        返回:
+            实际删除的文档数
+        """
+        with self._lock:
+            ids = [doc_id for doc_id in dict.fromkeys(ids) if doc_id in self.doc_store]
+            if not ids:
+                return 0
+
+            self._ensure_writable()
+            self._flush_pending()
+            if self.index_type == "hnsw":
+                # HNSW 不支持删除，用剩余向量重建
+                all_ids, vectors = export_vectors(self.index)
+                keep = ~np.isin(all_ids, ids)
+                self._init_index("hnsw", int(keep.sum()))
+                self.index.add_with_ids(vectors[keep], all_ids[keep])
+            else:
+                self.index.remove_ids(np.array(ids, dtype='int64'))
+            self.metadata_index.remove_many((doc_id, self.doc_store.get_metadata(doc_id)) for doc_id in ids)
+            for doc_id in ids:
+                self.doc_store.remove(doc_id)
+            if self.dedup_index is not None:
+                self.dedup_index.remove(ids)
+            if self.lexical_index is not None:
+                self.lexical_index.remove(ids)
+        print(f"删除 {len(ids)} 个文档，总文档数: {len(self.doc_store)}")
+        return len(ids)
 
-        # 添加到索引
-        self.index.add(embeddings_np)
-        self.documents.extend(docs)
-        self.metadata.extend(metadatas)
-        print(f"添加 {len(docs)} 个文档，总文档数: {len(self.documents)}")
+    def rebuild_index(self, index_type: str):
+        """用现有向量重建为指定类型的索引（IVF-PQ 源索引会带入量化误差）"""
+        with self._lock:
+            self._ensure_writable()
+            self._flush_pending()
+            if self.index is None:
+                return
+            ids, vectors = export_vectors(self.index)
+            self._init_index(index_type, len(vectors))
+            if len(vectors):
+                train_faiss_index(self.index, vectors)
+                self.index.add_with_ids(vectors, ids)
 
-    def search(self, query: str, k: int = 5) -> List[Dict]:
-        """语义搜索"""
-        if self.index is None or len(self.documents) == 0:
+    def optimize_index(self):
+        """auto 模式下语料规模跨过阈值时升级索引类型（只升级不降级，避免在阈值附近反复重建）"""
+        if Config.INDEX_TYPE != "auto" or self.index_type is None:
+            return
+        target = resolve_index_type("auto", len(self.doc_store))
+        if INDEX_TYPES.index(target) > INDEX_TYPES.index(self.index_type):
+            print(f"语料规模已达 {len(self.doc_store)}，索引由 {self.index_type} 升级为 {target}")
+            self.rebuild_index(target)
+
+    @timed("retrieval")
+    def search(self, query: str, k: int = 5, nprobe: int = None, ef_search: int = None,
+               filters: Dict[str, Any] = None) -> List[Dict]:
+        """
+        语义搜索
+
+        参数:
+            query: 查询文本
+            k: 返回结果数
+            nprobe: IVF 索引查询的聚类数，默认为 Config.IVF_NPROBE
+            ef_search: HNSW 索引查询的候选队列长度，默认为 Config.HNSW_EF_SEARCH
+            filters: 元数据过滤条件，如 {"stock_code": "000001", "report_year": [2022, 2023]}，
+                     字段之间为且，同一字段的多个取值为或；只在满足条件的向量中检索
+
+        返回:
+            结果列表；cosine 度量下 score 为 [-1, 1] 的余弦相似度，
+            distance 为单位向量间的平方欧氏距离 (2 - 2*score)；l2 度量下 score 为 None。
+            开启混合检索时按 RRF 融合排序，另附 bm25 与 rrf_score 字段，
+            仅由词法检索命中的结果 score 和 distance 为 None
+        """
+        if len(self.doc_store) == 0:
+            return []
+        selected = self._select(filters)
+        if selected is not None and not len(selected):
             return []
 
-        # 获取查询嵌入
-        query_embed = self.embedder.get_embedding(query)
-        query_embed_np = np.array([query_embed]).astype('float32')
+        if self.lexical_index is None:
+            # 获取查询嵌入
+            query_embed = self.embedder.get_embedding(query)
+            return self._search_vector(query_embed, k, nprobe, ef_search, selected)
 
-        # 执行搜索
-        distances, indices = self.index.search(query_embed_np, k,)
+        # 词法检索在后台线程执行，与查询嵌入的网络请求和向量检索重叠
+        n_candidates = max(k, Config.HYBRID_CANDIDATES)
+        lexical = self._lexical_executor.submit(self.lexical_index.search, query, n_candidates, selected)
+        dense_hits = self._dense_hits(self.embedder.get_embedding(query), n_candidates, nprobe, ef_search, selected)
+        return self._fuse(dense_hits, lexical.result(), k)
 
-        # 构建结果
-        results = []
-        for i, idx in enumerate(indices[0]):
-            if idx < 0:  # FAISS 可能返回 -1
-                continue
+    @timed("retrieval")
+    async def search_async(self, query: str, k: int = 5, nprobe: int = None, ef_search: int = None,
+                           filters: Dict[str, Any] = None) -> List[Dict]:
+        """search 的异步版本：异步生成查询嵌入，FAISS 检索与 BM25 检索放到线程池并行执行"""
+        if len(self.doc_store) == 0:
+            return []
+        selected = self._select(filters)
+        if selected is not None and not len(selected):
+            return []
+
+        if self.lexical_index is None:
+            query_embed = await self.embedder.get_embedding_async(query)
+            return await asyncio.to_thread(self._search_vector, query_embed, k, nprobe, ef_search, selected)
+
+        async def dense():
+            query_embed = await self.embedder.get_embedding_async(query)
+            return await asyncio.to_thread(self._dense_hits, query_embed, n_candidates, nprobe, ef_search, selected)
+
+        n_candidates = max(k, Config.HYBRID_CANDIDATES)
+        dense_hits, lexical_hits = await asyncio.gather(
+            dense(), asyncio.to_thread(self.lexical_index.search, query, n_candidates, selected)
+        )
+        return self._fuse(dense_hits, lexical_hits, k)
+
+    @timed("retrieval")
+    def search_batch(self, queries: List[str], k: int = 5, nprobe: int = None, ef_search: int = None,
+                     filters: Dict[str, Any] = None, priority: str = "interactive") -> List[List[Dict]]:
+        """
+        批量语义搜索：所有查询一次批量嵌入，FAISS 以查询矩阵检索一次
+
+        参数:
+            queries: 查询文本列表
+            priority: 查询嵌入请求的优先级
+            其余参数与 search 相同，过滤条件对所有查询生效
 
-            results.append({
-                "content": self.documents[idx],
-                "metadata": self.metadata[idx],
-                "distance": float(distances[0][i])
-            })
+        返回:
+            与 queries 顺序一一对应的结果列表，每项格式与 search 相同
+        """
+        if not queries or len(self.doc_store) == 0:
+            return [[] for _ in queries]
+        selected = self._select(filters)
+        if selected is not None and not len(selected):
+            return [[] for _ in queries]
 
+        n_candidates = k if self.lexical_index is None else max(k, Config.HYBRID_CANDIDATES)
+        lexical = None
+        if self.lexical_index is not None:
+            lexical = [self._lexical_executor.submit(self.lexical_index.search, query, n_candidates, selected)
+                       for query in queries]
+        query_embeds = self.embedder.get_embeddings_batch(queries, priority=priority)
+        dense_hits = self._dense_hits_batch(query_embeds, n_candidates, nprobe, ef_search, selected)
+
+        if lexical is None:
+            with self._lock:
+                return [[self._result(doc_id, **self._score(value)) for doc_id, value in hits
+                         if doc_id in self.doc_store] for hits in dense_hits]
+        return [self._fuse(hits, future.result(), k) for hits, future in zip(dense_hits, lexical)]
+
+    def documents(self, filters: Dict[str, Any] = None) -> List[Dict]:
+        """取出满足过滤条件的全部文档 [{"id", "content", "metadata"}]，filters 为空时返回全部文档"""
+        with self._lock:
+            selected = self.metadata_index.select(filters)
+            ids = self.doc_store.ids() if selected is None else selected.tolist()
+            return [self._result(int(doc_id)) for doc_id in ids]
+
+    def mentioned_entities(self, text: str) -> FrozenSet[Tuple[str, str]]:
+        """文本中提到的、知识库中已有的公司名称与股票代码 {(字段, 取值)}"""
+        with self._lock:
+            return self.metadata_index.mentions(text)
+
+    def _select(self, filters: Dict[str, Any] = None):
+        """按过滤条件取出候选 id，无过滤条件时返回 None"""
+        with self._lock:
+            return self.metadata_index.select(filters)
+
+    def _dense_hits(self, query_embed: List[float], k: int, nprobe: int = None,
+                    ef_search: int = None, selected: np.ndarray = None) -> List[tuple]:
+        """用单个查询向量检索索引，返回 [(doc_id, FAISS 返回值), ...]"""
+        return self._dense_hits_batch([query_embed], k, nprobe, ef_search, selected)[0]
+
+    @timed("faiss")
+    def _dense_hits_batch(self, query_embeds: List[List[float]], k: int, nprobe: int = None,
+                          ef_search: int = None, selected: np.ndarray = None) -> List[List[tuple]]:
+        """
+        用一组查询向量做一次矩阵检索，每个查询返回 [(doc_id, FAISS 返回值), ...]
+
+        selected 为过滤后的候选 id：候选较少时直接对这些向量精确计算，
+        否则通过 IDSelector 让 FAISS 在检索过程中跳过其余向量
+        """
+        query_embed_np = self._prepare_vectors(query_embeds)
+
+        with self._lock:
+            self._flush_pending()
+            if selected is not None and len(selected) <= Config.FILTER_EXACT_MAX:
+                return self._exact_hits(query_embed_np, k, selected)
+
+            # 执行搜索
+            sel = faiss.IDSelectorBatch(selected) if selected is not None else None
+            params = search_parameters(self.index, nprobe, ef_search, sel)
+            distances, indices = self.index.search(query_embed_np, k, params=params)
+
+        # FAISS 可能返回 -1
+        return [
+            [(int(idx), float(distances[row][i])) for i, idx in enumerate(indices[row]) if idx >= 0]
+            for row in range(len(indices))
+        ]
+
+    def _exact_hits(self, query_vectors: np.ndarray, k: int, selected: np.ndarray) -> List[List[tuple]]:
+        """只对候选 id 对应的向量做精确检索（调用方需持有锁），返回值与 FAISS 度量一致"""
+        vectors = self.index.reconstruct_batch(selected)
+        if self.metric == "cosine":
+            values = query_vectors @ vectors.T
+            orders = np.argsort(-values, axis=1)[:, :k]
+        else:
+            # |q - v|^2 = |q|^2 - 2 q·v + |v|^2，避免构造 查询数 x 候选数 x 维度 的中间数组
+            values = ((query_vectors ** 2).sum(axis=1)[:, None] - 2 * query_vectors @ vectors.T
+                      + (vectors ** 2).sum(axis=1)[None, :])
+            values = np.maximum(values, 0)
+            orders = np.argsort(values, axis=1)[:, :k]
+        return [
+            [(int(selected[i]), float(values[row][i])) for i in order]
+            for row, order in enumerate(orders)
+        ]
+
+    def _search_vector(self, query_embed: List[float], k: int, nprobe: int = None,
+                       ef_search: int = None, selected: np.ndarray = None) -> List[Dict]:
+        """用查询向量检索索引并组装结果"""
+        hits = self._dense_hits(query_embed, k, nprobe, ef_search, selected)
+        with self._lock:
+            return [self._result(doc_id, **self._score(value)) for doc_id, value in hits
+                    if doc_id in self.doc_store]
+
+    def _fuse(self, dense_hits: List[tuple], lexical_hits: List[tuple], k: int) -> List[Dict]:
+        """按倒数排名融合两路检索结果，只解码最终入选的文档"""
+        dense = dict(dense_hits)
+        lexical = dict(lexical_hits)
+        fused = reciprocal_rank_fusion([[doc_id for doc_id, _ in dense_hits],
+                                        [doc_id for doc_id, _ in lexical_hits]])
+
+        results = []
+        with self._lock:
+            for doc_id in sorted(fused, key=fused.get, reverse=True):
+                # 检索与删除并发时，候选可能已被删除
+                if doc_id not in self.doc_store:
+                    continue
+                score = self._score(dense[doc_id]) if doc_id in dense else {"score": None, "distance": None}
+                results.append(self._result(doc_id, bm25=lexical.get(doc_id), rrf_score=fused[doc_id], **score))
+                if len(results) == k:
+                    break
         return results
 
+    def _result(self, doc_id: int, **fields) -> Dict:
+        """组装单条检索结果（调用方需持有锁）"""
+        result = {
+            "id": doc_id,
+            "content": self.doc_store.get_content(doc_id),
+            "metadata": self.doc_store.get_metadata(doc_id),
+        }
+        result.update(fields)
+        return result
+
+    def _score(self, value: float) -> Dict:
+        """将 FAISS 返回值转换为相似度分数与距离"""
+        if self.metric == "cosine":
+            score = min(1.0, max(-1.0, value))
+            return {"score": score, "distance": 2.0 - 2.0 * score}
+        return {"score": None, "distance": value}
+
     def save_index(self, file_path: str):
-        """保存 FAISS 索引到文件"""
-        if self.index is None:
-            raise ValueError("索引未初始化")
+        """保存 FAISS 索引和文档存储到文件"""
+        with self._lock:
+            self._flush_pending()
+            if self.index is None:
+                if Config.INDEX_TYPE == "auto" and len(self.doc_store) == 0:
+                    self._init_index("flat", 0)
+                else:
+                    raise ValueError("索引未初始化")
 
-        faiss.write_index(self.index, file_path)
-        print(f"索引已保存到 {file_path}")
+            # mmap 加载且未修改的索引无需重写
+            if not (self._index_mmapped and self._index_path == file_path):
+                # 先写临时文件再原子替换，其他进程已 mmap 的旧文件不受影响
+                tmp_path = f"{file_path}.tmp"
+                faiss.write_index(self.index, tmp_path)
+                os.replace(tmp_path, file_path)
+                print(f"索引已保存到 {file_path}")
 
-        # 保存文档和元数据
-        data_file = file_path.replace(".faiss", ".json")
-        with open(data_file, "w") as f:
-            json.dump({
-                "content": self.documents,
-                "metadata": self.metadata
-            }, f)
-        print(f"文档元数据已保存到 {data_file}")
+            # 保存文档和元数据
+            data_file = file_path.replace(".faiss", ".docs")
+            self.doc_store.save(data_file)
+            if self.lexical_index is not None:
+                self.lexical_index.save(file_path.replace(".faiss", ".lex"))
+            self.metadata_index.save(file_path.replace(".faiss", ".filters.npz"))
+            if self.dedup_index is not None:
+                self.dedup_index.save(file_path.replace(".faiss", ".minhash.npz"))
+        print(f"文档存储已保存到 {data_file}")
 
     def load_index(self, file_path: str):
-        """从文件加载 FAISS 索引"""
-        self.index = faiss.read_index(file_path)
+        """从文件加载 FAISS 索引，Config.INDEX_MMAP 为真时以 mmap 方式只读加载"""
+        self._index_path = file_path
+        self._index_mmapped = False
+        if Config.INDEX_MMAP:
+            try:
+                self.index = faiss.read_index(file_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+                self._index_mmapped = True
+            except RuntimeError:
+                # 部分索引类型不支持 mmap，退回普通加载
+                self.index = faiss.read_index(file_path)
+        else:
+            self.index = faiss.read_index(file_path)
         print(f"索引已从 {file_path} 加载")
 
+        # 旧版索引按位置编号，包装为 IndexIDMap2 后 id 与原位置一致
+        if isinstance(self.index, faiss.IndexFlat):
+            self._ensure_writable()
+            self.index = self._wrap_with_ids(self.index)
+        self.index_type = infer_index_type(self.index)
+        self._pending = []
+        migrated = self._migrate_metric()
+
         # 加载文档和元数据
-        data_file = file_path.replace(".faiss", ".json")
-        try:
-            with open(data_file, "r") as f:
+        data_file = file_path.replace(".faiss", ".docs")
+        legacy_file = file_path.replace(".faiss", ".json")
+        if os.path.exists(data_file):
+            self.doc_store = DocStore.open(data_file)
+            print(f"加载 {len(self.doc_store)} 个文档")
+        elif os.path.exists(legacy_file):
+            # 旧版 JSON 文档文件，迁移为二进制文档存储
+            with open(legacy_file, "r") as f:
                 data = json.load(f)
-                self.documents = data["content"]
-                self.metadata = data["metadata"]
-            print(f"加载 {len(self.documents)} 个文档")
-        except FileNotFoundError:
-            print(f"警告: 未找到文档元数据文件 {data_file}")
\ No newline at end of file
+            ids = data.get("ids", list(range(len(data["content"]))))
+            next_id = data.get("next_id", max(ids, default=-1) + 1)
+            self.doc_store = DocStore.from_lists(ids, data["content"], data["metadata"], next_id)
+            print(f"加载 {len(self.doc_store)} 个文档，已从 {legacy_file} 迁移为二进制文档存储")
+            migrated = True
+        else:
+            print(f"警告: 未找到文档存储文件 {data_file}")
+
+        filters_file = file_path.replace(".faiss", ".filters.npz")
+        if os.path.exists(filters_file):
+            self.metadata_index = MetadataIndex.load(filters_file)
+        else:
+            # 旧版向量库没有过滤索引，按已存元数据补建
+            self.metadata_index = MetadataIndex.build(self.doc_store.iter_metadata())
+            migrated = True
+
+        if Config.HYBRID_SEARCH:
+            lexical_file = file_path.replace(".faiss", ".lex")
+            if os.path.exists(lexical_file):
+                self.lexical_index = LexicalIndex.open(lexical_file)
+            else:
+                # 旧版向量库没有倒排索引，按已存文档补建
+                self.lexical_index = LexicalIndex.build(
+                    (doc_id, self.doc_store.get_content(doc_id)) for doc_id in self.doc_store.ids()
+                )
+                print(f"已为 {len(self.lexical_index)} 个文档补建 BM25 倒排索引")
+                migrated = True
+
+        if Config.DEDUP_ENABLED:
+            dedup_file = file_path.replace(".faiss", ".minhash.npz")
+            self.dedup_index = NearDuplicateIndex.load(dedup_file) if os.path.exists(dedup_file) else None
+            if self.dedup_index is None:
+                # 旧版向量库没有签名文件（或签名参数已变化），按已存文档补建
+                self.dedup_index = NearDuplicateIndex.build(
+                    (doc_id, self.doc_store.get_content(doc_id)) for doc_id in self.doc_store.ids()
+                )
+                print(f"已为 {len(self.dedup_index)} 个文档补建近似重复检测签名")
+                migrated = True
+
+        if migrated:
+            self.save_index(file_path)
+
+    def _migrate_metric(self) -> bool:
+        """索引度量与配置不一致时，用已存向量按配置的度量重建索引"""
+        if self.index.metric_type == faiss_metric(self.metric):
+            return False
+
+        self._ensure_writable()
+        ids, vectors = export_vectors(self.index)
+        vectors = self._prepare_vectors(vectors)
+        self._init_index(self.index_type, len(vectors))
+        if len(vectors):
+            train_faiss_index(self.index, vectors)
+            self.index.add_with_ids(vectors, ids)
+        print(f"索引已迁移为 {self.metric} 度量，共 {len(vectors)} 条向量")
+        return True
+
+    def _wrap_with_ids(self, index) -> faiss.IndexIDMap2:
+        """将按位置编号的旧版扁平索引迁移为 IndexIDMap2"""
+        vectors = index.reconstruct_n(0, index.ntotal) if index.ntotal else None
+        wrapped = faiss.IndexIDMap2(faiss.IndexFlatL2(index.d))
+        if vectors is not None:
+            wrapped.add_with_ids(vectors, np.arange(index.ntotal, dtype='int64'))
+        print(f"旧版索引已迁移为 IndexIDMap2，共 {index.ntotal} 条向量")
+        return wrapped